@@ -0,0 +1,312 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Benchmark import Synthetic
+from Connector.Bitmex import Bitmex
+from Connector.Client import Client
+from Connector.Kucoin import Kucoin
+from Connector.Metrics import Metrics
+from Connector.OrderBook import BitmexOrderBook, KucoinOrderBook
+from Database.Database import Database
+from Database.Storage import COLUMNS
+from Strategies.FibonacciRetracement import FibonacciRetracement
+from Strategies.HeikinAshi import HeikinAshi
+from Strategies.Performance import Performance
+from Strategies.Portfolio import Portfolio
+from Utility import Timestamp
+from Utility.Utility import resample_dataframe
+
+# Offline benchmarks of the hot paths on seeded synthetic data, e.g.
+#   python -m Benchmark.Benchmark --rows 10000 1000000 --output before.json
+#   python -m Benchmark.Benchmark --rows 10000 1000000 --output after.json --compare before.json
+
+# Message replays and page parsing are capped, their cost per row doesn't change with the size of the data
+MAX_MESSAGES = 1000000
+# The portfolio benchmarks split the rows over this many symbols
+PORTFOLIO_SYMBOLS = 100
+
+class SyntheticClient(Client):
+    # Serves pages of synthetic candles through the regular paging and streaming code of Client, nothing goes over the network
+    granularities = { "1m": 60 }
+
+    def __init__(self, candles:pd.DataFrame):
+        self._dates = candles.index.to_numpy(dtype=np.int64)
+        self._values = candles[COLUMNS].to_numpy(dtype=np.float64)
+        super().__init__("Synthetic", "http://localhost", "http://localhost", None, None, "", "", cache_path=None)
+
+    def _get_instruments(self):
+        return { "SYN": { "symbol": "SYN", "tick_size": 0.01, "lot_size": 1.0, "min_size": 1.0, "quote_currency": "USD" } }
+
+    def get_historical_data(self, symbol:str, start=None, end=None, granularity="1m", candle_count=1000, workers=4, stream=False):
+        end = int(Timestamp.to_epoch([end])[0]) if end is not None else int(self._dates[-1])
+        start = int(Timestamp.to_epoch([start])[0]) if start is not None else end - self.granularities[granularity] * (candle_count - 1)
+
+        if stream:
+            return self._stream_candles(symbol, start, end, granularity, candle_count, workers)
+        return self._download_candles(symbol, start, end, granularity, candle_count, workers)
+
+    def _get_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int):
+        first = np.searchsorted(self._dates, start, side="left")
+        last = min(np.searchsorted(self._dates, end, side="right"), first + candle_count)
+        return self._dates[first:last], self._values[first:last]
+
+def measure(name:str, rows:int, function, repeat:int, setup=None) -> typing.Dict:
+    # Runs setup (not timed) and function(setup's result) `repeat` times, the best run is the least noisy number
+    times = []
+
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    result = { "name": name, "rows": rows, "repeat": repeat, "best": best, "median": statistics.median(times), "mean": statistics.mean(times),
+               "rows_per_second": rows / best if best > 0 else float("inf") }
+    print("{:<32} {:>10} rows  best {:>10.4f}s  median {:>10.4f}s  {:>14,.0f} rows/s".format(name, rows, best, result["median"], result["rows_per_second"]))
+    return result
+
+@contextlib.contextmanager
+def _quiet():
+    # The clients and Database print progress for every page
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _memory(result:typing.Dict, dataframe:pd.DataFrame) -> typing.Dict:
+    # Bytes per million candles of the frame a run returned, index included
+    result["bytes_per_million_rows"] = float(dataframe.memory_usage(index=True, deep=True).sum()) * 1000000 / max(1, dataframe.shape[0])
+    print("{:<32} {:>10} rows  {:>14,.0f} bytes per million rows".format(result["name"], result["rows"], result["bytes_per_million_rows"]))
+    return result
+
+def _replay_client(client_class, pages:typing.List):
+    # Client whose requests return the given responses in a loop, for timing the response parsing alone
+    client = client_class.__new__(client_class)
+    client.metrics = Metrics(enabled=False)
+    responses = itertools.cycle(pages)
+    client._request = lambda *args, **kwargs: next(responses)
+    return client
+
+def benchmark_database(candles:pd.DataFrame, repeat:int) -> typing.List[typing.Dict]:
+    rows = candles.shape[0]
+    path = tempfile.mkdtemp(prefix="benchmark_") + os.sep
+    results = []
+
+    try:
+        with _quiet():
+            client = SyntheticClient(candles)
+        database = Database(path)
+        name = client.name + "_SYN"
+        start, end = int(candles.index[0]), int(candles.index[-1])
+
+        def add_data(_):
+            with _quiet():
+                database.add_data(client, "SYN", start=start, end=end)
+
+        results.append(measure("database_add_data", rows, add_data, repeat, setup=lambda: database.storage.delete(name)))
+        # The stored candles already cover the range, nothing is downloaded
+        results.append(measure("database_add_data_up_to_date", rows, add_data, repeat))
+        results.append(_memory(measure("database_get_data", rows, lambda _: database.get_data(client.name, "SYN"), repeat), database.get_data(client.name, "SYN")))
+        compact = dict(dtype=np.float32, volume_scale=1)
+        results.append(_memory(measure("database_get_data_compact", rows, lambda _: database.get_data(client.name, "SYN", **compact), repeat),
+                               database.get_data(client.name, "SYN", **compact)))
+        # The load for a strategy run, only the columns the strategy reads
+        for strategy_name, strategy_class in (("fibonacci", FibonacciRetracement), ("heikin_ashi", HeikinAshi)):
+            load = dict(columns=strategy_class.columns, dtype=np.float32)
+            results.append(_memory(measure("database_get_data_" + strategy_name, rows, lambda _: database.get_data(client.name, "SYN", **load), repeat),
+                                   database.get_data(client.name, "SYN", **load)))
+
+        # The frame a strategy leaves behind, every float64 column widened with the intermediate columns, or the
+        # strategy's float32 columns with the intermediate series kept on the strategy (the default)
+        def heikin_ashi(compact_mode:bool) -> pd.DataFrame:
+            load = dict(columns=HeikinAshi.columns, dtype=np.float32) if compact_mode else dict()
+            strategy = HeikinAshi(database.get_data(client.name, "SYN", **load), keep_intermediate=not compact_mode)
+            strategy.backtest()
+            return strategy.dataframe
+
+        results.append(_memory(measure("database_heikin_ashi", rows, lambda _: heikin_ashi(False), repeat), heikin_ashi(False)))
+        results.append(_memory(measure("database_heikin_ashi_compact", rows, lambda _: heikin_ashi(True), repeat), heikin_ashi(True)))
+
+        def delete_cache():
+            database.storage.delete(name + ".1h")
+
+        results.append(measure("database_get_data_1h_cold", rows, lambda _: database.get_data(client.name, "SYN", "1h"), repeat, setup=delete_cache))
+        results.append(measure("database_get_data_1h_cached", rows, lambda _: database.get_data(client.name, "SYN", "1h"), repeat))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    return results
+
+def benchmark_resample(candles:pd.DataFrame, repeat:int) -> typing.List[typing.Dict]:
+    candles = Timestamp.ensure_datetime_index(candles)
+    return [measure("resample_dataframe_1h", candles.shape[0], lambda _: resample_dataframe(candles, "1h"), repeat)]
+
+def benchmark_strategies(candles:pd.DataFrame, repeat:int) -> typing.List[typing.Dict]:
+    rows = candles.shape[0]
+    candles = Timestamp.ensure_datetime_index(candles)
+    copy = lambda: candles.copy()
+
+    results = [
+        measure("fibonacci_backtest", rows, lambda dataframe: FibonacciRetracement(dataframe).backtest(), repeat, setup=copy),
+        measure("fibonacci_backtest_lookback", rows, lambda dataframe: FibonacciRetracement(dataframe, lookback=500).backtest(), repeat, setup=copy),
+        measure("heikin_ashi_backtest", rows, lambda dataframe: HeikinAshi(dataframe).backtest(), repeat, setup=copy)
+    ]
+
+    # Repeated runs (e.g. an optimizer sweep) reusing the arrays of the previous run
+    for name, strategy_class, params in (("fibonacci_lookback_buffers", FibonacciRetracement, dict(lookback=500)), ("heikin_ashi_backtest_buffers", HeikinAshi, dict())):
+        buffers = dict()
+        results.append(measure(name, rows, lambda dataframe: strategy_class(dataframe, buffers=buffers, **params).backtest(), repeat, setup=copy))
+
+    # Heikin Ashi flips often, so it has the most trades to list
+    strategy = HeikinAshi(candles.copy(), keep_intermediate=False)
+    strategy.backtest()
+    results.append(measure("performance_metrics", rows, lambda _: Performance.from_strategy(strategy).metrics(), repeat))
+    return results
+
+def benchmark_portfolio(rows:int, seed:int, repeat:int) -> typing.List[typing.Dict]:
+    # The same candles backtested as one Portfolio and as one strategy plus Performance per symbol
+    count = max(2, rows // PORTFOLIO_SYMBOLS)
+    candles = { "SYN{}".format(i): Timestamp.ensure_datetime_index(Synthetic.generate_candles(count, seed=seed + i)) for i in range(PORTFOLIO_SYMBOLS) }
+    total = count * PORTFOLIO_SYMBOLS
+    results = []
+
+    for name, strategy_class in (("heikin_ashi", HeikinAshi), ("fibonacci", FibonacciRetracement)):
+        def per_symbol(_):
+            for dataframe in candles.values():
+                strategy = strategy_class(dataframe.copy())
+                strategy.backtest()
+                Performance.from_strategy(strategy)
+
+        results.append(measure("portfolio_{}_per_symbol".format(name), total, per_symbol, repeat))
+        results.append(measure("portfolio_{}".format(name), total, lambda _: Portfolio(strategy_class, candles).backtest(), repeat))
+
+    return results
+
+def benchmark_candle_parsing(candles:pd.DataFrame, repeat:int) -> typing.List[typing.Dict]:
+    # Pages of 1000 candles, the same ten pages are parsed over and over
+    page_size = 1000
+    pages = [candles.iloc[i:i + page_size] for i in range(0, min(candles.shape[0], 10 * page_size), page_size)]
+    count = max(1, min(candles.shape[0], MAX_MESSAGES) // page_size)
+    results = []
+
+    for name, client_class, granularity, formatter in (("bitmex_candle_parsing", Bitmex, "1m", Synthetic.bitmex_candle_page),
+                                                       ("kucoin_candle_parsing", Kucoin, "1min", Synthetic.kucoin_candle_page)):
+        client = _replay_client(client_class, [formatter(page) for page in pages])
+
+        def parse(_):
+            for _ in range(count):
+                client._get_candles("SYN", 0, 0, granularity, page_size)
+
+        results.append(measure(name, count * page_size, parse, repeat))
+
+    return results
+
+def benchmark_order_books(rows:int, seed:int, repeat:int) -> typing.List[typing.Dict]:
+    count = min(rows, MAX_MESSAGES)
+    messages = Synthetic.bitmex_order_book_messages(count, seed=seed)
+
+    def apply_bitmex(book:BitmexOrderBook):
+        for message in messages:
+            book.apply(message)
+
+    results = [measure("bitmex_order_book_updates", len(messages), apply_bitmex, repeat, setup=lambda: BitmexOrderBook("XBTUSD"))]
+    del messages
+
+    snapshot, messages = Synthetic.kucoin_level2_messages(count, seed=seed)
+
+    def apply_kucoin(book:KucoinOrderBook):
+        for message in messages:
+            book.apply(message)
+
+    results.append(measure("kucoin_order_book_updates", len(messages), apply_kucoin, repeat, setup=lambda: KucoinOrderBook("BTC-USDT", snapshot=lambda: snapshot, threaded=False)))
+    return results
+
+BENCHMARKS = ["database", "resample", "strategies", "portfolio", "candle_parsing", "order_books"]
+
+def run(rows:typing.List[int], repeat=3, seed=0, only:typing.Union[typing.List[str], None]=None) -> typing.List[typing.Dict]:
+    only = only or BENCHMARKS
+    results = []
+
+    for count in rows:
+        candles = Synthetic.generate_candles(count, seed=seed)
+
+        if "database" in only:
+            results += benchmark_database(candles, repeat)
+        if "resample" in only:
+            results += benchmark_resample(candles, repeat)
+        if "strategies" in only:
+            results += benchmark_strategies(candles, repeat)
+        if "candle_parsing" in only:
+            results += benchmark_candle_parsing(candles, repeat)
+        del candles
+
+        if "portfolio" in only:
+            results += benchmark_portfolio(count, seed, repeat)
+        if "order_books" in only:
+            results += benchmark_order_books(count, seed, repeat)
+
+    return results
+
+def environment() -> typing.Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return { "commit": commit, "time": Timestamp.now(), "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+             "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count() }
+
+def compare(results:typing.List[typing.Dict], baseline:typing.List[typing.Dict], threshold=0.1) -> typing.List[typing.Dict]:
+    # Ratio of the best times against a previous run, above 1 + threshold is reported as a regression
+    baseline = { (result["name"], result["rows"]): result["best"] for result in baseline }
+    comparison = []
+
+    for result in results:
+        old = baseline.get((result["name"], result["rows"]))
+        if old is None or old == 0:
+            continue
+
+        ratio = result["best"] / old
+        comparison.append({ "name": result["name"], "rows": result["rows"], "ratio": ratio, "regression": ratio > 1 + threshold })
+        print("{:<32} {:>10} rows  {:>6.2f}x {}".format(result["name"], result["rows"], ratio, "REGRESSION" if ratio > 1 + threshold else ""))
+
+    return comparison
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmarks on seeded synthetic market data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000], help="Candles per run, 10k to 50M")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS)
+    parser.add_argument("--output", default="benchmark.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown reported as a regression by --compare")
+    arguments = parser.parse_args(arguments)
+
+    output = { "environment": environment(), "seed": arguments.seed, "results": run(arguments.rows, arguments.repeat, arguments.seed, arguments.only) }
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as file:
+            output["comparison"] = compare(output["results"], json.load(file)["results"], arguments.threshold)
+
+    with open(arguments.output, "w") as file:
+        json.dump(output, file, indent=2)
+
+    print("Results written to {}.".format(arguments.output))
+    return 1 if any(entry["regression"] for entry in output.get("comparison", [])) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
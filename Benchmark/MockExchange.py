@@ -0,0 +1,591 @@
+import base64
+import hashlib
+import itertools
+import json
+import math
+import random
+import struct
+import threading
+import time
+import typing
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from Benchmark import Synthetic
+from Connector.Bitmex import Bitmex
+from Connector.Kucoin import Kucoin
+from Utility.Utility import resample_candles
+
+# Local stand-in for the BitMEX and KuCoin endpoints the connectors use, REST and websocket, on one port.
+# Latency, rate limits and errors are configurable and seeded, so downloads and order round trips can be load tested offline:
+#
+#   exchange = MockExchange(latency=0.02, rate_limit=(120, 60)).start()
+#   bitmex = Bitmex("key", "secret", url=exchange.url, websocket_url=exchange.websocket_url + "/realtime")
+#   kucoin = Kucoin("key", "secret", "phrase", url=exchange.url)
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def load_recording(path:str) -> typing.List[typing.Tuple[str, typing.Dict]]:
+    # Recorded websocket messages, one {"channel": ..., "message": ...} JSON object per line
+    with open(path) as file:
+        return [(entry["channel"], entry["message"]) for entry in map(json.loads, file) if entry]
+
+def save_recording(path:str, messages:typing.Iterable[typing.Tuple[str, typing.Dict]]):
+    with open(path, "w") as file:
+        for channel, message in messages:
+            file.write(json.dumps({ "channel": channel, "message": message }) + "\n")
+
+class _TokenBucket:
+    # Server side rate limit, a request without a token gets a 429 instead of waiting
+    def __init__(self, capacity:int, window:float):
+        self.capacity = capacity
+        self.window = window
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def take(self) -> typing.Tuple[bool, int, float, float]:
+        # (allowed, tokens remaining, seconds until the bucket is full again, seconds until the next token)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.capacity / self.window)
+        self._updated = now
+        allowed = self.tokens >= 1
+
+        if allowed:
+            self.tokens -= 1
+        return allowed, int(self.tokens), (self.capacity - self.tokens) * self.window / self.capacity, max(0.0, 1 - self.tokens) * self.window / self.capacity
+
+class _WebsocketConnection:
+    # Server side of one websocket (RFC 6455) on the request's socket, text frames only
+    def __init__(self, handler:BaseHTTPRequestHandler):
+        self.handler = handler
+        self.channels = set()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = (message if isinstance(message, str) else json.dumps(message)).encode()
+        self._send_frame(0x1, data)
+
+    def _send_frame(self, opcode:int, data:bytes):
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x80 | opcode, len(data))
+        elif len(data) < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, len(data))
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, len(data))
+
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.handler.wfile.write(header + data)
+                self.handler.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def receive(self) -> typing.Union[str, None]:
+        # Next text message, None once the client closed the connection
+        while not self.closed:
+            try:
+                first, second = struct.unpack("!BB", self._read(2))
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", self._read(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self._read(8))[0]
+
+                mask = self._read(4) if second & 0x80 else b"\0\0\0\0"
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self._read(length)))
+            except (OSError, EOFError, struct.error):
+                self.closed = True
+                break
+
+            opcode = first & 0x0F
+            if opcode == 0x8:
+                self._send_frame(0x8, payload[:2])
+                self.closed = True
+            elif opcode == 0x9:
+                self._send_frame(0xA, payload)
+            elif opcode == 0x1:
+                return payload.decode()
+
+        return None
+
+    def _read(self, count:int) -> bytes:
+        data = self.handler.rfile.read(count)
+        if len(data) < count:
+            raise EOFError()
+        return data
+
+class MockExchange:
+    def __init__(self, candles:typing.Union[typing.Dict[str, pd.DataFrame], None]=None, host="127.0.0.1", port=0,
+                 latency:typing.Union[float, typing.Tuple[float, float]]=0.0, rate_limit:typing.Union[typing.Tuple[int, float], None]=None,
+                 error_rate=0.0, error_status=503, seed=0, order_book_levels=500):
+        # candles: symbol -> 1 minute candles in the storage layout (e.g. Database.storage.read or recorded csv files),
+        # a day of synthetic candles for XBTUSD and BTC-USDT by default. Other granularities are resampled from them.
+        # latency: seconds added to every REST response, or a (low, high) range drawn from the seeded generator.
+        # rate_limit: (requests, window seconds) per exchange, answered with the exchange's headers and 429s.
+        # error_rate: fraction of REST requests answered with error_status.
+        if candles is None:
+            candles = { symbol: Synthetic.generate_candles(1440, seed=seed) for symbol in ("XBTUSD", "BTC-USDT") }
+
+        self.candles = candles
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.order_book_levels = order_book_levels
+
+        self.orders = dict()
+        self.positions = dict()
+        self.requests = 0
+        self.connections = []
+        # Message sent to a connection when it subscribes to the channel, e.g. the orderBookL2 partial
+        self.snapshots = dict()
+
+        self._random = random.Random(seed)
+        self._seed = seed
+        self._buckets = dict()
+        self._resampled = dict()
+        self._order_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), type("Handler", (_RequestHandler,), { "exchange": self }))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def websocket_url(self) -> str:
+        return "ws" + self.url[4:]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockExchange", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        for connection in list(self.connections):
+            connection._send_frame(0x8, struct.pack("!H", 1001))
+            connection.closed = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def publish(self, channel:str, message:typing.Dict) -> int:
+        # Sends the message to every connection subscribed to the channel, returns how many got it
+        sent = 0
+        for connection in list(self.connections):
+            if channel in connection.channels and not connection.closed:
+                connection.send(message)
+                sent += 1
+        return sent
+
+    def replay(self, messages:typing.Iterable[typing.Tuple[str, typing.Dict]], interval=0.0) -> threading.Thread:
+        # Publishes recorded (channel, message) pairs in the background, `interval` seconds apart
+        def run():
+            for channel, message in messages:
+                self.publish(channel, message)
+                if interval > 0:
+                    time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="MockExchangeReplay", daemon=True)
+        thread.start()
+        return thread
+
+    def disconnect(self):
+        # Drops every websocket connection, for testing reconnects
+        for connection in list(self.connections):
+            connection._send_frame(0x8, struct.pack("!H", 1001))
+            connection.closed = True
+            try:
+                connection.handler.connection.shutdown(2)
+            except OSError:
+                pass
+
+    def _delay(self):
+        with self._lock:
+            latency = self._random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def _inject_error(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _take_token(self, exchange:str) -> typing.Union[typing.Tuple[bool, int, float, float], None]:
+        if self.rate_limit is None:
+            return None
+        with self._lock:
+            if exchange not in self._buckets:
+                self._buckets[exchange] = _TokenBucket(*self.rate_limit)
+            return self._buckets[exchange].take()
+
+    def _candles(self, symbol:str, seconds:int) -> typing.Union[pd.DataFrame, None]:
+        candles = self.candles.get(symbol)
+        if candles is None or seconds == 60:
+            return candles
+
+        with self._lock:
+            if (symbol, seconds) not in self._resampled:
+                self._resampled[(symbol, seconds)] = resample_candles(candles, seconds)
+            return self._resampled[(symbol, seconds)]
+
+    def _order_book_partial(self, symbol:str) -> typing.Dict:
+        message = Synthetic.bitmex_order_book_messages(1, seed=self._seed, levels=self.order_book_levels)[0]
+        for row in message["data"]:
+            row["symbol"] = symbol
+        return dict(message, filter={ "symbol": symbol })
+
+    # BitMEX
+
+    def bitmex_candles(self, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        seconds = Bitmex.granularities.get(params.get("binSize", "1m"))
+        candles = self._candles(params.get("symbol", ""), seconds) if seconds is not None else None
+        if candles is None:
+            return 400, { "error": { "message": "Invalid symbol or binSize", "name": "HTTPError" } }
+
+        dates = candles.index.to_numpy(dtype=np.int64)
+        start = int(datetime.fromisoformat(params["startTime"]).timestamp()) if "startTime" in params else int(dates[0])
+        end = int(datetime.fromisoformat(params["endTime"]).timestamp()) if "endTime" in params else int(dates[-1])
+        count = min(int(params.get("count", 100)), 1000)
+
+        first = np.searchsorted(dates, start, side="left")
+        last = min(np.searchsorted(dates, end, side="right"), first + count)
+        return 200, Synthetic.bitmex_candle_page(candles.iloc[first:last], symbol=params["symbol"])
+
+    def _new_order(self, params:typing.Dict) -> typing.Dict:
+        # Limit orders rest until they're canceled, market orders fill right away at the last close
+        order = {
+            "orderID": "{:08x}-0000-0000-0000-{:012x}".format(self._seed, next(self._order_ids)),
+            "account": 0, "symbol": params.get("symbol"), "side": params.get("side"), "orderQty": float(params.get("orderQty", 0)),
+            "price": float(params["price"]) if "price" in params else None, "ordType": params.get("ordType", "Limit"),
+            "timeInForce": params.get("timeInForce", "GoodTillCancel"),
+            "ordStatus": "Filled" if params.get("ordType") == "Market" else "New",
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        }
+        order["workingIndicator"] = order["ordStatus"] == "New"
+
+        with self._lock:
+            self.orders[order["orderID"]] = order
+        self._publish_order("insert", order)
+
+        if order["ordStatus"] == "Filled":
+            self._fill(order)
+        return order
+
+    def _fill(self, order:typing.Dict):
+        candles = self.candles.get(order["symbol"])
+        price = float(candles["close"].iloc[-1]) if candles is not None else 0.0
+        quantity = order["orderQty"] if order["side"] == "Buy" else -order["orderQty"]
+        order.update(cumQty=order["orderQty"], avgPx=price)
+
+        execution = { "execID": order["orderID"], "orderID": order["orderID"], "symbol": order["symbol"], "side": order["side"],
+                      "lastQty": order["orderQty"], "lastPx": price, "execType": "Trade", "timestamp": order["timestamp"] }
+        with self._lock:
+            position = self.positions.setdefault(order["symbol"], { "symbol": order["symbol"], "currentQty": 0.0, "avgEntryPrice": None })
+            position["currentQty"] += quantity
+            position["avgEntryPrice"] = price
+
+        self.publish("execution", { "table": "execution", "action": "insert", "data": [execution] })
+        self.publish("position", { "table": "position", "action": "update", "data": [dict(position)] })
+
+    def bitmex_place_order(self, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        return 200, self._new_order(params)
+
+    def bitmex_place_orders(self, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        return 200, [self._new_order(order) for order in json.loads(params.get("orders", "[]"))]
+
+    def bitmex_amend_orders(self, params:typing.Dict, bulk:bool) -> typing.Tuple[int, typing.Any]:
+        amendments = json.loads(params.get("orders", "[]")) if bulk else [params]
+        amended = []
+
+        with self._lock:
+            for amendment in amendments:
+                order = self.orders.get(amendment.get("orderID"))
+                if order is None or order["ordStatus"] != "New":
+                    amended.append({ "orderID": amendment.get("orderID"), "error": "Invalid ordStatus" })
+                    continue
+                for field in ("orderQty", "price"):
+                    if field in amendment:
+                        order[field] = float(amendment[field])
+                amended.append(order)
+
+        for order in amended:
+            if "error" not in order:
+                self._publish_order("update", order)
+        return 200, amended if bulk else amended[0]
+
+    def bitmex_cancel_orders(self, params:typing.Dict, all_orders:bool) -> typing.Tuple[int, typing.Any]:
+        with self._lock:
+            if all_orders:
+                ids = [order_id for order_id, order in self.orders.items() if order["ordStatus"] == "New"]
+            else:
+                ids = params.get("orderID", [])
+                ids = json.loads(ids) if isinstance(ids, str) and ids.startswith("[") else [ids] if isinstance(ids, str) else ids
+
+            canceled = []
+            for order_id in ids:
+                order = self.orders.get(order_id)
+                if order is None:
+                    canceled.append({ "orderID": order_id, "error": "Not Found" })
+                    continue
+                if order["ordStatus"] == "New":
+                    order.update(ordStatus="Canceled", workingIndicator=False)
+                canceled.append(order)
+
+        for order in canceled:
+            if "error" not in order:
+                self._publish_order("update", order)
+        return 200, canceled
+
+    def bitmex_orders(self, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        filters = json.loads(params["filter"]) if "filter" in params else dict()
+        with self._lock:
+            orders = list(self.orders.values())
+
+        if filters.get("open"):
+            orders = [order for order in orders if order["ordStatus"] == "New"]
+        if "symbol" in params:
+            orders = [order for order in orders if order["symbol"] == params["symbol"]]
+        return 200, orders
+
+    def _private_partial(self, table:str, symbol:str) -> typing.Dict:
+        # Open orders and positions, executions only stream new ones
+        with self._lock:
+            if table == "order":
+                rows = [dict(order) for order in self.orders.values() if order["ordStatus"] == "New"]
+            elif table == "position":
+                rows = [dict(position) for position in self.positions.values()]
+            else:
+                rows = []
+        rows = [row for row in rows if not symbol or row["symbol"] == symbol]
+        return { "table": table, "action": "partial", "data": rows }
+
+    def _publish_order(self, action:str, order:typing.Dict):
+        message = { "table": "order", "action": action, "data": [order] }
+        self.publish("order", message)
+        self.publish("order:" + order["symbol"], message)
+
+    # KuCoin
+
+    def kucoin_candles(self, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        seconds = Kucoin.granularities.get(params.get("type", "1min"))
+        candles = self._candles(params.get("symbol", ""), seconds) if seconds is not None else None
+        if candles is None:
+            return 200, { "code": "400100", "msg": "Invalid symbol or type" }
+
+        # [startAt, endAt), the newest 1500 candles of the range
+        dates = candles.index.to_numpy(dtype=np.int64)
+        first = np.searchsorted(dates, int(params.get("startAt", dates[0])), side="left")
+        last = np.searchsorted(dates, int(params.get("endAt", dates[-1] + 1)), side="left")
+        return 200, Synthetic.kucoin_candle_page(candles.iloc[max(first, last - 1500):last])
+
+    def kucoin_bullet(self, private:bool) -> typing.Tuple[int, typing.Any]:
+        return 200, { "code": "200000", "data": {
+            "token": "private" if private else "public",
+            "instanceServers": [{ "endpoint": self.websocket_url + "/kucoin", "protocol": "websocket", "encrypt": False, "pingInterval": 18000, "pingTimeout": 10000 }]
+        }}
+
+    def kucoin_order_book(self, params:typing.Dict, full_depth:bool) -> typing.Tuple[int, typing.Any]:
+        levels = self.order_book_levels if full_depth else min(self.order_book_levels, 100)
+        snapshot, _ = Synthetic.kucoin_level2_messages(0, seed=self._seed, levels=levels)
+        return 200, { "code": "200000", "data": dict(snapshot, time=int(time.time() * 1000)) }
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    exchange = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> typing.Dict:
+        # Query string and JSON or form body, both connectors send their parameters in the query string
+        parsed = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0:
+            body = self.rfile.read(length).decode()
+            try:
+                params.update(json.loads(body))
+            except ValueError:
+                params.update(urllib.parse.parse_qsl(body))
+        return params
+
+    def _respond(self, status:int, body, headers:typing.Union[typing.Dict, None]=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method:str):
+        exchange = self.exchange
+        path = urllib.parse.urlsplit(self.path).path
+        params = self._params()
+
+        if method == "GET" and self.headers.get("Upgrade", "").lower() == "websocket":
+            return self._websocket(path)
+
+        with exchange._lock:
+            exchange.requests += 1
+        exchange._delay()
+
+        is_kucoin = path in ("/api/v1/symbols", "/api/v1/market/candles", "/api/v1/market/orderbook/level2_100", "/api/v3/market/orderbook/level2") or path.startswith("/api/v1/bullet")
+        token = exchange._take_token("kucoin" if is_kucoin else "bitmex")
+        headers = dict()
+
+        if token is not None:
+            allowed, remaining, reset, wait = token
+            if is_kucoin:
+                headers = { "gw-ratelimit-limit": exchange.rate_limit[0], "gw-ratelimit-remaining": remaining, "gw-ratelimit-reset": int(reset * 1000) }
+            else:
+                headers = { "x-ratelimit-limit": exchange.rate_limit[0], "x-ratelimit-remaining": remaining, "x-ratelimit-reset": int(time.time() + reset) }
+
+            if not allowed:
+                if not is_kucoin:
+                    headers["retry-after"] = max(1, int(math.ceil(wait)))
+                return self._respond(429, { "error": { "message": "Rate limit exceeded", "name": "RateLimitError" } }, headers)
+
+        if exchange._inject_error():
+            return self._respond(exchange.error_status, { "error": { "message": "Injected error", "name": "HTTPError" } }, headers)
+
+        status, body = self._route(method, path, params)
+        self._respond(status, body, headers)
+
+    def _route(self, method:str, path:str, params:typing.Dict) -> typing.Tuple[int, typing.Any]:
+        exchange = self.exchange
+        routes = {
+            ("GET", "/api/v1"): lambda: (200, { "name": "MockExchange", "version": "1" }),
+            ("GET", "/api/v1/instrument/active"): lambda: (200, [{ "symbol": symbol, "state": "Open", "tickSize": 0.5, "lotSize": 100, "quoteCurrency": "USD" } for symbol in exchange.candles]),
+            ("GET", "/api/v1/trade/bucketed"): lambda: exchange.bitmex_candles(params),
+            ("GET", "/api/v1/order"): lambda: exchange.bitmex_orders(params),
+            ("POST", "/api/v1/order"): lambda: exchange.bitmex_place_order(params),
+            ("POST", "/api/v1/order/bulk"): lambda: exchange.bitmex_place_orders(params),
+            ("PUT", "/api/v1/order"): lambda: exchange.bitmex_amend_orders(params, bulk=False),
+            ("PUT", "/api/v1/order/bulk"): lambda: exchange.bitmex_amend_orders(params, bulk=True),
+            ("DELETE", "/api/v1/order"): lambda: exchange.bitmex_cancel_orders(params, all_orders=False),
+            ("DELETE", "/api/v1/order/all"): lambda: exchange.bitmex_cancel_orders(params, all_orders=True),
+            ("GET", "/api/v1/symbols"): lambda: (200, { "code": "200000", "data": [{ "symbol": symbol, "enableTrading": True, "priceIncrement": "0.1", "baseIncrement": "0.00000001", "baseMinSize": "0.00001", "quoteCurrency": "USDT" } for symbol in exchange.candles] }),
+            ("GET", "/api/v1/market/candles"): lambda: exchange.kucoin_candles(params),
+            ("GET", "/api/v1/market/orderbook/level2_100"): lambda: exchange.kucoin_order_book(params, full_depth=False),
+            ("GET", "/api/v3/market/orderbook/level2"): lambda: exchange.kucoin_order_book(params, full_depth=True),
+            ("POST", "/api/v1/bullet-public"): lambda: exchange.kucoin_bullet(private=False),
+            ("POST", "/api/v1/bullet-private"): lambda: exchange.kucoin_bullet(private=True)
+        }
+
+        route = routes.get((method, path))
+        if route is None:
+            return 404, { "error": { "message": "Not Found", "name": "HTTPError" } }
+        return route()
+
+    def _websocket(self, path:str):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        exchange = self.exchange
+        connection = _WebsocketConnection(self)
+        exchange.connections.append(connection)
+        is_kucoin = path.startswith("/kucoin")
+
+        try:
+            if is_kucoin:
+                connection.send({ "id": str(next(exchange._order_ids)), "type": "welcome" })
+            else:
+                connection.send({ "info": "Welcome to the MockExchange Realtime API.", "version": "1" })
+
+            while True:
+                raw = connection.receive()
+                if raw is None:
+                    break
+                if is_kucoin:
+                    self._kucoin_message(connection, json.loads(raw))
+                elif raw == "ping":
+                    connection.send("pong")
+                else:
+                    self._bitmex_message(connection, json.loads(raw))
+        finally:
+            connection.closed = True
+            exchange.connections.remove(connection)
+            self.close_connection = True
+
+    def _bitmex_message(self, connection:_WebsocketConnection, message:typing.Dict):
+        operation, args = message.get("op"), message.get("args", [])
+
+        if operation == "authKeyExpires":
+            connection.send({ "success": True, "request": message })
+        elif operation == "subscribe":
+            for channel in args:
+                connection.channels.add(channel)
+                connection.send({ "success": True, "subscribe": channel, "request": message })
+
+                table, _, symbol = channel.partition(":")
+                if channel in self.exchange.snapshots:
+                    connection.send(self.exchange.snapshots[channel])
+                elif table == "orderBookL2" and symbol:
+                    connection.send(self.exchange._order_book_partial(symbol))
+                elif table in ("order", "execution", "position"):
+                    connection.send(self.exchange._private_partial(table, symbol))
+        elif operation == "unsubscribe":
+            for channel in args:
+                connection.channels.discard(channel)
+                connection.send({ "success": True, "unsubscribe": channel, "request": message })
+        else:
+            connection.send({ "error": "Unknown or missing op", "request": message })
+
+    def _kucoin_message(self, connection:_WebsocketConnection, message:typing.Dict):
+        kind = message.get("type")
+
+        if kind == "ping":
+            connection.send({ "id": message.get("id"), "type": "pong" })
+        elif kind in ("subscribe", "unsubscribe"):
+            # "/market/ticker:A,B" subscribes to both symbols
+            prefix, _, symbols = message["topic"].partition(":")
+            channels = [prefix + ":" + symbol for symbol in symbols.split(",")] if symbols else [prefix]
+
+            for channel in channels:
+                if kind == "subscribe":
+                    connection.channels.add(channel)
+                else:
+                    connection.channels.discard(channel)
+            if message.get("response"):
+                connection.send({ "id": message.get("id"), "type": "ack" })
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
@@ -0,0 +1,141 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Database.Storage import COLUMNS
+
+# Seeded market data for the benchmarks, the same seed always gives the same data.
+# Candles are a geometric random walk in the storage layout (int64 epoch "date" index, float64 OHLCV columns).
+
+START = 1609459200 # 2021-01-01T00:00:00Z
+
+def iter_candles(rows:int, seed=0, start=START, interval=60, price=30000.0, volatility=0.001, gap_fraction=0.0, chunk_rows=1000000) -> typing.Iterator[pd.DataFrame]:
+    # Yields the candles in chunks so 50M rows never have to be in memory at once.
+    # gap_fraction of the candles are left out like the buckets without trades of an exchange.
+    generator = np.random.default_rng(seed)
+    date = start
+
+    for chunk_start in range(0, rows, chunk_rows):
+        count = min(chunk_rows, rows - chunk_start)
+
+        close = price * np.exp(np.cumsum(generator.normal(0, volatility, count)))
+        open = np.empty(count)
+        open[0] = price
+        open[1:] = close[:-1]
+        high = np.maximum(open, close) * (1 + np.abs(generator.normal(0, volatility / 2, count)))
+        low = np.minimum(open, close) * (1 - np.abs(generator.normal(0, volatility / 2, count)))
+        volume = np.round(generator.lognormal(10, 1, count))
+
+        dates = date + np.arange(count, dtype=np.int64) * interval
+        keep = generator.random(count) >= gap_fraction if gap_fraction > 0 else slice(None)
+
+        price = float(close[-1])
+        date = int(dates[-1]) + interval
+
+        columns = dict(zip(COLUMNS, (open[keep], high[keep], low[keep], close[keep], volume[keep])))
+        yield pd.DataFrame(columns, index=pd.Index(dates[keep], name="date"), copy=False)
+
+def generate_candles(rows:int, seed=0, **kwargs) -> pd.DataFrame:
+    return pd.concat(list(iter_candles(rows, seed=seed, **kwargs)))
+
+def generate_trades(rows:int, seed=0, start=START, price=30000.0, volatility=0.0001, trades_per_second=10.0) -> pd.DataFrame:
+    # Trades with an int64 epoch milliseconds "timestamp" index, price, size and side (1 buy, -1 sell)
+    generator = np.random.default_rng(seed)
+
+    timestamps = start * 1000 + np.cumsum(generator.exponential(1000 / trades_per_second, rows)).astype(np.int64)
+    side = np.where(generator.random(rows) < 0.5, 1.0, -1.0)
+    prices = np.round(price * np.exp(np.cumsum(generator.normal(0, volatility, rows))), 1)
+    size = np.ceil(generator.lognormal(4, 1.5, rows))
+
+    return pd.DataFrame({ "price": prices, "size": size, "side": side }, index=pd.Index(timestamps, name="timestamp"), copy=False)
+
+def bitmex_candle_page(candles:pd.DataFrame, symbol="XBTUSD") -> typing.List[typing.Dict]:
+    # The candles as /api/v1/trade/bucketed returns them
+    timestamps = pd.DatetimeIndex(candles.index.to_numpy(dtype=np.int64).view("datetime64[s]")).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    rows = candles[COLUMNS].to_numpy().tolist()
+    return [dict(zip(COLUMNS, row), timestamp=timestamp, symbol=symbol) for timestamp, row in zip(timestamps, rows)]
+
+def kucoin_candle_page(candles:pd.DataFrame) -> typing.Dict:
+    # The candles as /api/v1/market/candles returns them, [time, open, close, high, low, volume, turnover] strings newest first
+    values = candles[["open", "close", "high", "low", "volume"]].to_numpy()
+    rows = [[str(date)] + ["{:.8g}".format(value) for value in row] + ["{:.8g}".format(row[1] * row[4])] for date, row in zip(candles.index.tolist(), values.tolist())]
+    return { "code": "200000", "data": rows[::-1] }
+
+def bitmex_order_book_messages(count:int, seed=0, levels=500, tick=0.5, price=30000.0) -> typing.List[typing.Dict]:
+    # A partial of `levels` levels per side followed by orderBookL2 insert / update / delete messages of one level each
+    generator = np.random.default_rng(seed)
+    live = dict() # id -> (side, price)
+    messages = []
+
+    def row(level_id:int, side:str, level_price:float, size:int) -> typing.Dict:
+        return { "symbol": "XBTUSD", "id": level_id, "side": side, "size": size, "price": level_price }
+
+    partial = []
+    for i in range(levels):
+        for side, level_price in (("Buy", price - (i + 1) * tick), ("Sell", price + i * tick)):
+            level_id = len(live)
+            live[level_id] = (side, level_price)
+            partial.append(row(level_id, side, level_price, int(generator.integers(1, 10000))))
+    messages.append({ "table": "orderBookL2", "action": "partial", "data": partial })
+
+    ids = list(live)
+    prices = { level_price for _, level_price in live.values() }
+    next_id = len(live)
+    actions = generator.random(count)
+    sizes = generator.integers(1, 10000, count)
+
+    for i in range(count - 1):
+        if actions[i] < 0.1 and len(ids) > levels:
+            # Delete a random level (swap with the last id to keep it O(1))
+            position = int(generator.integers(len(ids)))
+            level_id = ids[position]
+            ids[position] = ids[-1]
+            ids.pop()
+            side, level_price = live.pop(level_id)
+            prices.discard(level_price)
+            messages.append({ "table": "orderBookL2", "action": "delete", "data": [{ "symbol": "XBTUSD", "id": level_id, "side": side, "price": level_price }] })
+        elif actions[i] < 0.2:
+            side = "Buy" if actions[i] < 0.15 else "Sell"
+            offset = int(generator.integers(1, 2 * levels))
+            level_price = price - offset * tick if side == "Buy" else price + (offset - 1) * tick
+            if level_price in prices:
+                continue
+            live[next_id] = (side, level_price)
+            prices.add(level_price)
+            ids.append(next_id)
+            messages.append({ "table": "orderBookL2", "action": "insert", "data": [row(next_id, side, level_price, int(sizes[i]))] })
+            next_id += 1
+        else:
+            level_id = ids[int(generator.integers(len(ids)))]
+            side, level_price = live[level_id]
+            messages.append({ "table": "orderBookL2", "action": "update", "data": [row(level_id, side, level_price, int(sizes[i]))] })
+
+    return messages
+
+def kucoin_level2_messages(count:int, seed=0, levels=500, tick=0.1, price=30000.0) -> typing.Tuple[typing.Dict, typing.List[typing.Dict]]:
+    # (snapshot data, /market/level2 messages with one change each and consecutive sequences after the snapshot)
+    generator = np.random.default_rng(seed)
+    snapshot = {
+        "sequence": "1",
+        "bids": [["{:.1f}".format(price - (i + 1) * tick), str(int(generator.integers(1, 10000)))] for i in range(levels)],
+        "asks": [["{:.1f}".format(price + i * tick), str(int(generator.integers(1, 10000)))] for i in range(levels)]
+    }
+
+    is_bid = generator.random(count) < 0.5
+    offsets = generator.integers(1, 2 * levels, count)
+    # A third of the changes remove their level
+    sizes = np.where(generator.random(count) < 0.33, 0, generator.integers(1, 10000, count))
+    messages = []
+
+    for i in range(count):
+        sequence = i + 2
+        level_price = price - offsets[i] * tick if is_bid[i] else price + (offsets[i] - 1) * tick
+        change = ["{:.1f}".format(level_price), str(int(sizes[i])), str(sequence)]
+        messages.append({
+            "type": "message", "topic": "/market/level2:BTC-USDT", "subject": "trade.l2update",
+            "data": { "sequenceStart": sequence, "sequenceEnd": sequence, "symbol": "BTC-USDT",
+                      "changes": { "bids": [change] if is_bid[i] else [], "asks": [] if is_bid[i] else [change] } }
+        })
+
+    return snapshot, messages
@@ -0,0 +1,64 @@
+from Connector.Client import Client, OrderSide, OrderType
+
+import asyncio
+import functools
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncClient:
+    # Awaitable version of a Bitmex / Kucoin client, e.g. AsyncClient(Kucoin(...)).
+    # Calls run on a worker pool sized to the client's HTTP pool, so they share its keep-alive
+    # connections and rate limiters, and many requests can be in flight on one event loop.
+    def __init__(self, client:Client, max_workers:typing.Union[int, None]=None):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or client.pool_size, thread_name_prefix=client.name)
+
+    def __getattr__(self, name:str):
+        # name, instruments, orders, ... of the wrapped client
+        return getattr(self.client, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        
+    def queue(self, channel:str, maxsize=0) -> asyncio.Queue:
+        # Messages of a websocket channel, e.g. `async for` over `await queue.get()` in a task. Call it from the event loop.
+        return self.client.start_websocket().queue(channel, maxsize)
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def place_order(self, side:OrderSide, symbol:str, contracts:float, order_type:OrderType, price=None, tif="GoodTillCancel"):
+        return await self._run(self.client.place_order, side, symbol, contracts, order_type, price, tif)
+
+    async def cancel_order(self, order_id: typing.Union[str, None]=None):
+        return await self._run(self.client.cancel_order, order_id)
+
+    async def get_orders(self, only_open_orders=True):
+        return await self._run(self.client.get_orders, only_open_orders)
+
+    async def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, **kwargs):
+        return await self._run(self.client.get_historical_data, symbol, start, end, **kwargs)
+
+    async def amend_order(self, order_id:str, contracts:typing.Union[float, None]=None, price:typing.Union[float, None]=None):
+        return await self._run(self.client.amend_order, order_id, contracts, price)
+    
+    async def place_orders(self, orders:typing.List[typing.Dict]):
+        return await self._run(self.client.place_orders, orders)
+    
+    async def amend_orders(self, amendments:typing.List[typing.Dict]):
+        return await self._run(self.client.amend_orders, amendments)
+    
+    async def cancel_orders(self, order_ids:typing.List[str]):
+        # One bulk request where the exchange has one, concurrent cancels otherwise
+        return await self._run(self.client.cancel_orders, order_ids)
+
+    async def get_historical_data_for_symbols(self, symbols:typing.List[str], start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, **kwargs):
+        candles = await asyncio.gather(*[self.get_historical_data(symbol, start, end, **kwargs) for symbol in symbols])
+        return dict(zip(symbols, candles))
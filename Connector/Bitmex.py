@@ -1,5 +1,7 @@
-from Connector.Client import Client, OrderSide, OrderType
+from Connector.Client import Client, OrderSide, OrderType, CANDLE_COLUMNS
 
+import numpy as np
+import operator
 import json
 import typing
 import requests
@@ -7,20 +9,52 @@ import time
 import hashlib
 import urllib.parse
 import hmac
-from datetime import date, datetime
+import threading
+from datetime import date, datetime, timezone
 from urllib.parse import non_hierarchical, urlencode
+from collections import deque, OrderedDict
 
-from bitmex_websocket import BitMEXWebsocket
+from Connector.OrderBook import BitmexOrderBook
+from Connector.Websocket import BitmexWebsocket
+from Utility import Timestamp
+
+# Order fields kept in Bitmex.orders and the names they're kept under
+ORDER_FIELDS = {
+    "orderID": "id", "timestamp": "timestamp", "account": "account", "symbol": "symbol", "side": "side",
+    "orderQty": "contracts", "ordType": "type", "ordStatus": "status", "price": "price", "cumQty": "filled"
+}
+CLOSED_ORDER_STATUSES = ("Filled", "Canceled", "Rejected")
+# Closed order ids remembered so late REST responses can't reopen them
+CLOSED_ORDERS_KEPT = 10000
+# Order messages kept until the cache is first loaded
+PENDING_ORDER_MESSAGES_KEPT = 10000
 
 class Bitmex(Client): 
-    def __init__(self, public_key:str, secret_key:str, use_testnet=True):
-        super().__init__("Bitmex", "https://www.bitmex.com", "https://testnet.bitmex.com", "wss://ws.bitmex.com/realtime", "wss://ws.testnet.bitmex.com/realtime", public_key, secret_key, use_testnet)
+    granularities = { "1m": 60, "5m": 300, "1h": 3600, "1d": 86400 }
+    # Every request counts against "rest", order placement and cancels also against the per second "order" limit
+    rate_limits = { "rest": (120, 60), "order": (10, 1) }
+    websocket_class = BitmexWebsocket
+    # Place and amend many orders with the /order/bulk endpoints, False sends them concurrently one by one
+    bulk_orders = True
+    
+    def __init__(self, public_key:str, secret_key:str, use_testnet=True, **kwargs):
+        # Filled from the websocket by track_orders
+        self.positions = dict()
+        self.executions = deque(maxlen=1000)
+        self._orders_lock = threading.Lock()
+        self._closed_orders = OrderedDict()
+        self._pending_orders = deque(maxlen=PENDING_ORDER_MESSAGES_KEPT)
+        super().__init__("Bitmex", "https://www.bitmex.com", "https://testnet.bitmex.com", "wss://ws.bitmex.com/realtime", "wss://ws.testnet.bitmex.com/realtime", public_key, secret_key, use_testnet, **kwargs)
         
+    def ping(self) -> bool:
         if self._request("GET", "/api/v1", None):
             print("Successfully connected to the {} API.".format(self.name))
+            return True
+        return False
         
-    def _generate_signature(self, method:str, endpoint:str, data:typing.Dict) -> str:
-        expires = int(round(time.time()) + 5)
+    def _generate_signature(self, method:str, endpoint:str, data:typing.Dict, expires=None) -> str:
+        if expires is None:
+            expires = int(round(time.time()) + 5)
         parsedURL = urllib.parse.urlparse(endpoint)
         path = parsedURL.path
         
@@ -34,44 +68,51 @@ class Bitmex(Client):
         signature = hmac.new(self._secret_key.encode(), message.encode(), hashlib.sha256).hexdigest()
         return signature
         
-    def _request(self, method:str, endpoint:str, params=None, use_headers=False):
+    def _generate_headers(self, method:str, endpoint:str, params) -> typing.Dict:
+        expires = str(int(round(time.time()) + 5))
+        signature = self._generate_signature(method=method, endpoint=endpoint, data=params or '', expires=expires)
         
-        headers = dict()
+        return {
+            "api-expires": expires,
+            "api-key": self._public_key,
+            "api-signature": signature
+        }
+    
+    def _rate_limit_classes(self, method:str, endpoint:str) -> typing.List[str]:
+        if endpoint.startswith("/api/v1/order") and method != "GET":
+            return ["rest", "order"]
+        return ["rest"]
+    
+    def _read_rate_limit_headers(self, response:requests.Response):
+        limit = response.headers.get("x-ratelimit-limit")
+        remaining = response.headers.get("x-ratelimit-remaining")
+        reset = response.headers.get("retry-after") # Seconds, only sent with a 429
         
-        if use_headers:
-            expires = str(int(round(time.time()) + 5))
-            signature = self._generate_signature(method=method, endpoint=endpoint, data=params or '')
-            headers = {
-                "api-expires": expires,
-                "api-key": self._public_key,
-                "api-signature": signature
-            }
+        if reset is not None:
+            reset = float(reset)
+        elif response.headers.get("x-ratelimit-reset") is not None: # Epoch time the bucket is full again
+            reset = max(0.0, float(response.headers["x-ratelimit-reset"]) - time.time())
         
-        response = requests.request(method=method, url=self.base_url+endpoint, params=params, headers=headers)
-            
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(response.text)
+        return (int(limit) if limit is not None else None,
+                int(remaining) if remaining is not None else None,
+                reset)
         
-        return None
-    
     def _get_instruments(self):
         super()._get_instruments()
         instruments_response = self._request("GET", "/api/v1/instrument/active", None)
-        instruments = []
         
-        if instruments_response is not None:
-            for instrument in instruments_response:
-                instruments.append(instrument["symbol"])
-        else:
-            print("Failed to collect instruments.")
-            
-        return instruments
-    
-    def place_order(self, side:OrderSide, symbol:str, contracts:float, order_type:OrderType, price=None, tif="GoodTillCancel"):
-        super().place_order(side, symbol, contracts, order_type, price, tif)
+        if instruments_response is None:
+            return None
         
+        return { instrument["symbol"]: {
+            "symbol": instrument["symbol"],
+            "tick_size": instrument.get("tickSize"),
+            "lot_size": instrument.get("lotSize"),
+            "min_size": instrument.get("lotSize"),
+            "quote_currency": instrument.get("quoteCurrency")
+        } for instrument in instruments_response }
+    
+    def _order_params(self, side:OrderSide, symbol:str, contracts:float, order_type:OrderType, price=None, tif="GoodTillCancel") -> typing.Dict:
         params = {
             "symbol": symbol.upper(),
             "side": "Buy" if side == OrderSide.BUY else "Sell",
@@ -82,48 +123,174 @@ class Bitmex(Client):
         if order_type == OrderType.LIMIT: # If a price is given, assume limit order in code and bitmex also assumes limit if price is given.
             params["price"] = float(price)
             params["timeInForce"] = tif
-             
-
+            
+        return params
+    
+    def _update_order_cache(self, orders:typing.List[typing.Dict], action="update", symbol:typing.Union[str, None]=None):
+        # self.orders holds the open orders. It's replaced on every change, never edited in place, so readers can iterate
+        # it while the websocket thread updates it. Rows from REST responses and the websocket may only carry the changed fields.
+        # A "partial" replaces the open orders (of `symbol` only when given), a "delete" closes the orders.
+        with self._orders_lock:
+            if self._orders is None and (action != "partial" or symbol is not None):
+                # Nothing loaded yet, replayed on top of the first load. A symbol's partial doesn't hold the other symbols' orders
+                self._pending_orders.append((orders, action, symbol))
+                return
+            
+            if self._orders is None:
+                # The order stream's partial is newer than every message before it
+                self._pending_orders.clear()
+            self._orders = self._apply_orders(self._orders or dict(), orders, action, symbol)
+            
+    def _apply_orders(self, open_orders:typing.Dict, orders:typing.List[typing.Dict], action="update", symbol:typing.Union[str, None]=None) -> typing.Dict:
+        # New dict of the open orders with the rows applied, called with _orders_lock held
+        if action == "partial":
+            open_orders = { order_id: order for order_id, order in open_orders.items() if symbol is not None and order.get("symbol") != symbol }
+        else:
+            open_orders = dict(open_orders)
+        
+        for order in orders:
+            if "orderID" not in order or "error" in order:
+                continue
+            
+            order_id = order["orderID"]
+            fields = { name: order[field] for field, name in ORDER_FIELDS.items() if field in order }
+            cached = open_orders.get(order_id)
+            
+            if action == "partial":
+                # The partial is the exchange's current state
+                self._closed_orders.pop(order_id, None)
+            elif order_id in self._closed_orders:
+                # A REST response that arrived after the websocket closed the order
+                continue
+            elif cached is not None and "timestamp" in fields and cached.get("timestamp") is not None and fields["timestamp"] < cached["timestamp"]:
+                # Older than the cached row (BitMEX timestamps are ISO strings, they sort by time)
+                continue
+            
+            if action == "delete" or fields.get("status") in CLOSED_ORDER_STATUSES:
+                open_orders.pop(order_id, None)
+                self._closed_orders[order_id] = True
+                if len(self._closed_orders) > CLOSED_ORDERS_KEPT:
+                    self._closed_orders.popitem(last=False)
+            elif cached is not None:
+                open_orders[order_id] = dict(cached, **fields)
+            elif "symbol" in fields:
+                open_orders[order_id] = fields
+        
+        return open_orders
+    
+    def _load_orders(self):
+        # The REST snapshot is applied like a partial of the order stream, then the messages that arrived before
+        # it finished are replayed on top. An order stream partial that got there first is newer, the snapshot is dropped.
+        rows = self._get_order_rows()
+        
+        with self._orders_lock:
+            if self._orders is not None:
+                return
+            
+            open_orders = self._apply_orders(dict(), rows or [], action="partial")
+            for orders, action, symbol in self._pending_orders:
+                open_orders = self._apply_orders(open_orders, orders, action, symbol)
+            self._pending_orders.clear()
+            self._orders = open_orders
+    
+    def place_order(self, side:OrderSide, symbol:str, contracts:float, order_type:OrderType, price=None, tif="GoodTillCancel"):
+        super().place_order(side, symbol, contracts, order_type, price, tif)
+        
         endpoint = '/api/v1/order'
-        order = self._request("POST", endpoint, params, use_headers=True)
+        order = self._request("POST", endpoint, self._order_params(side, symbol, contracts, order_type, price, tif), use_headers=True)
         
         if order is not None:
-            order_dict = dict()
-            order_dict["id"] = order["orderID"]
-            order_dict["timestamp"] = order["timestamp"]
-            order_dict["account"] = order["account"]
-            order_dict["symbol"] = order["symbol"]
-            order_dict["side"] = order["side"]
-            order_dict["contracts"] = order["orderQty"]
-            order_dict["type"] = order["ordType"]
-            order_dict["status"] = order["ordStatus"]
-            self.orders[order["orderID"]] = order_dict
+            self._update_order_cache([order])
         else:
             print("Failed to place order.")
         
         return order
+    
+    def place_orders(self, orders:typing.List[typing.Dict]):
+        # orders: place_order's arguments as dicts, e.g. a ladder of limit orders. One request with the bulk endpoint.
+        if not self.bulk_orders:
+            return super().place_orders(orders)
+        
+        params = { "orders": json.dumps([self._order_params(**order) for order in orders]) }
+        response = self._request("POST", "/api/v1/order/bulk", params, use_headers=True)
+        
+        if response is not None:
+            self._update_order_cache(response)
+        else:
+            print("Failed to place orders.")
+            
+        return response
+    
+    def amend_order(self, order_id:str, contracts:typing.Union[float, None]=None, price:typing.Union[float, None]=None):
+        params = { "orderID": order_id }
+        if contracts is not None:
+            params["orderQty"] = contracts
+        if price is not None:
+            params["price"] = float(price)
+            
+        order = self._request("PUT", "/api/v1/order", params, use_headers=True)
+        
+        if order is not None:
+            self._update_order_cache([order])
+        else:
+            print("Failed to amend order.")
+            
+        return order
+    
+    def amend_orders(self, amendments:typing.List[typing.Dict]):
+        # amendments: amend_order's arguments as dicts, one request with the bulk endpoint
+        if not self.bulk_orders:
+            return super().amend_orders(amendments)
+        
+        orders = []
+        for amendment in amendments:
+            order = { "orderID": amendment["order_id"] }
+            if amendment.get("contracts") is not None:
+                order["orderQty"] = amendment["contracts"]
+            if amendment.get("price") is not None:
+                order["price"] = float(amendment["price"])
+            orders.append(order)
+        
+        response = self._request("PUT", "/api/v1/order/bulk", { "orders": json.dumps(orders) }, use_headers=True)
+        
+        if response is not None:
+            self._update_order_cache(response)
+        else:
+            print("Failed to amend orders.")
+            
+        return response
 
     def cancel_order(self, order_id: typing.Union[str, None]=None):
         super().cancel_order(order_id)
         if order_id is not None:
             endpoint = "/api/v1/order"
+            params = { "orderID" : order_id }
         else:
             endpoint = "/api/v1/order/all"
-        
-        params = dict()
-        params = { "orderID" : order_id }
+            params = None
             
         response = self._request("DELETE", endpoint, params, use_headers=True)
         
         if response is not None:
-            self.orders.pop(order_id)
+            # Both endpoints answer with the canceled orders
+            self._update_order_cache(response)
         else:
             print("Failed to cancelled order")
 
         return response
+    
+    def cancel_orders(self, order_ids:typing.List[str]):
+        # Any number of orders in one request, the order endpoint takes a list of ids
+        response = self._request("DELETE", "/api/v1/order", { "orderID": json.dumps(list(order_ids)) }, use_headers=True)
         
-    def get_orders(self, only_open_orders=True):
-        super().get_orders(only_open_orders)
+        if response is not None:
+            self._update_order_cache(response)
+        else:
+            print("Failed to cancel orders.")
+            
+        return response
+        
+    def _get_order_rows(self, only_open_orders=True) -> typing.Union[typing.List[typing.Dict], None]:
         endpoint = '/api/v1/order'
         
         params = None
@@ -133,177 +300,119 @@ class Bitmex(Client):
             filters = { "open" : True }
             params["filter"] = json.dumps(filters)
         
-        orders = self._request("GET", endpoint, params, use_headers=True)
+        return self._request("GET", endpoint, params, use_headers=True)
+        
+    def get_orders(self, only_open_orders=True):
+        super().get_orders(only_open_orders)
+        orders = self._get_order_rows(only_open_orders)
+        
+        data = dict()
         
         if orders is not None:
-            data = dict()
-
             for order in orders:
-                order_dict = dict()
-                order_dict["id"] = order["orderID"]
-                order_dict["timestamp"] = order["timestamp"]
-                order_dict["account"] = order["account"]
-                order_dict["symbol"] = order["symbol"]
-                order_dict["side"] = order["side"]
-                order_dict["contracts"] = order["orderQty"]
-                order_dict["type"] = order["ordType"]
-                order_dict["status"] = order["ordStatus"]
-                data[order["orderID"]] = order_dict
+                data[order["orderID"]] = { name: order.get(field) for field, name in ORDER_FIELDS.items() }
         else:
             print("No order data avaliable")
                 
 
         return data
+    
+    def track_orders(self):
+        # Keeps self.orders, self.positions and self.executions current from the private websocket streams,
+        # reading them never goes to the exchange. The order stream's partial replaces the cached open orders.
+        def on_order(message):
+            self._update_order_cache(message["data"], action=message["action"])
+            
+        def on_execution(message):
+            self.executions.extend(message["data"])
             
-    def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, granularity="1m", candle_count=1000):
+        def on_position(message):
+            for position in message["data"]:
+                if message["action"] == "partial" or position["symbol"] not in self.positions:
+                    self.positions[position["symbol"]] = position
+                else:
+                    self.positions[position["symbol"]].update(position)
+        
+        self.subscribe("order", on_order)
+        self.subscribe("execution", on_execution)
+        self.subscribe("position", on_position)
+        return self.websocket
+            
+    def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, granularity="1m", candle_count=1000, workers=4, stream=False):
         super().get_historical_data(symbol, start, end, candle_count)
         
-        collect_rate = 2
+        # Without a start only the latest page is collected
+        end = int(Timestamp.to_epoch([end])[0]) if end is not None else Timestamp.now()
+        start = int(Timestamp.to_epoch([start])[0]) if start is not None else end - self.granularities[granularity] * (candle_count - 1)
+        
+        # stream=True yields one frame per page instead of building the whole frame
+        if stream:
+            return self._stream_candles(symbol.upper(), start, end, granularity, candle_count, workers)
         
+        return self._download_candles(symbol.upper(), start, end, granularity, candle_count, workers)
+    
+    def _get_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int):
         params = {
             "binSize": granularity,
-            "symbol": symbol.upper(),
+            "symbol": symbol,
             "count": candle_count,
+            "startTime": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+            "endTime": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+            "reverse": "false"
         }
         
-        last_start_time = None
-        candles = []
-        counter = 0
-        end_point = "/api/v1/trade/bucketed"
+        data_response = self._request("GET", "/api/v1/trade/bucketed", params=params)
         
-        if start is None and end is None:
-            last_start_time = datetime.today()
-            end = datetime.now()
-            params["endTime"] = end
-            
-            while(True):   
-                params["startTime"] = last_start_time   
-               
-                data_response = self._request("GET", end_point, params=params)
-                
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-        
-                for candle in data_response:            
-                    data = dict()
-                    data["date"] =   candle["timestamp"]
-                    data["open"] =   candle["open"]
-                    data["high"] =   candle["high"]
-                    data["low"] =    candle["low"]
-                    data["close"] =  candle["close"]
-                    data["volume"] = candle["volume"]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[-1]["date"]
-                    print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response), len(candles)))
-                
-                if (len(data_response) < candle_count):
-                    if len(candles) > 0:
-                        candles.pop()
-                    break
-                
-                counter += 1  
-                time.sleep(collect_rate)    
-        elif start is not None and end is None:
-            last_start_time = start
-            end = datetime.now()
-            params["endTime"] = end
-            
-            while(True):   
-                params["startTime"] = last_start_time   
-                data_response = self._request("GET", end_point, params=params)
-                
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-
-                for candle in data_response:            
-                    data = dict()
-                    data["date"] =   candle["timestamp"]
-                    data["open"] =   candle["open"]
-                    data["high"] =   candle["high"]
-                    data["low"] =    candle["low"]
-                    data["close"] =  candle["close"]
-                    data["volume"] = candle["volume"]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[-1]["date"]
-                    
-                print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response), len(candles)))
-                counter += 1  
-                
-                        
-                if(len(data_response) < candle_count):
-                    if len(candles) > 0:
-                        candles.pop()
-                    break 
-                
-                time.sleep(collect_rate)
-        else:
-            last_start_time = start
-            params["endTime"] = end
+        if data_response is None:
+            return None
+        
+        # Timestamps look like "2021-11-21T00:00:00.000Z", numpy parses the first 19 characters without a per candle datetime.
+        # Empty buckets have null prices which become NaN.
+        with self.metrics.timer("parse"):
+            dates = np.array([candle["timestamp"][:19] for candle in data_response], dtype="datetime64[s]").astype(np.int64)
+            values = np.array(list(map(operator.itemgetter(*CANDLE_COLUMNS), data_response)), dtype=np.float64).reshape(-1, len(CANDLE_COLUMNS))
+        
+        return dates, values
             
-            while(True):  
-                params["startTime"] = last_start_time   
-               
-                data_response = self._request("GET", end_point, params=params)
-
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-        
-                for candle in data_response:            
-                    data = dict()
-                    data["date"] =   candle["timestamp"]
-                    data["open"] =   candle["open"]
-                    data["high"] =   candle["high"]
-                    data["low"] =    candle["low"]
-                    data["close"] =  candle["close"]
-                    data["volume"] = candle["volume"]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[-1]["date"]
-                    print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response), len(candles)))
-                
-                if (len(data_response) < candle_count):
-                    break
-                
-                counter += 1
-                
-                time.sleep(collect_rate) 
-
-        return candles
+    def get_order_book(self, symbol:str) -> BitmexOrderBook:
+        # Full depth book from the orderBookL2 deltas, a lost delta asks for a new partial
+        if symbol not in self.order_books:
+            channel = "orderBookL2:" + symbol
+            self.order_books[symbol] = BitmexOrderBook(symbol, resubscribe=lambda: self.websocket.resubscribe(channel))
+            self.subscribe(channel, self.order_books[symbol].apply)
             
+        return self.order_books[symbol]
+    
     def get_realtime_data(self, symbol:str):
-        ws = BitMEXWebsocket(endpoint=self.websocket_url, symbol=symbol, api_key=self._public_key, api_secret=self._secret_key)
-        
-        self.realtime_data = dict()
-        self.realtime_data["instrument"] = ws.get_instrument()
-        self.realtime_data["ticker"] = ws.get_ticker()
-        self.realtime_data["funds"] = ws.funds()
-        self.realtime_data["market_depth"] = ws.market_depth()
-        self.realtime_data["open_orders"] = ws.open_orders(clOrdIDPrefix=None)
-        self.realtime_data["recent_trades"] = ws.recent_trades()
-        
-        while(ws.ws.sock.connected):
-            self.realtime_data["ticker"] = ws.get_ticker()
-            self.logger.info("Ticker: %s" % self.realtime_data["ticker"])
+        # Keeps self.realtime_data up to date from the websocket and returns right away with the websocket.
+        # Instrument and margin rows are merged with their updates, open orders are the symbol's orders in self.orders.
+        self.realtime_data = {
+            "instrument": dict(), "ticker": dict(), "funds": dict(), "market_depth": self.get_order_book(symbol),
+            "open_orders": dict(), "recent_trades": deque(maxlen=1000)
+        }
+        
+        def on_instrument(message):
+            for row in message["data"]:
+                self.realtime_data["instrument"].update(row)
+            instrument = self.realtime_data["instrument"]
+            self.realtime_data["ticker"] = { "last": instrument.get("lastPrice"), "buy": instrument.get("bidPrice"), "sell": instrument.get("askPrice"), "mid": instrument.get("midPrice") }
             
-            if ws.api_key:
-                self.realtime_data["funds"] = ws.funds()
-                self.logger.info("Funds: %s" % self.realtime_data["funds"])
-                
-            self.realtime_data["market_depth"] = ws.market_depth()
-            self.logger.info("Market Depth: %s" % self.realtime_data["market_depth"])
-                
-            self.realtime_data["open_orders"] = ws.open_orders(clOrdIDPrefix=None)
-            self.logger.info("Open Trades: %s" % self.realtime_data["open_orders"])  
+        def on_trade(message):
+            self.realtime_data["recent_trades"].extend(message["data"])
             
-            self.realtime_data["recent_trades"] = ws.recent_trades()
-            self.logger.info("Recent Trades: %s\n\n" % self.realtime_data["recent_trades"])
+        def on_margin(message):
+            for row in message["data"]:
+                self.realtime_data["funds"].update(row)
                 
-            time.sleep(1000)
\ No newline at end of file
+        def on_order(message):
+            self._update_order_cache(message["data"], action=message["action"], symbol=symbol)
+            self.realtime_data["open_orders"] = { order_id: order for order_id, order in (self._orders or dict()).items() if order.get("symbol") == symbol }
+        
+        self.subscribe("instrument:" + symbol, on_instrument)
+        self.subscribe("trade:" + symbol, on_trade)
+        
+        if self._public_key and self._secret_key:
+            self.subscribe("margin", on_margin)
+            self.subscribe("order:" + symbol, on_order)
+            
+        return self.websocket
@@ -1,9 +1,26 @@
 
 import typing
+import json
 import logging
+import os
+import os.path
+import requests
+import threading
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Connector.Metrics import Metrics
+from Connector.Websocket import Websocket
 
 from datetime import date, datetime
+from urllib.parse import urlsplit
 
 class OrderSide(Enum):
     BUY = 0
@@ -12,29 +29,278 @@ class OrderType(Enum):
     MARKET = 0
     LIMIT = 1
     
+CANDLE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# Where the instrument lists of the exchanges are cached between runs
+INSTRUMENTS_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "BitmexBot")
+
+class RateLimiter:
+    # Token bucket for one class of endpoints. It refills continuously at capacity / window tokens per second
+    # and is corrected by the exchange's rate limit headers after every response.
+    def __init__(self, capacity:float, window:float):
+        self.capacity = capacity
+        self.window = window
+        self.tokens = capacity
+        self.wait_time = 0.0
+        
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        
+    def _refill(self, now:float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.capacity / self.window)
+        self._updated = now
+        
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) * self.window / self.capacity
+                    
+                self.wait_time += wait
+            time.sleep(wait)
+            
+    def update(self, limit:typing.Union[int, None], remaining:typing.Union[int, None], reset:typing.Union[float, None]):
+        # limit / remaining are the exchange's view of the bucket, reset the seconds until it refills
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            
+            if limit is not None and limit > 0:
+                self.capacity = limit
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset is not None:
+                    self._blocked_until = max(self._blocked_until, now + reset)
+                    
+    def block(self, seconds:float):
+        # Called on a 429, nothing is sent until the exchange allows it again
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = 0
+            self._blocked_until = max(self._blocked_until, now + seconds)
+    
 class Client: 
-    def __init__(self, name:str, base_url:str, test_net_url:str, websocket:typing.Union[str, None], testnet_websocket:typing.Union[str, None], public_key:str, secret_key:str, use_testnet=True):
+    # Candle granularity name -> length in seconds, filled in by every exchange
+    granularities = dict()
+    # Endpoint class -> (requests, window in seconds), filled in by every exchange
+    rate_limits = { "rest": (60, 60) }
+    # Market data / order websocket of the exchange
+    websocket_class = Websocket
+    
+    def __init__(self, name:str, base_url:str, test_net_url:str, websocket:typing.Union[str, None], testnet_websocket:typing.Union[str, None], public_key:str, secret_key:str, use_testnet=True, pool_size=10, timeout=(3.05, 10), retries=3, backoff=0.5, metrics:typing.Union[bool, Metrics]=False, url:typing.Union[str, None]=None, websocket_url:typing.Union[str, None]=None,
+                 cache_path:typing.Union[str, None]=INSTRUMENTS_CACHE_PATH, instruments_ttl=86400):
+        # One token bucket per endpoint class, shared by every thread using this client
+        self.rate_limiters = { endpoint_class: RateLimiter(capacity, window) for endpoint_class, (capacity, window) in self.rate_limits.items() }
+        
+        # Request latencies, counters and stage timers, metrics=True or a Metrics shared with other clients turns them on
+        self.metrics = metrics if isinstance(metrics, Metrics) else Metrics(enabled=metrics, labels={ "client": name })
+        self.metrics.collect(self._collect_rate_limit_metrics)
+        
+        # One keep-alive session per client so requests reuse pooled connections instead of a new TCP+TLS handshake
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = self._create_session(pool_size, retries, backoff)
+        
         if use_testnet:
             self.base_url = test_net_url
             self.websocket_url = testnet_websocket
         else:
             self.base_url = base_url
             self.websocket_url = websocket
+            
+        # url / websocket_url point the client somewhere else, e.g. at a Benchmark.MockExchange
+        if url is not None:
+            self.base_url = url
+        if websocket_url is not None:
+            self.websocket_url = websocket_url
         
         self._public_key = public_key
         self._secret_key = secret_key
         
         self.name = name
         
-        self.instruments = self._get_instruments()
-        self.orders = self.get_orders()
+        # Nothing is requested until it's used, instruments come from the disk cache while it's younger than instruments_ttl seconds
+        self.cache_path = cache_path
+        self.instruments_ttl = instruments_ttl
+        self._instruments = None
+        self._orders = None
+        self._lazy_lock = threading.Lock()
         
         self.websocket = None
+        self.order_books = dict()
         
         self.logger = self.create_logger()
         self.realtime_data = None
         
-    def _get_instruments(self):
+    @property
+    def instruments(self) -> typing.Dict[str, typing.Dict]:
+        # Upper case symbol -> { "symbol", "tick_size", "lot_size", ... }, iterating it gives the symbols
+        if self._instruments is None:
+            with self._lazy_lock:
+                if self._instruments is None:
+                    self._instruments = self._load_instruments()
+        return self._instruments
+    
+    def get_instrument(self, symbol:str) -> typing.Union[typing.Dict, None]:
+        return self.instruments.get(symbol.upper())
+    
+    def refresh_instruments(self) -> typing.Dict[str, typing.Dict]:
+        with self._lazy_lock:
+            self._instruments = self._load_instruments(use_cache=False)
+        return self._instruments
+    
+    @property
+    def orders(self) -> typing.Dict:
+        # Loaded from the exchange on first access
+        if self._orders is None:
+            with self._lazy_lock:
+                if self._orders is None:
+                    self._load_orders()
+        return self._orders
+    
+    @orders.setter
+    def orders(self, orders:typing.Dict):
+        self._orders = orders
+        
+    def _load_orders(self):
+        # Sets self._orders from the exchange, clients that also stream the orders merge the two
+        self._orders = self.get_orders() or dict()
+        
+    def _instruments_cache_file(self) -> str:
+        # Testnet, mainnet and mock exchanges list different instruments
+        return os.path.join(self.cache_path, "{}_{}_instruments.json".format(self.name, urlsplit(self.base_url).netloc.replace(":", "_")))
+    
+    def _load_instruments(self, use_cache=True) -> typing.Dict[str, typing.Dict]:
+        cached = None
+        
+        if self.cache_path is not None and os.path.exists(self._instruments_cache_file()):
+            try:
+                with open(self._instruments_cache_file()) as file:
+                    cached = json.load(file)
+            except (OSError, ValueError):
+                cached = None
+                
+        if use_cache and cached is not None and time.time() - cached["time"] < self.instruments_ttl:
+            return cached["instruments"]
+        
+        instruments = self._get_instruments()
+        
+        if instruments is None:
+            # An outdated list is better than none when the exchange can't be reached
+            print("Failed to collect instruments.")
+            return cached["instruments"] if cached is not None else dict()
+        
+        instruments = { symbol.upper(): instrument for symbol, instrument in instruments.items() }
+        
+        if self.cache_path is not None:
+            os.makedirs(self.cache_path, exist_ok=True)
+            temporary = self._instruments_cache_file() + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump({ "time": time.time(), "instruments": instruments }, file)
+            os.replace(temporary, self._instruments_cache_file())
+            
+        return instruments
+        
+    def _create_session(self, pool_size:int, retries:int, backoff:float) -> requests.Session:
+        # Order placement (POST) is never retried automatically, a retry could place the order twice.
+        # 429s are left to the rate limiters in _request.
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    
+    def _generate_headers(self, method:str, endpoint:str, params) -> typing.Dict:
+        # Authentication headers for private endpoints, implemented by every exchange
+        return dict()
+    
+    def _rate_limit_classes(self, method:str, endpoint:str) -> typing.List[str]:
+        # The endpoint classes a request counts against, the first one is described by the rate limit headers
+        return ["rest"]
+    
+    def _read_rate_limit_headers(self, response:requests.Response):
+        # Returns (limit, remaining, seconds until reset) from the exchange's headers, None where missing
+        return None, None, None
+    
+    def _collect_rate_limit_metrics(self):
+        for endpoint_class, limiter in self.rate_limiters.items():
+            yield "rate_limit_wait_seconds_total", { "endpoint_class": endpoint_class }, limiter.wait_time
+    
+    def _record_response(self, method:str, endpoint:str, response:requests.Response, seconds:float):
+        status = str(response.status_code)
+        self.metrics.observe("request_seconds", seconds, endpoint=endpoint, method=method)
+        self.metrics.increment("requests_total", endpoint=endpoint, method=method, status=status)
+        self.metrics.increment("response_bytes_total", len(response.content), endpoint=endpoint)
+        
+        if response.request.body is not None:
+            self.metrics.increment("request_bytes_total", len(response.request.body), endpoint=endpoint)
+        if response.status_code == 429:
+            self.metrics.increment("rate_limited_total", endpoint=endpoint)
+        elif response.status_code != 200:
+            self.metrics.increment("errors_total", endpoint=endpoint, method=method, status=status)
+        
+        # Retries of 5xx responses done by the session's urllib3 Retry
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and len(retries.history) > 0:
+            self.metrics.increment("retries_total", len(retries.history), endpoint=endpoint)
+    
+    def _request(self, method:str, endpoint:str, params=None, use_headers=False):
+        limiters = [self.rate_limiters[endpoint_class] for endpoint_class in self._rate_limit_classes(method, endpoint)]
+        
+        for attempt in range(self.retries + 1):
+            for limiter in limiters:
+                limiter.acquire()
+            
+            headers = dict()
+            
+            if use_headers:
+                headers = self._generate_headers(method=method, endpoint=endpoint, params=params)
+            
+            start = time.perf_counter()
+            try:
+                response = self._session.request(method=method, url=self.base_url+endpoint, params=params, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.metrics.increment("errors_total", endpoint=endpoint, method=method, status="exception")
+                print("{} request to {} failed: {}".format(self.name, endpoint, e))
+                return None
+            
+            if self.metrics.enabled:
+                self._record_response(method, endpoint, response, time.perf_counter() - start)
+            
+            limit, remaining, reset = self._read_rate_limit_headers(response)
+            limiters[0].update(limit, remaining, reset)
+            
+            # A 429 was never processed by the exchange so it is safe to send again once the limit resets
+            if response.status_code != 429:
+                break
+            
+            for limiter in limiters:
+                limiter.block(reset if reset is not None else self.backoff * 2 ** attempt)
+            
+        if response.status_code == 200:
+            with self.metrics.timer("decode"):
+                return response.json()
+        else:
+            print(response.text)
+        
+        return None
+    
+    def _get_instruments(self) -> typing.Union[typing.Dict[str, typing.Dict], None]:
+        # Symbol -> { "symbol", "tick_size", "lot_size", "min_size", "quote_currency" } from the exchange, None on failure
         pass
     
     def place_order(self, side:OrderSide, symbol:str, contracts:float, order_type:OrderType, price=None, tif="GoodTillCancel"):
@@ -46,8 +312,120 @@ class Client:
     def get_orders(self, only_open_orders=True):
         pass
     
+    def amend_order(self, order_id:str, contracts:typing.Union[float, None]=None, price:typing.Union[float, None]=None):
+        pass
+    
+    def _concurrently(self, function, arguments:typing.List[typing.Dict]) -> typing.List:
+        # One request per order on the session's pool, for exchanges without bulk endpoints. Results are in order.
+        if len(arguments) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(arguments))) as executor:
+            return list(executor.map(lambda kwargs: function(**kwargs), arguments))
+    
+    def place_orders(self, orders:typing.List[typing.Dict]):
+        # orders: place_order's arguments as dicts
+        return self._concurrently(self.place_order, orders)
+    
+    def amend_orders(self, amendments:typing.List[typing.Dict]):
+        # amendments: amend_order's arguments as dicts
+        return self._concurrently(self.amend_order, amendments)
+    
+    def cancel_orders(self, order_ids:typing.List[str]):
+        return self._concurrently(self.cancel_order, [{ "order_id": order_id } for order_id in order_ids])
+    
     def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, candle_count=1000):
        pass
+   
+    def get_realtime_data(self, symbol:str):
+        # Keeps self.realtime_data up to date from the websocket and returns right away, implemented by every exchange
+        pass
+    
+    def get_order_book(self, symbol:str):
+        # Level 2 book of the symbol kept up to date from the websocket, implemented by every exchange
+        pass
+    
+    def start_websocket(self) -> Websocket:
+        # The websocket is opened on first use and shared by every subscriber
+        if self.websocket is None:
+            self.websocket = self.websocket_class(self)
+        return self.websocket.start()
+    
+    def subscribe(self, channel:str, callback:typing.Callable[[typing.Any], None]):
+        # Calls callback with every message of the channel (an exchange topic) from the websocket thread
+        return self.start_websocket().subscribe(channel, callback)
+   
+    def _get_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int):
+        # Returns one page of candles between the epoch times (inclusive) sorted by date as a
+        # (int64 epoch dates, float64 [n, 5] OHLCV values in CANDLE_COLUMNS order) pair, None on failure
+        pass
+    
+    def _stream_candle_pages(self, symbol:str, start:int, end:int, granularity:str, candle_count:int, workers=4):
+        # Splits [start, end] into windows of one page each and downloads them on a bounded pool of threads.
+        # Windows are yielded in order and at most `workers` of them are held in memory at once.
+        interval = self.granularities[granularity]
+        window = interval * candle_count
+        start = start - start % interval
+        windows = iter([(window_start, min(window_start + window - interval, end)) for window_start in range(start, end + 1, window)])
+        
+        def download_window(window_start:int, window_end:int):
+            pages = []
+            
+            while window_start <= window_end:
+                page = self._get_candles(symbol, window_start, window_end, granularity, candle_count)
+                
+                if page is None:
+                    print("Failed to collect candles between {} and {}.".format(window_start, window_end))
+                    break
+                
+                pages.append(page)
+                dates = page[0]
+                
+                # The exchange returned a short page without reaching the end of the window, the rest is a gap
+                if dates.shape[0] < candle_count or dates.shape[0] == 0:
+                    break
+                window_start = int(dates[-1]) + interval
+            
+            if len(pages) == 1:
+                return pages[0]
+            return np.concatenate([page[0] for page in pages]), np.concatenate([page[1] for page in pages]).reshape(-1, len(CANDLE_COLUMNS))
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = deque(executor.submit(download_window, *window) for window in itertools.islice(windows, max(1, workers)))
+            
+            while len(pending) > 0:
+                page = pending.popleft().result()
+                
+                for window in itertools.islice(windows, 1):
+                    pending.append(executor.submit(download_window, *window))
+                    
+                yield page
+    
+    def _stream_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int, workers=4):
+        # Yields one chunk per window as a frame with an int64 epoch "date" index and float64 OHLCV columns,
+        # so memory doesn't grow with the range. Chunks are in order and de-duplicated on their date.
+        last_date = None
+        total = 0
+        
+        for counter, (dates, values) in enumerate(self._stream_candle_pages(symbol, start, end, granularity, candle_count, workers)):
+            if last_date is not None:
+                keep = dates > last_date
+                dates, values = dates[keep], values[keep]
+            if dates.shape[0] == 0:
+                continue
+            
+            chunk = pd.DataFrame(values, columns=CANDLE_COLUMNS, index=pd.Index(dates, name="date"), copy=False)
+            last_date = int(dates[-1])
+            total += dates.shape[0]
+            
+            print("Window {}: {} candles collected | Total candles {}".format(counter, dates.shape[0], total))
+            yield chunk
+            
+    def _download_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int, workers=4):
+        chunks = list(self._stream_candles(symbol, start, end, granularity, candle_count, workers))
+        
+        if len(chunks) == 0:
+            return pd.DataFrame(np.empty((0, len(CANDLE_COLUMNS))), columns=CANDLE_COLUMNS, index=pd.Index(np.empty(0, dtype=np.int64), name="date"))
+        return pd.concat(chunks)
 
     def create_logger(self):
         # Prints logger info to terminal
@@ -2,9 +2,10 @@ from Connector.Client import Client, OrderSide, OrderType
 
 import numpy as np 
 import pandas as pd
-from Utility.Utility import str2int64time, datetime2str, int64time2str
+from Utility import Timestamp
 import json
 import typing
+import base64
 import requests
 import time
 import hashlib
@@ -12,32 +13,56 @@ import urllib.parse
 import hmac
 from datetime import date, datetime
 from urllib.parse import _DefragResultBase, non_hierarchical, urlencode
+from collections import deque
+
+from Connector.OrderBook import KucoinOrderBook
+from Connector.Websocket import KucoinWebsocket
 
 class Kucoin(Client):
-    def __init__(self, public_key:str, secret_key:str, phrase:str, use_testnet=True):
-        super().__init__("Kucoin", "https://api.kucoin.com", "https://openapi-sandbox.kucoin.com", None, None, public_key, secret_key, use_testnet)
+    granularities = {
+        "1min": 60, "3min": 180, "5min": 300, "15min": 900, "30min": 1800,
+        "1hour": 3600, "2hour": 7200, "4hour": 14400, "6hour": 21600, "8hour": 28800, "12hour": 43200,
+        "1day": 86400, "1week": 604800
+    }
+    
+    # Public market data and private endpoints have separate quotas
+    rate_limits = { "public": (100, 10), "private": (1000, 30) }
+    # The websocket url comes with the token of every connection
+    websocket_class = KucoinWebsocket
+    
+    def __init__(self, public_key:str, secret_key:str, phrase:str, use_testnet=True, **kwargs):
         self.phrase = phrase
+        super().__init__("Kucoin", "https://api.kucoin.com", "https://openapi-sandbox.kucoin.com", None, None, public_key, secret_key, use_testnet, **kwargs)
+        
+    def _generate_headers(self, method:str, endpoint:str, params) -> typing.Dict:
+        timestamp = str(int(time.time() * 1000))
+        query = "?" + urlencode(params) if params else ""
+        message = timestamp + method + endpoint + query
+        
+        signature = base64.b64encode(hmac.new(self._secret_key.encode(), message.encode(), hashlib.sha256).digest())
+        phrase = base64.b64encode(hmac.new(self._secret_key.encode(), self.phrase.encode(), hashlib.sha256).digest())
+        
+        return {
+            "KC-API-KEY": self._public_key,
+            "KC-API-SIGN": signature.decode(),
+            "KC-API-TIMESTAMP": timestamp,
+            "KC-API-PASSPHRASE": phrase.decode(),
+            "KC-API-KEY-VERSION": "2"
+        }
         
-    def _request(self, method:str, endpoint:str, params=None, use_headers=False):
-        headers = dict()
-        
-        if use_headers:
-            expires = str(int(round(time.time()) + 5))
-            signature = self._generate_signature(method=method, endpoint=endpoint, data=params or '')
-            headers = {
-                "api-expires": expires,
-                "api-key": self._public_key,
-                "api-signature": signature
-            }
-        
-        response = requests.request(method=method, url=self.base_url+endpoint, params=params, headers=headers)
-            
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(response.text)
+    def _rate_limit_classes(self, method:str, endpoint:str) -> typing.List[str]:
+        if endpoint.startswith("/api/v1/market") or endpoint.startswith("/api/v1/symbols"):
+            return ["public"]
+        return ["private"]
+    
+    def _read_rate_limit_headers(self, response:requests.Response):
+        limit = response.headers.get("gw-ratelimit-limit")
+        remaining = response.headers.get("gw-ratelimit-remaining")
+        reset = response.headers.get("gw-ratelimit-reset") # Milliseconds until the quota resets
         
-        return None
+        return (int(limit) if limit is not None else None,
+                int(remaining) if remaining is not None else None,
+                int(reset) / 1000 if reset is not None else None)
         
     def _get_instruments(self):
         super()._get_instruments()
@@ -45,144 +70,98 @@ class Kucoin(Client):
         params = { "market" : "USDS"}
         
         instruments_response = self._request(method="GET", endpoint="/api/v1/symbols", params=params)
-        instruments = []
         
-        if instruments_response is not None:
-            for instrument in instruments_response["data"]:
-                instruments.append(instrument["symbol"])
-                
-        return instruments
+        if instruments_response is None or instruments_response.get("code") != "200000":
+            return None
+        
+        # Increments and sizes are decimal strings
+        number = lambda value: float(value) if value is not None else None
+        return { instrument["symbol"]: {
+            "symbol": instrument["symbol"],
+            "tick_size": number(instrument.get("priceIncrement")),
+            "lot_size": number(instrument.get("baseIncrement")),
+            "min_size": number(instrument.get("baseMinSize")),
+            "quote_currency": instrument.get("quoteCurrency")
+        } for instrument in instruments_response["data"] }
     
-    def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, granularity="1min", candle_count=1500):
+    def get_historical_data(self, symbol:str, start:typing.Union[str, None]=None, end:typing.Union[str, None]=None, granularity="1min", candle_count=1500, workers=4, stream=False):
         super().get_historical_data(symbol, start, end, candle_count)
         
-        collect_rate = 2
+        # Without a start only the latest page is collected
+        end = int(Timestamp.to_epoch([end])[0]) if end is not None else Timestamp.now()
+        start = int(Timestamp.to_epoch([start])[0]) if start is not None else end - self.granularities[granularity] * (candle_count - 1)
         
-        if start is not None:
-            start = str2int64time(start)
-        if end is not None:
-            end = str2int64time(end)
-            
+        # stream=True yields one frame per page instead of building the whole frame
+        if stream:
+            return self._stream_candles(symbol.upper(), start, end, granularity, candle_count, workers)
+        
+        return self._download_candles(symbol.upper(), start, end, granularity, candle_count, workers)
+    
+    def _get_candles(self, symbol:str, start:int, end:int, granularity:str, candle_count:int):
         params = {
             "type": granularity,
-            "symbol": symbol.upper()
+            "symbol": symbol,
+            "startAt": start,
+            "endAt": end + 1
         }
         
-        last_start_time = None
-        candles = []
-        counter = 0
-        end_point = "/api/v1/market/candles"
+        data_response = self._request("GET", "/api/v1/market/candles", params=params)
         
-        if start is None and end is None:
-            last_start_time = str2int64time(datetime2str(datetime.today()))
-            now = str2int64time(datetime2str(datetime.now()))
-            params["endAt"] = now
-            
-            while(True):   
-                params["startAt"] = last_start_time   
-               
-                data_response = self._request("GET", end_point, params=params)
-
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-                else:
-                    counter += 1
-        
-                for candle in data_response["data"]:            
-                    data = dict()
-                    data["date"] =   int64time2str(int(candle[0]))
-                    data["open"] =   candle[1]
-                    data["high"] =   candle[2]
-                    data["low"] =    candle[3]
-                    data["close"] =  candle[4]
-                    data["volume"] = candle[5]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[0]["date"]
-                    print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response["data"]), len(candles)))
-                
-                if (len(data_response) < candle_count):
-                    if len(candles) > 0:
-                        candles.pop(0)
-                    break
-                
-                time.sleep(collect_rate)    
-        elif start is not None and end is None:
-            last_start_time = start
-            now = str2int64time(datetime2str(datetime.now()))
-            params["endAt"] = now
-            
-            while(True):   
-                params["startAt"] = last_start_time   
-                data_response = self._request("GET", end_point, params=params)
-                
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-                else:
-                    counter += 1
-                    
-                for candle in data_response["data"]:            
-                    data = dict()
-                    data["date"] =   int64time2str(int(candle[0]))
-                    data["open"] =   candle[1]
-                    data["high"] =   candle[2]
-                    data["low"] =    candle[3]
-                    data["close"] =  candle[4]
-                    data["volume"] = candle[5]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[0]["date"]
-                    
-                print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response["data"]), len(candles)))
-                         
-                if(len(data_response) < candle_count):
-                    if len(candles) > 0:
-                        candles.pop(0)
-                    break 
-                
-                time.sleep(collect_rate)
-        else:
-            last_start_time = start
-            params["endAt"] = end
-            
-            while(True):  
-                params["startAt"] = last_start_time   
-               
-                data_response = self._request("GET", end_point, params=params)
-
-                if data_response is None:
-                    print("No candle data is availiable.")
-                    break
-                else:
-                    counter += 1
-                
-                for candle in data_response["data"]:            
-                    data = dict()
-                    data["date"] =   int64time2str(int(candle[0]))
-                    data["open"] =   candle[1]
-                    data["high"] =   candle[2]
-                    data["low"] =    candle[3]
-                    data["close"] =  candle[4]
-                    data["volume"] = candle[5]
-                    candles.append(data)
-                
-                if len(candles) > 0:
-                    last_start_time = candles[0]["date"]
-                    print("Iteration {}: {} candles collected | Total candles {}".format(counter, len(data_response["data"]), len(candles)))
-                
-                if (len(data_response) < candle_count):
-                    break
-                
-                time.sleep(collect_rate) 
-
-        return candles
-                
+        # Errors come back as { "code", "msg" } bodies, the caller reports the failed page
+        if data_response is None or data_response.get("code") != "200000":
+            return None
         
+        # Rows are [time, open, close, high, low, volume, turnover] as strings, newest candle first.
+        # numpy parses the strings straight into one float64 block.
+        with self.metrics.timer("parse"):
+            values = np.array(data_response["data"], dtype=np.float64).reshape(-1, 7)[::-1]
         
+        return values[:, 0].astype(np.int64), values[:, [1, 3, 4, 2, 5]]
+    
+    def _get_order_book_snapshot(self, symbol:str, full_depth:bool):
+        # The full depth snapshot needs the API keys, the public one only has the top 100 levels
+        if full_depth:
+            response = self._request(method="GET", endpoint="/api/v3/market/orderbook/level2", params={ "symbol": symbol }, use_headers=True)
+        else:
+            response = self._request(method="GET", endpoint="/api/v1/market/orderbook/level2_100", params={ "symbol": symbol })
         
+        if response is None or response.get("code") != "200000":
+            return None
+        return response["data"]
     
-        
\ No newline at end of file
+    def get_order_book(self, symbol:str) -> KucoinOrderBook:
+        # Book from the level 2 deltas on top of a REST snapshot, a sequence gap takes a new snapshot.
+        # Without API keys the snapshot only has 100 levels and the book is clipped to them.
+        if symbol not in self.order_books:
+            full_depth = bool(self._public_key and self._secret_key)
+            self.order_books[symbol] = KucoinOrderBook(symbol, snapshot=lambda: self._get_order_book_snapshot(symbol, full_depth), depth=None if full_depth else 100)
+            self.subscribe("/market/level2:" + symbol, self.order_books[symbol].apply)
+            
+        return self.order_books[symbol]
+    
+    def get_realtime_data(self, symbol:str):
+        # Keeps self.realtime_data up to date from the websocket and returns right away with the websocket
+        self.realtime_data = { "ticker": dict(), "market_depth": self.get_order_book(symbol), "open_orders": dict(), "recent_trades": deque(maxlen=1000) }
+        
+        def on_ticker(message):
+            self.realtime_data["ticker"] = message["data"]
+            
+        def on_trade(message):
+            self.realtime_data["recent_trades"].append(message["data"])
+            
+        def on_order(message):
+            order = message["data"]
+            if order.get("symbol") != symbol:
+                return
+            if order.get("status") == "done":
+                self.realtime_data["open_orders"].pop(order["orderId"], None)
+            else:
+                self.realtime_data["open_orders"].setdefault(order["orderId"], dict()).update(order)
+        
+        self.subscribe("/market/ticker:" + symbol, on_ticker)
+        self.subscribe("/market/match:" + symbol, on_trade)
+        
+        if self._public_key and self._secret_key:
+            self.subscribe("/spotMarket/tradeOrders", on_order)
+            
+        return self.websocket
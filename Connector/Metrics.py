@@ -0,0 +1,140 @@
+import bisect
+import contextlib
+import json
+import math
+import threading
+import time
+import typing
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_disabled_timer = contextlib.nullcontext()
+
+class Histogram:
+    def __init__(self, buckets:typing.Tuple[float, ...]=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the values above the last bound, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> typing.Dict:
+        cumulative, total = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            cumulative.append(("+Inf" if bound == math.inf else bound, total))
+        return { "buckets": cumulative, "sum": self.sum, "count": self.count }
+
+class Metrics:
+    # Counters and latency histograms of a client, keyed by name and labels (endpoint, method, status, stage, ...).
+    # Disabled metrics return before doing any work, so they cost one attribute check per call site.
+    # Values computed elsewhere (e.g. RateLimiter.wait_time) are read at export time by the registered collectors.
+    def __init__(self, enabled=True, prefix="bitmexbot", labels:typing.Union[typing.Dict[str, str], None]=None):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.labels = labels or dict()
+
+        self._counters = dict()
+        self._histograms = dict()
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name:str, labels:typing.Dict[str, str]) -> typing.Tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def increment(self, name:str, value:float=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name:str, value:float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def _timer(self, stage:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def timer(self, stage:str):
+        # `with metrics.timer("parse"):` adds the time spent in the block to the stage's histogram
+        if not self.enabled:
+            return _disabled_timer
+        return self._timer(stage)
+
+    def collect(self, collector:typing.Callable[[], typing.Iterable[typing.Tuple[str, typing.Dict[str, str], float]]]):
+        # collector() yields (counter name, labels, value) when the metrics are exported
+        self._collectors.append(collector)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> typing.Dict:
+        # JSON serializable copy of every metric
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = { key: histogram.snapshot() for key, histogram in self._histograms.items() }
+
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                counters[self._key(name, labels)] = value
+
+        return {
+            "labels": self.labels,
+            "counters": [{ "name": name, "labels": dict(labels), "value": value } for (name, labels), value in sorted(counters.items())],
+            "histograms": [dict(histogram, name=name, labels=dict(labels)) for (name, labels), histogram in sorted(histograms.items())]
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def _format_labels(self, labels:typing.Dict) -> str:
+        labels = dict(self.labels, **labels)
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels.items()) + "}"
+
+    def to_prometheus(self) -> str:
+        # Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        for counter in snapshot["counters"]:
+            name = self.prefix + "_" + counter["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{} {}".format(name, self._format_labels(counter["labels"]), counter["value"]))
+
+        for histogram in snapshot["histograms"]:
+            name = self.prefix + "_" + histogram["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            for bound, count in histogram["buckets"]:
+                lines.append("{}_bucket{} {}".format(name, self._format_labels(dict(histogram["labels"], le=bound)), count))
+            lines.append("{}_sum{} {}".format(name, self._format_labels(histogram["labels"]), histogram["sum"]))
+            lines.append("{}_count{} {}".format(name, self._format_labels(histogram["labels"]), histogram["count"]))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+import bisect
+import math
+import threading
+import time
+import typing
+from collections import deque
+
+class OrderBook:
+    # Level 2 book of one symbol kept up to date in place from the websocket's deltas.
+    # Every side is a price -> size dict plus a sorted list of its prices, so the best bid / ask is the end of a list
+    # and top N / VWAP walk the levels in order without sorting.
+    def __init__(self, symbol:str):
+        self.symbol = symbol
+        self.bids = dict()
+        self.asks = dict()
+        self.synced = False
+        self.updates = 0
+        self.resyncs = 0
+
+        # Ascending prices, the best bid is the last one and the best ask the first one
+        self._bid_prices = []
+        self._ask_prices = []
+        self._lock = threading.Lock()
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_prices.clear()
+        self._ask_prices.clear()
+        self.synced = False
+
+    def _set_level(self, is_bid:bool, price:float, size:float):
+        # A size of 0 removes the level
+        levels, prices = (self.bids, self._bid_prices) if is_bid else (self.asks, self._ask_prices)
+
+        if size > 0:
+            if price not in levels:
+                bisect.insort(prices, price)
+            levels[price] = size
+        elif levels.pop(price, None) is not None:
+            del prices[bisect.bisect_left(prices, price)]
+
+    def best_bid(self) -> typing.Tuple[float, float]:
+        # (price, size), NaNs when the side is empty
+        with self._lock:
+            if len(self._bid_prices) == 0:
+                return math.nan, math.nan
+            price = self._bid_prices[-1]
+            return price, self.bids[price]
+
+    def best_ask(self) -> typing.Tuple[float, float]:
+        with self._lock:
+            if len(self._ask_prices) == 0:
+                return math.nan, math.nan
+            price = self._ask_prices[0]
+            return price, self.asks[price]
+
+    def mid(self) -> float:
+        return (self.best_bid()[0] + self.best_ask()[0]) / 2
+
+    def spread(self) -> float:
+        return self.best_ask()[0] - self.best_bid()[0]
+
+    def top(self, n=10) -> typing.Tuple[typing.List[typing.Tuple[float, float]], typing.List[typing.Tuple[float, float]]]:
+        # The n best (price, size) levels of each side, best first
+        with self._lock:
+            bids = [(price, self.bids[price]) for price in self._bid_prices[:-n - 1:-1]]
+            asks = [(price, self.asks[price]) for price in self._ask_prices[:n]]
+        return bids, asks
+
+    def vwap(self, side:str, size:float) -> float:
+        # Average price of filling `size` against the book, side "buy" takes the asks and "sell" the bids.
+        # NaN when the book isn't deep enough.
+        is_buy = side.lower() == "buy"
+        remaining, cost = size, 0.0
+
+        with self._lock:
+            levels, prices = (self.asks, self._ask_prices) if is_buy else (self.bids, reversed(self._bid_prices))
+
+            for price in prices:
+                filled = min(remaining, levels[price])
+                cost += filled * price
+                remaining -= filled
+                if remaining <= 0:
+                    return cost / size
+
+        return math.nan
+
+    def resync(self):
+        # The deltas can't be applied anymore (missed message), the book is empty until it's rebuilt from a snapshot
+        self.clear()
+        self.resyncs += 1
+
+class BitmexOrderBook(OrderBook):
+    # Applies orderBookL2 messages. Levels are identified by id, updates and deletes may leave the price out.
+    def __init__(self, symbol:str, resubscribe:typing.Union[typing.Callable[[], None], None]=None):
+        super().__init__(symbol)
+        # Asks the websocket for a new partial (the snapshot) after a missed message
+        self.resubscribe = resubscribe
+        self._levels = dict()
+
+    def clear(self):
+        super().clear()
+        self._levels.clear()
+
+    def apply(self, message:typing.Dict):
+        action = message["action"]
+
+        with self._lock:
+            if action == "partial":
+                self.clear()
+                self.synced = True
+            elif not self.synced:
+                # Deltas before the first partial are already part of it
+                return
+
+            for row in message["data"]:
+                level_id = row["id"]
+
+                if action == "partial" or action == "insert":
+                    is_bid = row["side"] == "Buy"
+                    self._levels[level_id] = (is_bid, row["price"])
+                    self._set_level(is_bid, row["price"], row["size"])
+                    continue
+
+                level = self._levels.get(level_id)
+                if level is None:
+                    # Update or delete of a level that was never inserted, a message was lost
+                    self._resync()
+                    return
+
+                is_bid, price = level
+                if action == "update":
+                    self._set_level(is_bid, price, row["size"])
+                else:
+                    del self._levels[level_id]
+                    self._set_level(is_bid, price, 0)
+
+            self.updates += 1
+
+    def _resync(self):
+        self.resync()
+        if self.resubscribe is not None:
+            self.resubscribe()
+
+class KucoinOrderBook(OrderBook):
+    # Applies /market/level2 messages on top of a REST snapshot. Every change carries a sequence number, the changes
+    # older than the snapshot are skipped and a gap in the sequence rebuilds the book from a new snapshot.
+    # The snapshot is fetched on its own thread while the deltas are buffered, so the websocket thread and the readers
+    # never wait on a request, and the buffered deltas are replayed in order once it arrives.
+    def __init__(self, symbol:str, snapshot:typing.Callable[[], typing.Union[typing.Dict, None]], depth:typing.Union[int, None]=None,
+                 threaded=True, buffer_size=10000, retry_delay=1, max_retry_delay=60):
+        super().__init__(symbol)
+        # Returns the "data" of the level 2 snapshot endpoint ({"sequence", "bids", "asks"}), None on failure
+        self.snapshot = snapshot
+        # Levels kept per side when the snapshot only has the top `depth` levels, the deltas cover the full book
+        self.depth = depth
+        # threaded=False takes the snapshot on the calling thread (replays and benchmarks)
+        self.threaded = threaded
+        self.sequence = 0
+
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._buffer = deque(maxlen=buffer_size)
+        self._fetching = False
+        self._delay = retry_delay
+        self._retry_at = 0.0
+
+    def apply(self, message:typing.Dict):
+        data = message["data"]
+
+        with self._lock:
+            if self.synced and int(data["sequenceStart"]) > self.sequence + 1:
+                # A message was lost
+                self.resync()
+
+            if self.synced:
+                self._apply(data)
+                return
+
+            self._buffer.append(data)
+            fetch = self._start_fetch()
+
+        if fetch:
+            self._fetch_in_background()
+
+    def _start_fetch(self) -> bool:
+        # One snapshot request at a time, failed ones are retried with an exponential backoff when the next delta arrives
+        if self._fetching or time.monotonic() < self._retry_at:
+            return False
+        self._fetching = True
+        return True
+
+    def _fetch_in_background(self):
+        if self.threaded:
+            threading.Thread(target=self._fetch, name="OrderBook-" + self.symbol, daemon=True).start()
+        else:
+            self._fetch()
+
+    def _fetch(self):
+        # The snapshot is requested without holding the lock
+        data = self.snapshot()
+
+        with self._lock:
+            self._fetching = False
+
+            if data is None:
+                self._retry_at = time.monotonic() + self._delay
+                self._delay = min(self._delay * 2, self.max_retry_delay)
+                return
+
+            self._load_snapshot(data)
+            buffered = list(self._buffer)
+            self._buffer.clear()
+
+            for i, delta in enumerate(buffered):
+                if int(delta["sequenceEnd"]) <= self.sequence:
+                    continue
+                if int(delta["sequenceStart"]) > self.sequence + 1:
+                    # The snapshot is older than the buffered deltas (or the buffer overflowed), take another one
+                    self.resync()
+                    self._buffer.extend(buffered[i:])
+                    self._retry_at = time.monotonic() + self._delay
+                    self._delay = min(self._delay * 2, self.max_retry_delay)
+                    return
+                self._apply(delta)
+
+            self._delay = self.retry_delay
+
+    def _load_snapshot(self, data:typing.Dict):
+        self.clear()
+        for is_bid, levels in ((True, data["bids"]), (False, data["asks"])):
+            for price, size in levels:
+                self._set_level(is_bid, float(price), float(size))
+
+        self.sequence = int(data["sequence"])
+        self.synced = True
+
+    def _apply(self, data:typing.Dict):
+        if int(data["sequenceEnd"]) <= self.sequence:
+            return
+
+        changes = data["changes"]
+        for is_bid, levels in ((True, changes["bids"]), (False, changes["asks"])):
+            for price, size, sequence in levels:
+                if int(sequence) > self.sequence:
+                    self._set_level(is_bid, float(price), float(size))
+
+        if self.depth is not None:
+            self._clip()
+
+        self.sequence = int(data["sequenceEnd"])
+        self.updates += 1
+
+    def _clip(self):
+        # Levels past the snapshot's depth were never in the snapshot, only the best `depth` of every side are kept
+        while len(self._bid_prices) > self.depth:
+            del self.bids[self._bid_prices.pop(0)]
+        while len(self._ask_prices) > self.depth:
+            del self.asks[self._ask_prices.pop()]
@@ -0,0 +1,280 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+import typing
+from collections import defaultdict, deque
+
+import websocket
+
+class Websocket:
+    # Push based market data: every message is handed to the callbacks subscribed to its channel as soon as it arrives,
+    # on the websocket's own thread, so the caller is never blocked. Dropped connections are reopened with a growing
+    # delay and every channel is subscribed again.
+    # Tick to callback latency (arrival of the frame to the start of the callback) of the last messages is kept in `latencies`.
+    def __init__(self, client, ping_interval=5.0, reconnect_delay=1.0, max_reconnect_delay=60.0, latency_samples=10000):
+        self.client = client
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.latencies = deque(maxlen=latency_samples)
+
+        self.connected = threading.Event()
+        self.reconnects = 0
+
+        self._callbacks = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._ws = None
+        self._ids = itertools.count(1)
+
+    def _connection_url(self) -> str:
+        # Url of a new connection, implemented by every exchange
+        return self.client.websocket_url
+
+    def _on_connected(self):
+        # Authentication after the connection is opened, implemented by exchanges with private channels
+        pass
+
+    def _subscribe_message(self, channels:typing.List[str]):
+        # Message subscribing to the channels, implemented by every exchange
+        pass
+
+    def _unsubscribe_message(self, channels:typing.List[str]):
+        pass
+
+    def _ping_message(self):
+        return "ping"
+
+    def _parse(self, message) -> typing.List[typing.Tuple[str, typing.Any]]:
+        # Splits a decoded message into (channel, data) pairs for the subscribers, implemented by every exchange
+        return []
+
+    def start(self):
+        # Connects on a background thread and returns right away, wait on `connected` if needed
+        if self._thread is not None and self._thread.is_alive():
+            return self
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.client.name + "Websocket", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._ws is not None:
+            self._ws.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def subscribe(self, channel:str, callback:typing.Callable[[typing.Any], None]):
+        # The callback runs on the websocket thread and should hand heavy work off to another thread
+        with self._lock:
+            new_channel = len(self._callbacks[channel]) == 0
+            self._callbacks[channel].append(callback)
+
+        if new_channel and self.connected.is_set():
+            self._send(self._subscribe_message([channel]))
+        return callback
+
+    def unsubscribe(self, channel:str, callback:typing.Union[typing.Callable, None]=None):
+        # Removes one callback, or all of them when callback is None
+        with self._lock:
+            callbacks = self._callbacks.get(channel, [])
+            if callback is None:
+                callbacks.clear()
+            elif callback in callbacks:
+                callbacks.remove(callback)
+
+            last_callback = len(callbacks) == 0
+            if last_callback:
+                self._callbacks.pop(channel, None)
+
+        if last_callback and self.connected.is_set():
+            self._send(self._unsubscribe_message([channel]))
+
+    def resubscribe(self, channel:str):
+        # Subscribes again without touching the callbacks, the exchange answers with a new snapshot of the channel
+        if self.connected.is_set():
+            self._send(self._unsubscribe_message([channel]))
+            self._send(self._subscribe_message([channel]))
+
+    def queue(self, channel:str, maxsize=0) -> asyncio.Queue:
+        # asyncio.Queue of the channel's messages for the running event loop, e.g. `data = await queue.get()`
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=maxsize)
+
+        def put(data):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._put, queue, data)
+
+        self.subscribe(channel, put)
+        return queue
+
+    @staticmethod
+    def _put(queue:asyncio.Queue, data):
+        # A full queue drops the oldest message, a slow consumer gets the latest data instead of stalling the websocket
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    def _send(self, message):
+        if message is None or self._ws is None:
+            return
+        try:
+            self._ws.send(message if isinstance(message, str) else json.dumps(message))
+        except websocket.WebSocketException as e:
+            print("{} websocket send failed: {}".format(self.client.name, e))
+
+    def _run(self):
+        delay = self.reconnect_delay
+
+        while not self._stopped.is_set():
+            url = self._connection_url()
+
+            if url is not None:
+                self._ws = websocket.WebSocketApp(url, on_open=self._on_open, on_message=self._on_message, on_error=self._on_error, on_close=self._on_close)
+                heartbeat = threading.Thread(target=self._heartbeat, args=(self._ws,), daemon=True)
+                heartbeat.start()
+                started = time.monotonic()
+
+                self._ws.run_forever(skip_utf8_validation=True)
+                self.connected.clear()
+
+                # A connection that stayed up for a while starts the delays over
+                if time.monotonic() - started > self.max_reconnect_delay:
+                    delay = self.reconnect_delay
+
+            if self._stopped.is_set():
+                break
+
+            print("{} websocket disconnected, reconnecting in {}s.".format(self.client.name, delay))
+            if self._stopped.wait(delay):
+                break
+
+            self.reconnects += 1
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _heartbeat(self, ws:websocket.WebSocketApp):
+        # Keeps idle connections open, the exchanges close them after a few seconds without traffic
+        while self._ws is ws and not self._stopped.wait(self.ping_interval):
+            if self.connected.is_set():
+                self._send(self._ping_message())
+
+    def _on_open(self, ws):
+        self._on_connected()
+        self.connected.set()
+
+        with self._lock:
+            channels = list(self._callbacks)
+        if len(channels) > 0:
+            self._send(self._subscribe_message(channels))
+
+    def _on_message(self, ws, raw:str):
+        received = time.perf_counter()
+
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return # "pong"
+
+        for channel, data in self._parse(message):
+            with self._lock:
+                callbacks = list(self._callbacks.get(channel, ()))
+
+            for callback in callbacks:
+                self.latencies.append(time.perf_counter() - received)
+                try:
+                    callback(data)
+                except Exception as e:
+                    print("{} websocket callback for {} failed: {!r}".format(self.client.name, channel, e))
+
+    def _on_error(self, ws, error):
+        print("{} websocket error: {}".format(self.client.name, error))
+
+    def _on_close(self, ws, status_code, message):
+        self.connected.clear()
+
+class BitmexWebsocket(Websocket):
+    # Channels are BitMEX subscription topics, "trade:XBTUSD", "orderBookL2:XBTUSD", "instrument:XBTUSD", "order", ...
+    # Callbacks get the message ({"table", "action", "data"}) with only the rows of the channel's symbol.
+    def _on_connected(self):
+        if self.client._public_key and self.client._secret_key:
+            expires = int(time.time()) + 5
+            signature = self.client._generate_signature("GET", "/realtime", "", expires=expires)
+            self._send({ "op": "authKeyExpires", "args": [self.client._public_key, expires, signature] })
+
+    def _subscribe_message(self, channels:typing.List[str]):
+        return { "op": "subscribe", "args": channels }
+
+    def _unsubscribe_message(self, channels:typing.List[str]):
+        return { "op": "unsubscribe", "args": channels }
+
+    def _parse(self, message) -> typing.List[typing.Tuple[str, typing.Any]]:
+        table = message.get("table") if isinstance(message, dict) else None
+
+        if table is None:
+            if "error" in message:
+                print("{} websocket error: {}".format(self.client.name, message["error"]))
+            return []
+
+        # Rows of several symbols can share a message
+        channels = [(table, message)]
+        rows_by_symbol = defaultdict(list)
+
+        for row in message.get("data", ()):
+            if "symbol" in row:
+                rows_by_symbol[row["symbol"]].append(row)
+
+        for symbol, rows in rows_by_symbol.items():
+            channels.append((table + ":" + symbol, message if len(rows_by_symbol) == 1 else dict(message, data=rows)))
+
+        return channels
+
+class KucoinWebsocket(Websocket):
+    # Channels are KuCoin topics, "/market/ticker:BTC-USDT", "/market/match:BTC-USDT", "/spotMarket/tradeOrders", ...
+    # Callbacks get the message ({"topic", "subject", "data"}). Topics under /spotMarket/trade... and /account/ are private.
+    private_topics = ("/spotMarket/tradeOrders", "/spotMarket/advancedOrders", "/account/")
+
+    def _connection_url(self) -> typing.Union[str, None]:
+        # Every connection needs a new token, private channels need the authenticated one
+        private = bool(self.client._public_key and self.client._secret_key)
+        response = self.client._request("POST", "/api/v1/bullet-private" if private else "/api/v1/bullet-public", use_headers=private)
+
+        if response is None or response.get("code") != "200000":
+            return None
+
+        data = response["data"]
+        server = data["instanceServers"][0]
+        self.ping_interval = server.get("pingInterval", self.ping_interval * 1000) / 1000
+        return "{}?token={}&connectId={}".format(server["endpoint"], data["token"], next(self._ids))
+
+    def _is_private(self, channel:str) -> bool:
+        return channel.startswith(self.private_topics)
+
+    def _subscribe_message(self, channels:typing.List[str]):
+        # One message per channel so the acks match the topics
+        for channel in channels[:-1]:
+            self._send(self._topic_message("subscribe", channel))
+        return self._topic_message("subscribe", channels[-1])
+
+    def _unsubscribe_message(self, channels:typing.List[str]):
+        for channel in channels[:-1]:
+            self._send(self._topic_message("unsubscribe", channel))
+        return self._topic_message("unsubscribe", channels[-1])
+
+    def _topic_message(self, action:str, channel:str) -> typing.Dict:
+        return { "id": str(next(self._ids)), "type": action, "topic": channel, "privateChannel": self._is_private(channel), "response": True }
+
+    def _ping_message(self):
+        return { "id": str(next(self._ids)), "type": "ping" }
+
+    def _parse(self, message) -> typing.List[typing.Tuple[str, typing.Any]]:
+        if message.get("type") == "message":
+            return [(message["topic"], message)]
+        if message.get("type") == "error":
+            print("{} websocket error: {}".format(self.client.name, message.get("data")))
+        return []
@@ -1,5 +1,7 @@
 
 from os import name
+import glob
+import typing
 import os.path
 import numpy as np
 import pandas as pd
@@ -9,73 +11,243 @@ from requests.api import get
 from Connector.Bitmex import Bitmex
 
 from Connector.Client import Client
+from Connector.Metrics import Metrics
+from Database.Storage import COLUMNS, Storage, CsvStorage, NpyStorage, normalize_dataframe
+from Database.ResampleCache import ResampleCache
+from Utility import Timestamp
+from Utility.Utility import time_frame_seconds, resample_dataframe, fill_candle_gaps
+
+# The old KuCoin parser stored the close as "high", the high as "low" and the low as "close"
+LEGACY_KUCOIN_COLUMNS = { "high": "close", "low": "high", "close": "low" }
+
+def fix_legacy_kucoin_columns(dataframe:pd.DataFrame) -> pd.DataFrame:
+    # Candles of a legacy KuCoin csv file under their real names. Those files have lows above their highs,
+    # correctly mapped candles (e.g. exported files) never do and are returned unchanged.
+    if not (dataframe["low"] > dataframe["high"]).any():
+        return dataframe
+    return dataframe.rename(columns=LEGACY_KUCOIN_COLUMNS)[list(dataframe.columns)]
+
+def compact_dataframe(dataframe:pd.DataFrame, columns:typing.Union[typing.List[str], None]=None, dtype=None, volume_scale:typing.Union[float, None]=None) -> pd.DataFrame:
+    # Projection and dtype conversion of a candle frame. Columns that keep their dtype stay views of the stored
+    # (memory mapped) arrays, each one its own Series so pandas doesn't consolidate them into a copied block
+    columns = columns or [column for column in COLUMNS if column in dataframe.columns]
+    index = pd.Index(dataframe.index.to_numpy(dtype=np.int64), name="date", copy=False)
+    series = dict()
+    
+    for column in columns:
+        values = dataframe[column].to_numpy()
+        
+        if column == "volume" and volume_scale is not None:
+            scaled = np.round(np.nan_to_num(values.astype(np.float64, copy=False)) * volume_scale)
+            # The smallest integer type that holds the largest volume
+            values = scaled.astype(np.int32 if scaled.shape[0] == 0 or np.abs(scaled).max() <= np.iinfo(np.int32).max else np.int64)
+        elif column != "volume" and dtype is not None:
+            values = values.astype(dtype, copy=False)
+        
+        series[column] = pd.Series(values, index=index, copy=False)
+    
+    return pd.DataFrame(series, copy=False)
 
 class Database: 
-    def __init__(self, path:str):
+    def __init__(self, path:str, storage:typing.Union[Storage, None]=None):
         self.path = path
+        # Binary column storage for the candles, csv files are only used for import and export
+        self.storage = storage if storage is not None else NpyStorage(path)
+        self.csv = CsvStorage(path)
+        self.resample_cache = ResampleCache(self.storage)
         
     def add_data(self, client:Client, symbol:str, start=None, end=None):
-        symbol_is_valid = False
         symbol = symbol.upper()
         
-        for instrument in client.instruments:
-            if instrument.upper() == symbol:
-                symbol_is_valid = True
-                break
-            
-        if symbol_is_valid == False:
+        if client.get_instrument(symbol) is None:
             print("Symbol '{}' is not a valid symbol in the {} database.".format(symbol, client.name))
             return None
         # If start and end are none -> Get latest data
-        # If start -> Write older data
-        filename = client.name + "_" + symbol + ".csv"
-
-        if self._does_file_exist(file=filename) == False: # Inital data
-            data = client.get_historical_data(symbol=symbol, start=start, end=end)
-            return self._write_initial_data(client, filename, symbol, data)
-        elif self._does_file_exist(file=filename) == True and start is None and end is None:
-            return self._write_latest_data(client=client, symbol=symbol)
-        elif self._does_file_exist(file=filename) == True and start is not None and end is None:
-            return self._write_older_data(client=client, symbol=symbol, start_date=start)
-        elif self._does_file_exist(file=filename) == True and start is not None: # There was a new start and end so create a new data set or a specific start and end time was given
-            data = client.get_historical_data(symbol=symbol, start=start, end=end)
-            return self._write_initial_data(client, filename, symbol, data)
-        else:
+        # If start -> Also write older data
+        filename = client.name + "_" + symbol
+        
+        if start is None and end is not None:
             print("You must supply a start time if you supply an end time.")
+            return None
+        
+        stored = self._read(filename) if self._does_file_exist(file=filename) else None
+
+        if stored is None or stored.shape[0] == 0: # Inital data
+            return self._write_initial_data(client, filename, symbol, start, end)
+        
+        # Only the ranges missing before the first and after the last stored candle are downloaded
+        first_date, last_date = int(stored.index[0]), int(stored.index[-1])
+        del stored
+        
+        if start is not None and Timestamp.to_epoch([start])[0] < first_date:
+            self._write_older_data(client=client, symbol=symbol, start_date=start, end_date=first_date)
+        if end is None or Timestamp.to_epoch([end])[0] > last_date:
+            self._write_latest_data(client=client, symbol=symbol, last_date=last_date, end_date=end)
+            
+        return self.get_data(client_name=client.name, symbol=symbol)
             
-    def get_data(self, client_name:str, symbol:str):
-        filename =  client_name + "_" + symbol + ".csv"
-        return pd.read_csv(self.path + filename, parse_dates=True, index_col=["date"])
+    def get_data(self, client_name:str, symbol:str, time_frame:typing.Union[str, None]=None, columns:typing.Union[typing.List[str], None]=None,
+                 dtype=None, volume_scale:typing.Union[float, None]=None, datetime_index=True):
+        # time_frame="30m", "1h", ... returns resampled candles, see Utility.time_frames.
+        # Memory-conscious loading: columns only loads those fields, dtype=np.float32 stores the prices in 4 bytes,
+        # volume_scale stores the volume as the integer round(volume * volume_scale) and datetime_index=False keeps the int64 epoch index.
+        # The default stays every float64 column: float32 keeps about 7 significant digits, so prices, levels and fills would round.
+        # Strategy runs load only the strategy's columns (Portfolio.from_database does), e.g. columns=FibonacciRetracement.columns
+        # with dtype=np.float32 is 12 instead of 48 bytes per candle.
+        name = client_name + "_" + symbol
+        # Resampling needs every column, the projection is done afterwards
+        dataframe = self._read(name, columns=columns if time_frame is None else None)
+        
+        if dataframe is None:
+            print("No data stored for '{}' in the {} database.".format(symbol, client_name))
+            return None
+        
+        if time_frame in time_frame_seconds:
+            resampled = self.resample_cache.get(name, time_frame, raw=dataframe)
+            # An empty store has nothing to resample and is returned as it is
+            if resampled is not None:
+                del dataframe
+                dataframe = fill_candle_gaps(resampled, time_frame_seconds[time_frame])
+        elif time_frame is not None:
+            # Calendar time frames (W, M, Q) don't line up with the epoch and aren't cached
+            dataframe = resample_dataframe(Timestamp.ensure_datetime_index(dataframe), time_frame)
+            dataframe.index = Timestamp.to_epoch(dataframe.index)
+        
+        if columns is not None or dtype is not None or volume_scale is not None:
+            dataframe = compact_dataframe(dataframe, columns=columns, dtype=dtype, volume_scale=volume_scale)
+        
+        # The int64 epoch index is reinterpreted as datetimes without parsing
+        if datetime_index:
+            dataframe.index = Timestamp.to_datetime_index(dataframe.index)
+        return dataframe
+    
+    def import_csv(self, client_name:str, symbol:str):
+        # Moves a legacy Data/<Client>_<SYMBOL>.csv file into the storage backend
+        name = client_name + "_" + symbol
+        dataframe = self.csv.read(name)
+        
+        if dataframe is not None and client_name == "Kucoin":
+            dataframe = fix_legacy_kucoin_columns(dataframe)
+        if dataframe is not None:
+            self.storage.write(name, dataframe)
+        
+        return dataframe
     
-    def _write_latest_data(self, client: Client,  symbol:str):
+    def repair_legacy_kucoin_import(self, client_name:str, symbol:str) -> int:
+        # Stores imported before the legacy KuCoin columns were remapped. Stored rows that still hold the csv file's
+        # values are replaced with the remapped candles, rows downloaded since are kept. Returns the repaired row count.
+        name = client_name + "_" + symbol
+        legacy = self.csv.read(name) if client_name == "Kucoin" else None
+        stored = self.storage.read(name)
+        
+        if legacy is None or stored is None or fix_legacy_kucoin_columns(legacy) is legacy:
+            return 0
+        
+        fixed = fix_legacy_kucoin_columns(legacy)[COLUMNS].to_numpy()
+        _, stored_rows, legacy_rows = np.intersect1d(stored.index.to_numpy(), legacy.index.to_numpy(), assume_unique=True, return_indices=True)
+        values = stored[COLUMNS].to_numpy(copy=True)
+        unchanged = (values[stored_rows] == legacy[COLUMNS].to_numpy()[legacy_rows]).all(axis=1)
+        
+        if unchanged.any():
+            values[stored_rows[unchanged]] = fixed[legacy_rows[unchanged]]
+            self.storage.write(name, pd.DataFrame(values, index=stored.index.to_numpy(copy=True), columns=COLUMNS))
+        
+        return int(unchanged.sum())
+    
+    def export_csv(self, client_name:str, symbol:str):
+        name = client_name + "_" + symbol
+        dataframe = self.storage.read(name)
+        
+        if dataframe is not None:
+            self.csv.write(name, dataframe)
+            
+        return dataframe
+    
+    def migrate_csv_files(self):
+        # One shot migration of every legacy csv file in the database path
+        migrated = []
+        
+        for file in sorted(glob.glob(self.path + "*.csv")):
+            name = os.path.splitext(os.path.basename(file))[0]
+            
+            if "_" not in name:
+                continue
+            
+            client_name, symbol = name.split("_", 1)
+            if self.storage.exists(name):
+                repaired = self.repair_legacy_kucoin_import(client_name=client_name, symbol=symbol)
+                if repaired > 0:
+                    print("Repaired the columns of {} legacy candles of {}.".format(repaired, name))
+                continue
+            
+            self.import_csv(client_name=client_name, symbol=symbol)
+            migrated.append(name)
+            print("Migrated {} to {}.".format(file, type(self.storage).__name__))
+            
+        return migrated
+    
+    def _read(self, name:str, columns:typing.Union[typing.List[str], None]=None):
+        if not self.storage.exists(name) and self.csv.exists(name):
+            client_name, symbol = name.split("_", 1)
+            self.import_csv(client_name=client_name, symbol=symbol)
+        
+        return self.storage.read(name, columns=columns)
+    
+    def _write_stream(self, name:str, stream, metrics:Metrics, before_date:typing.Union[int, None]=None):
+        # Every chunk is stored as soon as it arrives, an interrupted download keeps what it already wrote.
+        # The time spent waiting for chunks and writing them goes to the client's "fetch" and "db_write" stage timers.
+        stream = iter(stream)
+        
+        while True:
+            with metrics.timer("fetch"):
+                chunk = next(stream, None)
+            if chunk is None:
+                break
+            
+            if before_date is not None:
+                chunk = chunk[chunk.index < before_date]
+            if chunk.shape[0] > 0:
+                with metrics.timer("db_write"):
+                    self.storage.append(name, chunk)
+    
+    def _write_latest_data(self, client: Client,  symbol:str, last_date:int, end_date=None):
         symbol = symbol.upper()
- 
-        dataframe = self.get_data(client_name=client.name, symbol=symbol)
-        start_date = dataframe.head(1).index
-        data = client.get_historical_data(symbol=symbol, start=start_date)
-        df = pd.DataFrame(data=data)
-       # df['date'] = pd.to_datetime(df['date'].astype(str), format='%Y-%m-%dT%H:%M:%S.%fZ')
-        df.set_index("date",inplace=True)
-        df.to_csv(self.path + client.name + '_' + symbol + '.csv')
-        return self.get_data(client_name=client.name, symbol=symbol)
+        
+        # The last stored candle is downloaded again since it may have still been open
+        stream = client.get_historical_data(symbol=symbol, start=last_date, end=end_date, stream=True)
+        self._write_stream(client.name + '_' + symbol, stream, client.metrics)
             
-    def _write_older_data(self, client: Client, symbol:str, start_date:str):
+    def _write_older_data(self, client: Client, symbol:str, start_date:str, end_date:int):
         symbol = symbol.upper()
+        name = client.name + '_' + symbol
+        partial = name + ".partial"
         
-        data= client.get_historical_data(symbol=symbol, start=start_date)
-        df = pd.DataFrame(data=data)
-        df.set_index("date",inplace=True)
-        df.to_csv(self.path + client.name + '_' + symbol + '.csv')
-        return self.get_data(client_name=client.name, symbol=symbol)
+        # Older candles are collected in a separate partial data set and merged in front of the stored ones at the end.
+        # An interrupted backfill resumes after the last candle in the partial data set.
+        stored = self.storage.read(partial)
+        if stored is not None and stored.shape[0] > 0:
+            start_date = int(stored.index[-1])
+        del stored
+        
+        stream = client.get_historical_data(symbol=symbol, start=start_date, end=end_date, stream=True)
+        self._write_stream(partial, stream, client.metrics, before_date=end_date)
         
-    def _write_initial_data(self, client:Client, filename:str, symbol:str, data):
-        df = pd.DataFrame(data=data)
-        df.set_index("date",inplace=True)
-        df.to_csv(self.path + filename)
+        older = self.storage.read(partial)
+        if older is not None:
+            self.storage.append(name, older)
+            del older
+            self.storage.delete(partial)
+        
+    def _write_initial_data(self, client:Client, filename:str, symbol:str, start=None, end=None):
+        self._write_stream(filename, client.get_historical_data(symbol=symbol, start=start, end=end, stream=True), client.metrics)
+        
+        if not self.storage.exists(filename):
+            print("No candle data is availiable.")
+            return None
         return self.get_data(client_name=client.name, symbol=symbol)
    
     def _does_file_exist(self, file:str) -> bool:
-        return os.path.exists(path=self.path + file)
+        return self.storage.exists(file) or self.csv.exists(file)
     
     def _is_file_empty(self, file:str):
         if(self._does_file_exist(self.path + file)):
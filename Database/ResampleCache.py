@@ -0,0 +1,68 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Database.Storage import Storage
+from Utility.Utility import time_frame_seconds, resample_candles
+
+class ResampleCache:
+    # Resampled candles per (exchange, symbol, time frame), stored next to the raw candles as "<Client>_<SYMBOL>.<time frame>".
+    # Only the trailing (possibly still open) bucket and newer ones are recomputed when candles are added, reads that
+    # find nothing new don't write. A coarse time frame is built from the largest finer one already cached (4h from 1h)
+    # instead of the raw candles.
+    def __init__(self, storage:Storage):
+        self.storage = storage
+
+    def get(self, name:str, time_frame:str, raw:typing.Union[pd.DataFrame, None]=None) -> typing.Union[pd.DataFrame, None]:
+        # raw is the stored candles of `name` when the caller already read them
+        raw = raw if raw is not None else self.storage.read(name)
+
+        if raw is None or raw.shape[0] == 0:
+            return None
+        return self._update(name, raw, time_frame)
+
+    def _cache_name(self, name:str, time_frame:str) -> str:
+        return name + "." + time_frame
+
+    def _source_time_frame(self, name:str, time_frame:str) -> typing.Union[str, None]:
+        seconds = time_frame_seconds[time_frame]
+        sources = [source for source, source_seconds in time_frame_seconds.items()
+                   if source_seconds < seconds and seconds % source_seconds == 0 and self.storage.exists(self._cache_name(name, source))]
+
+        return max(sources, key=lambda source: time_frame_seconds[source]) if len(sources) > 0 else None
+
+    def _update(self, name:str, raw:pd.DataFrame, time_frame:str) -> pd.DataFrame:
+        seconds = time_frame_seconds[time_frame]
+        source_time_frame = self._source_time_frame(name, time_frame)
+        source = raw if source_time_frame is None else self._update(name, raw, source_time_frame)
+
+        cache_name = self._cache_name(name, time_frame)
+        cached = self.storage.read(cache_name)
+        source_dates = source.index.to_numpy(dtype=np.int64)
+
+        if cached is None or cached.shape[0] == 0 or not self._first_bucket_matches(source, cached, seconds):
+            # Nothing cached yet or older candles were added in front, build it from scratch
+            self.storage.write(cache_name, resample_candles(source, seconds))
+        else:
+            last_bucket = int(cached.index[-1])
+            tail = resample_candles(source.iloc[np.searchsorted(source_dates, last_bucket, side="left"):], seconds)
+            
+            # The source's tail still resamples to the cached last bucket, nothing was added since the last update
+            if tail.shape[0] == 1 and np.array_equal(tail.to_numpy(), cached.iloc[-1:].to_numpy(), equal_nan=True):
+                return cached
+            
+            del cached
+            self.storage.append(cache_name, tail)
+
+        return self.storage.read(cache_name)
+
+    def _first_bucket_matches(self, source:pd.DataFrame, cached:pd.DataFrame, seconds:int) -> bool:
+        first_bucket = int(cached.index[0])
+        source_dates = source.index.to_numpy(dtype=np.int64)
+
+        if source_dates[0] < first_bucket:
+            return False
+
+        head = resample_candles(source.iloc[:np.searchsorted(source_dates, first_bucket + seconds, side="left")], seconds)
+        return head.shape[0] == 1 and np.array_equal(head.to_numpy(), cached.iloc[:1].to_numpy(), equal_nan=True)
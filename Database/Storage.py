@@ -0,0 +1,185 @@
+import io
+import os
+import os.path
+import shutil
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Utility import Timestamp
+
+# Every backend stores an int64 epoch (seconds) "date" index and float64 OHLCV columns
+COLUMNS = ["open", "high", "low", "close", "volume"]
+
+def normalize_dataframe(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # Brings any candle frame (legacy csv, client data) to the storage layout, sorted by date
+    if "date" in dataframe.columns:
+        dataframe = dataframe.set_index("date")
+
+    dates = Timestamp.to_epoch(dataframe.index)
+    order = np.argsort(dates, kind="stable")
+
+    # Candles with the same timestamp are de-duplicated, the last one received wins
+    dates = dates[order]
+    keep = np.ones(dates.shape[0], dtype=bool)
+    keep[:-1] = dates[1:] != dates[:-1]
+    order = order[keep]
+
+    columns = { column: dataframe[column].to_numpy(dtype=np.float64)[order] for column in COLUMNS }
+    return pd.DataFrame(columns, index=pd.Index(dates[keep], name="date"), copy=False)
+
+def merge_dataframes(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    # Rows of the new frame replace stored rows with the same timestamp
+    return normalize_dataframe(pd.concat([old, new]))
+
+class Storage:
+    extension = ""
+
+    def __init__(self, path:str):
+        self.path = path
+
+    def exists(self, name:str) -> bool:
+        pass
+
+    def read(self, name:str, columns:typing.Union[typing.List[str], None]=None) -> typing.Union[pd.DataFrame, None]:
+        # columns picks a subset of COLUMNS, all of them by default
+        pass
+
+    def write(self, name:str, dataframe:pd.DataFrame):
+        pass
+
+    def delete(self, name:str):
+        if self.exists(name):
+            os.remove(self.path + name + self.extension)
+
+    def append(self, name:str, dataframe:pd.DataFrame):
+        # Generic merge, backends that can grow their files in place override this
+        stored = self.read(name)
+        self.write(name, dataframe if stored is None else merge_dataframes(stored, dataframe))
+
+class CsvStorage(Storage):
+    # Legacy format, kept for importing and exporting
+    extension = ".csv"
+
+    def exists(self, name:str) -> bool:
+        return os.path.exists(self.path + name + self.extension)
+
+    def read(self, name:str, columns:typing.Union[typing.List[str], None]=None) -> typing.Union[pd.DataFrame, None]:
+        if not self.exists(name):
+            return None
+        dataframe = normalize_dataframe(pd.read_csv(self.path + name + self.extension, index_col=["date"]))
+        return dataframe if columns is None else dataframe[columns]
+
+    def write(self, name:str, dataframe:pd.DataFrame):
+        dataframe.to_csv(self.path + name + self.extension)
+
+class NpyStorage(Storage):
+    # One memory mapped .npy file per column in a "<name>/" directory, reads are near zero-copy
+    def _column_path(self, name:str, column:str) -> str:
+        return os.path.join(self.path + name, column + ".npy")
+
+    def exists(self, name:str) -> bool:
+        return os.path.exists(self._column_path(name, "date"))
+
+    def read(self, name:str, columns:typing.Union[typing.List[str], None]=None) -> typing.Union[pd.DataFrame, None]:
+        if not self.exists(name):
+            return None
+
+        # Copy on write, so callers can edit the frame without touching the files. Only the requested columns are mapped.
+        # The date column is written last, its length is the number of complete rows.
+        # Every column is its own Series so pandas keeps one block per memory map instead of consolidating them into a copy.
+        dates = np.load(self._column_path(name, "date"), mmap_mode="c")
+        index = pd.Index(dates, name="date", copy=False)
+        columns = { column: pd.Series(np.load(self._column_path(name, column), mmap_mode="c")[:dates.shape[0]], index=index, copy=False)
+                    for column in (columns or COLUMNS) }
+        return pd.DataFrame(columns, copy=False)
+
+    def delete(self, name:str):
+        shutil.rmtree(self.path + name, ignore_errors=True)
+
+    def write(self, name:str, dataframe:pd.DataFrame):
+        os.makedirs(self.path + name, exist_ok=True)
+
+        arrays = { column: dataframe[column].to_numpy(dtype=np.float64) for column in COLUMNS }
+        arrays["date"] = dataframe.index.to_numpy(dtype=np.int64)
+
+        # Write everything to temporary files first so a crash never leaves a half written set of columns
+        for column, array in arrays.items():
+            with open(self._column_path(name, column) + ".tmp", "wb") as file:
+                np.save(file, array)
+        for column in arrays:
+            os.replace(self._column_path(name, column) + ".tmp", self._column_path(name, column))
+
+    def append(self, name:str, dataframe:pd.DataFrame):
+        new_dates = dataframe.index.to_numpy(dtype=np.int64)
+        count, last_date = 0, None
+
+        # Only the row count and the last date of the stored candles are needed, the columns aren't touched
+        if self.exists(name):
+            stored_dates = np.load(self._column_path(name, "date"), mmap_mode="r")
+            count = stored_dates.shape[0]
+            last_date = int(stored_dates[-1]) if count > 0 else None
+            del stored_dates
+
+        # Only rows at or after the last stored candle can be appended, anything else is a full merge
+        if last_date is None or new_dates.shape[0] == 0 or new_dates[0] < last_date:
+            return super().append(name, dataframe)
+
+        # The last stored candle may have been incomplete, a new row with the same timestamp replaces it
+        row = count - 1 if new_dates[0] == last_date else count
+        arrays = { column: dataframe[column].to_numpy(dtype=np.float64) for column in COLUMNS }
+        arrays["date"] = new_dates
+
+        for column, array in arrays.items():
+            if not self._write_rows(self._column_path(name, column), row, array):
+                return super().append(name, dataframe)
+
+    def _write_rows(self, path:str, row:int, array:np.ndarray) -> bool:
+        # Writes the rows starting at the given row and fixes up the .npy header in place, O(new rows)
+        with open(path, "r+b") as file:
+            version = np.lib.format.read_magic(file)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+            shape, fortran_order, dtype = read_header(file)
+            header_length = file.tell()
+
+            header = io.BytesIO()
+            write_header(header, { "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": (row + array.shape[0],) })
+
+            # numpy pads the header so the length can grow, if it still doesn't fit rewrite the file
+            if header.tell() != header_length or dtype != array.dtype:
+                return False
+
+            file.seek(header_length + row * dtype.itemsize)
+            file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate()
+            file.seek(0)
+            file.write(header.getvalue())
+
+        return True
+
+class ParquetStorage(Storage):
+    # Columnar "<name>.parquet" files, needs pyarrow
+    extension = ".parquet"
+
+    def __init__(self, path:str):
+        super().__init__(path)
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetStorage requires pyarrow, install it or use NpyStorage.")
+        self._parquet = pyarrow.parquet
+
+    def exists(self, name:str) -> bool:
+        return os.path.exists(self.path + name + self.extension)
+
+    def read(self, name:str, columns:typing.Union[typing.List[str], None]=None) -> typing.Union[pd.DataFrame, None]:
+        if not self.exists(name):
+            return None
+        table = self._parquet.read_table(self.path + name + self.extension, columns=["date"] + (columns or COLUMNS), memory_map=True)
+        return table.to_pandas().set_index("date")
+
+    def write(self, name:str, dataframe:pd.DataFrame):
+        dataframe.reset_index().to_parquet(self.path + name + self.extension + ".tmp", index=False)
+        os.replace(self.path + name + self.extension + ".tmp", self.path + name + self.extension)
@@ -5,90 +5,173 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from Utility.Utility import reusable_array, rolling_max, rolling_min
+from Strategies.Indicators import MACD, RollingMax, RollingMin
+
+def _levels(prices:np.ndarray, ratios:typing.Tuple[float, ...], lookback:typing.Union[int, None]=None, out:typing.Union[np.ndarray, None]=None) -> np.ndarray:
+    # Levels of (bars, symbols) prices in get_levels order (max, one per ratio, min) stacked along the first axis.
+    # With a lookback they're (6, bars, symbols) from the swing high / low of the last `lookback` bars, without one
+    # (6, 1, symbols) from every bar. `out` is the array to write them to.
+    if lookback is None:
+        levels = out if out is not None else np.empty((6, 1) + prices.shape[1:])
+        # NaNs are skipped, a symbol without prices has NaN levels
+        levels[0] = np.fmax.reduce(prices, axis=0, keepdims=True, initial=np.nan)
+        levels[5] = np.fmin.reduce(prices, axis=0, keepdims=True, initial=np.nan)
+    else:
+        levels = out if out is not None else np.empty((6,) + prices.shape)
+        rolling_max(prices, lookback, out=levels[0])
+        rolling_min(prices, lookback, out=levels[5])
+    
+    min_max_diff = levels[0] - levels[5]
+    for level, ratio in zip(levels[1:5], ratios):
+        np.multiply(min_max_diff, -ratio, out=level)
+        level += levels[0]
+    return levels
+
+def _bounds(prices:np.ndarray, levels:np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    # (upper, lower) levels around every price like get_fib_lvls_for_price, a NaN price is below all of them
+    buckets = 4 - ((prices >= levels[1]).astype(np.int64) + (prices >= levels[2]) + (prices >= levels[3]) + (prices >= levels[4]))
+    levels = np.broadcast_to(levels, (6,) + prices.shape)
+    return np.take_along_axis(levels, buckets[np.newaxis], axis=0)[0], np.take_along_axis(levels, buckets[np.newaxis] + 1, axis=0)[0]
+
+def _macd(prices:pd.DataFrame, fast_span:int, slow_span:int, signal_span:int) -> typing.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # (fast_ema, slow_ema, macd, signal_line) down every column of the frame
+    fast_ema = prices.ewm(span=fast_span, adjust=False).mean()
+    slow_ema = prices.ewm(span=slow_span, adjust=False).mean()
+    macd     = fast_ema - slow_ema
+    return fast_ema, slow_ema, macd, macd.ewm(span=signal_span, adjust=False).mean()
+
+def _signals(prices:np.ndarray, levels:np.ndarray, macd:np.ndarray, signal_line:np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    # Boolean (buys, sells) of (bars, symbols) arrays, `levels` from _levels.
+    # A bar is a candidate when the price hits the upper or lower level of the previous close, a buy when the signal
+    # line is above the MACD and a sell when it's below. Only the flag state machine is sequential, it walks the
+    # candidate bars of every symbol as plain python values.
+    buys  = np.zeros(prices.shape, dtype=bool)
+    sells = np.zeros(prices.shape, dtype=bool)
+    
+    if prices.shape[0] < 2:
+        return buys, sells
+    
+    upper_level, lower_level = _bounds(prices, levels)
+    hit = np.zeros(prices.shape, dtype=bool)
+    hit[1:] = (prices[1:] >= upper_level[:-1]) | (prices[1:] <= lower_level[:-1])
+    
+    buy_candidates  = hit & (signal_line > macd)
+    sell_candidates = hit & (signal_line < macd)
+    
+    # Candidates ordered by symbol then bar, the state starts over at every symbol
+    symbols, bars = np.nonzero((buy_candidates | sell_candidates).T)
+    buy_bars, sell_bars = [], []
+    current, flag, last_buy_price = -1, 0, 0
+    
+    for symbol, index, price, is_buy in zip(symbols.tolist(), bars.tolist(), prices[bars, symbols].tolist(), buy_candidates[bars, symbols].tolist()):
+        if symbol != current:
+            current, flag, last_buy_price = symbol, 0, 0
+        
+        if is_buy and flag == 0:
+            last_buy_price = price
+            buy_bars.append((index, symbol))
+            flag = 1
+        elif not is_buy and flag == 1 and price >= last_buy_price:
+            sell_bars.append((index, symbol))
+            flag = 0
+    
+    for bars, result in ((buy_bars, buys), (sell_bars, sells)):
+        if len(bars) > 0:
+            result[tuple(np.array(bars).T)] = True
+    
+    return buys, sells
+
 class FibonacciRetracement:
-    def __init__(self, dataframe: pd.DataFrame, src="close"):
+    # Columns Portfolio needs to run the strategy on many symbols
+    columns = ["close"]
+    
+    def __init__(self, dataframe: pd.DataFrame, src="close", fast_span=12, slow_span=26, signal_span=9, ratios=(0.236, 0.382, 0.5, 0.618), lookback:typing.Union[int, None]=None,
+                 keep_intermediate=False, buffers:typing.Union[typing.Dict[str, np.ndarray], None]=None):
+        # Only backtest's buy / sell columns are added to the frame, the MACD and signal line stay on the strategy
+        # as their own series, keep_intermediate=True adds them too. See Utility.reusable_array for buffers.
         self.dataframe = dataframe
+        self.lookback = lookback
+        self.keep_intermediate = keep_intermediate
+        self.buffers = buffers
         
-        self.max_price    = self.dataframe[src].max()
-        self.min_price    = self.dataframe[src].min()
-        min_max_diff      = self.max_price - self.min_price
+        # Levels from the whole frame without a lookback (every bar sees future prices), per bar without lookahead with one.
+        # self.levels is (6, 1) or (6, bars) in get_levels order, get_fib_lvls looks them up there
+        prices = self.dataframe[src].to_numpy(dtype=np.float64).reshape(-1, 1)
+        shape  = (6, 1, 1) if lookback is None else (6, prices.shape[0], 1)
+        self.levels = _levels(prices, ratios, lookback, out=reusable_array(buffers, "levels", shape))[..., 0]
         
-        # Calculating the retracement levels
-        self.first_level  = self.max_price - min_max_diff * 0.236
-        self.second_level = self.max_price - min_max_diff * 0.382
-        self.third_level  = self.max_price - min_max_diff * 0.5
-        self.fourth_level = self.max_price - min_max_diff * 0.618
+        if lookback is None:
+            self.max_price, self.first_level, self.second_level, self.third_level, self.fourth_level, self.min_price = self.levels[:, 0].tolist()
+        else:
+            self.max_price, self.first_level, self.second_level, self.third_level, self.fourth_level, self.min_price = self.levels
         
         # Using the MACD for this fibonacci strategy
-        self.fast_ema    = self.dataframe[src].ewm(span=12, adjust=False).mean()
-        self.slow_ema    = self.dataframe[src].ewm(span=26, adjust=False).mean()
-        self.macd        = self.fast_ema - self.slow_ema
-        self.signal_line = self.macd.ewm(span=9, adjust=False).mean()
-        
-        self.dataframe["buy_and_hold_returns"]  = self.dataframe["close"].pct_change()
-        self.dataframe["buy_and_hold_creturns"] = self.dataframe["buy_and_hold_returns"].cumsum().apply(np.exp)
-        self.dataframe["macd"]                  = self.macd
-        self.dataframe["signal_line"]           = self.signal_line
-        
-    def get_fib_lvls_for_price(self, price:float):
-        if price >= self.first_level:
-            return (self.max_price, self.first_level)
-        elif price >= self.second_level:
-            return (self.first_level, self.second_level)
-        elif price >= self.third_level:
-            return (self.second_level, self.third_level)
-        elif price >= self.fourth_level:
-            return (self.third_level, self.fourth_level)
+        self.fast_ema, self.slow_ema, self.macd, self.signal_line = [frame[src] for frame in _macd(self.dataframe[[src]], fast_span, slow_span, signal_span)]
+        
+        if self.keep_intermediate:
+            self.dataframe["buy_and_hold_returns"]  = self.dataframe["close"].pct_change()
+            self.dataframe["buy_and_hold_creturns"] = self.dataframe["buy_and_hold_returns"].add(1).cumprod()
+            self.dataframe["macd"]                  = self.macd
+            self.dataframe["signal_line"]           = self.signal_line
+        
+    def get_levels(self):
+        # [max, first, second, third, fourth, min], scalars or per bar arrays with a lookback
+        return [self.max_price, self.first_level, self.second_level, self.third_level, self.fourth_level, self.min_price]
+    
+    def get_fib_lvls_for_price(self, price:float, index=-1):
+        # With a lookback the levels of the bar at `index` are used
+        max_price, first_level, second_level, third_level, fourth_level, min_price = self.get_levels()
+        
+        if self.lookback is not None:
+            max_price, first_level, second_level, third_level, fourth_level, min_price = [level[index] for level in self.get_levels()]
+        
+        if price >= first_level:
+            return (max_price, first_level)
+        elif price >= second_level:
+            return (first_level, second_level)
+        elif price >= third_level:
+            return (second_level, third_level)
+        elif price >= fourth_level:
+            return (third_level, fourth_level)
         else:
-            return (self.fourth_level, self.min_price)
+            return (fourth_level, min_price)
+    
+    def get_fib_lvls(self, prices:np.ndarray):
+        # Vectorized get_fib_lvls_for_price, returns the (upper, lower) level arrays for every price.
+        # With a lookback the prices must line up with the bars of the frame.
+        return _bounds(np.asarray(prices, dtype=np.float64), self.levels)
     
     def backtest(self):
         # If signal line crosses above the MACD and the current price crossed above or below the last fib level
         # If signal line crosses below the MACD and the current price crossed above or below the last fib level
+        prices = self.dataframe["close"].to_numpy(dtype=np.float64)
+        buys, sells = _signals(prices.reshape(-1, 1), self.levels[..., np.newaxis], self.macd.to_numpy(dtype=np.float64).reshape(-1, 1),
+                               self.signal_line.to_numpy(dtype=np.float64).reshape(-1, 1))
         
-        buy_list = []
-        sell_list = []
-        flag = 0
-        last_buy_price = 0
-        upper_level, lower_level = None, None
-        
-        for index in range(0, self.dataframe.shape[0]):
-            # Get the price of the close index
-            price = self.dataframe["close"][index] 
-            
-            # If this the first index, get the current levels for that price.
-               
-            # Else if the other prices are greater than or equal to the upper level 
-            #or less than or equal to lower level, this means the price hit a
-            #a new fibonacci level.
-        
-            if index == 0:
-                upper_level, lower_level = self.get_fib_lvls_for_price(price=price)
-                buy_list.append(np.nan)
-                sell_list.append(np.nan)
-            elif price >= upper_level or price <= lower_level: 
-                # If the conditons are met and we purchased
-                if self.dataframe["signal_line"][index] > self.dataframe["macd"][index] and flag == 0:
-                    last_buy_price = price
-                    buy_list.append(price)
-                    sell_list.append(np.nan)
-                    flag = 1
-                elif self.dataframe["signal_line"][index] < self.dataframe["macd"][index] and flag == 1 and price >= last_buy_price:
-                    buy_list.append(np.nan)
-                    sell_list.append(price)
-                    flag = 0
-                else:
-                    buy_list.append(np.nan)
-                    sell_list.append(np.nan)
-            else:
-                buy_list.append(np.nan)
-                sell_list.append(np.nan)   
-                
-            upper_level, lower_level = self.get_fib_lvls_for_price(price=price)
-            
-        self.dataframe["buy_signal_price"] = buy_list
-        self.dataframe["sell_signal_price"] = sell_list
+        # The signal prices keep the dtype of the candles (e.g. float32 from Database.get_data), the columns are the arrays themselves
+        dtype = np.result_type(self.dataframe["close"].dtype, np.float32)
+        for column, signals in (("buy_signal_price", buys[:, 0]), ("sell_signal_price", sells[:, 0])):
+            signal_prices = reusable_array(self.buffers, column, prices.shape, dtype=dtype)
+            signal_prices.fill(np.nan)
+            np.copyto(signal_prices, prices, where=signals, casting="same_kind")
+            self.dataframe[column] = pd.Series(signal_prices, index=self.dataframe.index, copy=False)
+    
+    @staticmethod
+    def portfolio_signals(candles:typing.Dict[str, np.ndarray], src="close", fast_span=12, slow_span=26, signal_span=9, ratios=(0.236, 0.382, 0.5, 0.618),
+                          lookback:typing.Union[int, None]=None) -> typing.Tuple[np.ndarray, np.ndarray]:
+        # backtest for (time, symbol) arrays, returns the boolean (buy, sell) arrays
+        prices = candles[src]
+        _, _, macd, signal_line = _macd(pd.DataFrame(prices, copy=False), fast_span, slow_span, signal_span)
+        return _signals(prices, _levels(prices, ratios, lookback), macd.to_numpy(), signal_line.to_numpy())
                     
+    def _plot_levels(self):
+        for level, color in zip(self.get_levels(), ["red", "orange", "yellow", "green", "blue", "purple"]):
+            if self.lookback is None:
+                plt.axhline(level, linestyle="--", color=color, alpha=0.5)
+            else:
+                plt.plot(self.dataframe.index, level, linestyle="--", color=color, alpha=0.5)
+    
     def plot(self, figsize=(15,10), style="seaborn-pastel"):
         plt.style.use(style)
         plt.figure(figsize=figsize)
@@ -100,12 +183,7 @@ class FibonacciRetracement:
         plt.plot(self.dataframe.index, self.dataframe["close"])
         
         # Plotting the fib retracement lines
-        plt.axhline(self.max_price, linestyle="--", color='red', alpha=0.5)
-        plt.axhline(self.first_level, linestyle="--", color='orange', alpha=0.5)
-        plt.axhline(self.second_level, linestyle="--", color='yellow', alpha=0.5)
-        plt.axhline(self.third_level, linestyle="--", color='green', alpha=0.5)
-        plt.axhline(self.fourth_level, linestyle="--", color='blue', alpha=0.5)
-        plt.axhline(self.min_price, linestyle="--", color='purple', alpha=0.5)
+        self._plot_levels()
         
         plt.ylabel("Fibonacci")
         plt.xticks(rotation=45)
@@ -135,12 +213,7 @@ class FibonacciRetracement:
         plt.scatter(self.dataframe.index, self.dataframe["sell_signal_price"], color="red", marker="v", alpha=1)
         
         # Plotting the fib retracement lines
-        plt.axhline(self.max_price, linestyle="--", color='red', alpha=0.5)
-        plt.axhline(self.first_level, linestyle="--", color='orange', alpha=0.5)
-        plt.axhline(self.second_level, linestyle="--", color='yellow', alpha=0.5)
-        plt.axhline(self.third_level, linestyle="--", color='green', alpha=0.5)
-        plt.axhline(self.fourth_level, linestyle="--", color='blue', alpha=0.5)
-        plt.axhline(self.min_price, linestyle="--", color='purple', alpha=0.5)
+        self._plot_levels()
         
         plt.ylabel("Close Price $USD")
         plt.xlabel("Date")
@@ -154,4 +227,76 @@ class FibonacciRetracement:
         plt.ylabel('MACD')
         plt.xticks(rotation=45)
         
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+class FibonacciRetracementRunner:
+    # Live version of FibonacciRetracement.backtest with O(1) updates per closed candle.
+    # Levels come from the swing high / low of the last `lookback` candles, or of all candles so far without one
+    # (the backtest without a lookback uses the whole frame, including the future, so it can't be run live).
+    def __init__(self, fast_span=12, slow_span=26, signal_span=9, ratios=(0.236, 0.382, 0.5, 0.618), lookback:typing.Union[int, None]=None):
+        self.ratios = ratios
+        self.lookback = lookback
+        self.macd = MACD(fast_span, slow_span, signal_span)
+        self.high = RollingMax(lookback)
+        self.low = RollingMin(lookback)
+        
+        self.upper_level, self.lower_level = None, None
+        self.flag = 0
+        self.last_buy_price = 0
+        self.candles = 0
+        
+    def warm_up(self, dataframe:pd.DataFrame):
+        # Seeds the state from history (e.g. Database.get_data) with the vectorized backtest
+        if dataframe.shape[0] == 0:
+            return
+        
+        strategy = FibonacciRetracement(dataframe[["close"]].copy(), fast_span=self.macd.fast_ema.span, slow_span=self.macd.slow_ema.span, signal_span=self.macd.signal_ema.span,
+                                        ratios=self.ratios, lookback=self.lookback if self.lookback is not None else dataframe.shape[0], keep_intermediate=False)
+        strategy.backtest()
+        
+        close = dataframe["close"].to_numpy(dtype=np.float64)
+        self.macd.warm_up(close)
+        self.high.warm_up(close)
+        self.low.warm_up(close)
+        self.upper_level, self.lower_level = strategy.get_fib_lvls_for_price(close[-1], index=-1)
+        
+        buys = np.flatnonzero(~np.isnan(strategy.dataframe["buy_signal_price"].to_numpy()))
+        sells = np.flatnonzero(~np.isnan(strategy.dataframe["sell_signal_price"].to_numpy()))
+        self.flag = 1 if buys.shape[0] > 0 and (sells.shape[0] == 0 or buys[-1] > sells[-1]) else 0
+        self.last_buy_price = close[buys[-1]] if buys.shape[0] > 0 else 0
+        self.candles = dataframe.shape[0]
+        
+    def _fib_lvls_for_price(self, price:float, max_price:float, min_price:float):
+        min_max_diff = max_price - min_price
+        first_level, second_level, third_level, fourth_level = [max_price - min_max_diff * ratio for ratio in self.ratios]
+        
+        if price >= first_level:
+            return (max_price, first_level)
+        elif price >= second_level:
+            return (first_level, second_level)
+        elif price >= third_level:
+            return (second_level, third_level)
+        elif price >= fourth_level:
+            return (third_level, fourth_level)
+        else:
+            return (fourth_level, min_price)
+        
+    def update(self, price:float) -> typing.Tuple[float, float]:
+        # Returns the (buy, sell) signal price of this candle, NaN when there is none
+        macd, signal_line = self.macd.update(price)
+        max_price = self.high.update(price)
+        min_price = self.low.update(price)
+        buy, sell = np.nan, np.nan
+        
+        if self.candles > 0 and (price >= self.upper_level or price <= self.lower_level):
+            if signal_line > macd and self.flag == 0:
+                self.last_buy_price = price
+                buy = price
+                self.flag = 1
+            elif signal_line < macd and self.flag == 1 and price >= self.last_buy_price:
+                sell = price
+                self.flag = 0
+                
+        self.upper_level, self.lower_level = self._fib_lvls_for_price(price, max_price, min_price)
+        self.candles += 1
+        return buy, sell
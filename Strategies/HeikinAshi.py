@@ -1,49 +1,86 @@
-
 import typing
 
 import numpy as np 
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from Strategies.Indicators import HeikinAshiCandle
+from Utility.Utility import reusable_array
+
+def _heikin_ashi(open_prices:np.ndarray, high_prices:np.ndarray, low_prices:np.ndarray, close_prices:np.ndarray,
+                 out:typing.Union[typing.Tuple[np.ndarray, np.ndarray], None]=None) -> typing.Tuple[np.ndarray, np.ndarray]:
+    # (heikin_open, heikin_close) along the first axis, a 2D (time, symbol) array does every symbol at once.
+    # `out` is the (heikin_open, heikin_close) pair to write them to.
+    heikin_open, heikin_close = out if out is not None else (np.empty(close_prices.shape), np.empty(close_prices.shape))
+    heikin_open[-1:] = np.nan
+    np.add(open_prices[1:], close_prices[1:], out=heikin_open[:-1])
+    heikin_open[:-1] /= 2
+    
+    np.add(open_prices, close_prices, out=heikin_close)
+    heikin_close += high_prices
+    heikin_close += low_prices
+    heikin_close /= 4
+    return heikin_open, heikin_close
+
+def _signals(heikin_open:np.ndarray, heikin_close:np.ndarray, out:typing.Union[np.ndarray, None]=None) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (signals, buys, sells), the signal of the previous candle and whether it flipped to 1 (buy) or -1 (sell) here.
+    # `out` is the array to write the signals to.
+    signals = out if out is not None else np.empty(heikin_close.shape)
+    signals[:1] = np.nan
+    np.copyto(signals[1:], np.where(heikin_close[:-1] < heikin_open[:-1], 1.0, -1.0))
+    
+    flips = np.zeros(heikin_close.shape, dtype=bool)
+    flips[1:] = signals[1:] != signals[:-1]
+    return signals, flips & (signals == 1), flips & (signals == -1)
+
 class HeikinAshi:
-    def __init__(self, dataframe:pd.DataFrame):
+    # Columns Portfolio needs to run the strategy on many symbols
+    columns = ["open", "high", "low", "close"]
+    
+    def __init__(self, dataframe:pd.DataFrame, keep_intermediate=False, buffers:typing.Union[typing.Dict[str, np.ndarray], None]=None):
+        # Only the signal price columns are added to the caller's frame, the Heikin Ashi series stay on the strategy
+        # as arrays, keep_intermediate=True adds them too. See Utility.reusable_array for buffers.
         self.dataframe = dataframe
+        self.keep_intermediate = keep_intermediate
+        self.buffers = buffers
         
-        self.dataframe["buy_and_hold_returns"] = self.dataframe["close"].pct_change()
-        self.dataframe["buy_and_hold_creturns"] = self.dataframe["buy_and_hold_returns"].cumsum().apply(np.exp)
+        shape = (self.dataframe.shape[0],)
+        self.heikin_open, self.heikin_close = _heikin_ashi(*[self.dataframe[column].to_numpy(dtype=np.float64) for column in self.columns],
+                                                           out=(reusable_array(buffers, "heikin_open", shape), reusable_array(buffers, "heikin_close", shape)))
+        self.signals = None
         
-        self.dataframe["heikin_open"] = (self.dataframe["open"].shift(-1) + self.dataframe["close"].shift(-1)) / 2
-        self.dataframe["heikin_close"] = (self.dataframe["open"] + self.dataframe["close"] + self.dataframe["high"] + self.dataframe["low"]) / 4
+        if self.keep_intermediate:
+            self.dataframe["buy_and_hold_returns"] = self.dataframe["close"].pct_change()
+            self.dataframe["buy_and_hold_creturns"] = self.dataframe["buy_and_hold_returns"].add(1).cumprod()
+            
+            self.dataframe["heikin_open"] = self.heikin_open
+            self.dataframe["heikin_close"] = self.heikin_close
         
     def backtest(self):
         # Post the signals
         # when the data changed, post buy and sell
         
-        self.dataframe["signals"] = np.where(self.dataframe["heikin_close"] < self.dataframe["heikin_open"], 1, -1)
-        self.dataframe["signals"] = self.dataframe["signals"].shift(1)
-        
-        buy_prices = []
-        sell_prices = []
-        
-        for index in range(0, self.dataframe.shape[0]):
-            price = self.dataframe["close"][index]
-            if index != 0:
-                if self.dataframe["signals"][index - 1] != self.dataframe["signals"][index]:
-                    if self.dataframe["signals"][index] == 1:
-                        buy_prices.append(price)
-                        sell_prices.append(np.nan)
-                    elif self.dataframe["signals"][index] == -1:
-                        buy_prices.append(np.nan)
-                        sell_prices.append(price)
-                else:
-                    buy_prices.append(np.nan)
-                    sell_prices.append(np.nan)
-            else:
-                buy_prices.append(np.nan)
-                sell_prices.append(np.nan)
-                        
-        self.dataframe["buy_signal_price"] = buy_prices
-        self.dataframe["sell_signal_price"] = sell_prices
+        close_prices = self.dataframe["close"].to_numpy(dtype=np.float64)
+        
+        # Signal of the previous candle, the first candle has none
+        self.signals, buys, sells = _signals(self.heikin_open, self.heikin_close, out=reusable_array(self.buffers, "signals", close_prices.shape))
+        
+        if self.keep_intermediate:
+            self.dataframe["signals"] = self.signals
+        
+        # Same dtype as the close prices, float32 candles get float32 signal columns. The columns are the arrays themselves
+        dtype = np.result_type(self.dataframe["close"].dtype, np.float32)
+        for column, signals in (("buy_signal_price", buys), ("sell_signal_price", sells)):
+            prices = reusable_array(self.buffers, column, close_prices.shape, dtype=dtype)
+            prices.fill(np.nan)
+            np.copyto(prices, close_prices, where=signals, casting="same_kind")
+            self.dataframe[column] = pd.Series(prices, index=self.dataframe.index, copy=False)
+    
+    @staticmethod
+    def portfolio_signals(candles:typing.Dict[str, np.ndarray]) -> typing.Tuple[np.ndarray, np.ndarray]:
+        # backtest for (time, symbol) arrays of the columns, returns the boolean (buy, sell) arrays
+        _, buys, sells = _signals(*_heikin_ashi(*[candles[column] for column in HeikinAshi.columns]))
+        return buys, sells
         
     def plot_buy_and_sell(self,figsize=(15, 10), style="seaborn-pastel"):
         plt.style.use(style=style)
@@ -58,4 +95,43 @@ class HeikinAshi:
         plt.ylabel = "Close Prices $USD"
         
         plt.xticks(rotation=45)
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+class HeikinAshiRunner:
+    # Live version of HeikinAshi.backtest, one O(1) update per closed candle gives that candle's buy / sell price
+    def __init__(self):
+        self.candle = HeikinAshiCandle()
+        self.signal = np.nan
+        self.candles = 0
+        
+    def warm_up(self, dataframe:pd.DataFrame):
+        # Seeds the state from history, e.g. Database.get_data
+        if dataframe.shape[0] == 0:
+            return
+        
+        # A signal needs the candle before it, so the last three candles rebuild the state of the last two
+        last = dataframe.iloc[-3:]
+        self.candles = dataframe.shape[0] - last.shape[0]
+        self.candle.heikin_close = np.nan
+        self.signal = np.nan
+        
+        for open, high, low, close in last[["open", "high", "low", "close"]].to_numpy(dtype=np.float64).tolist():
+            self.update(open, high, low, close)
+        
+    def update(self, open:float, high:float, low:float, close:float) -> typing.Tuple[float, float]:
+        previous_heikin_open, previous_heikin_close = self.candle.update(open, high, low, close)
+        
+        # Signal of the previous candle, the first candle has none
+        signal = np.nan
+        if self.candles > 0:
+            signal = 1 if previous_heikin_close < previous_heikin_open else -1
+        
+        flip = self.candles > 0 and signal != self.signal
+        self.signal = signal
+        self.candles += 1
+        
+        if flip and signal == 1:
+            return close, np.nan
+        elif flip and signal == -1:
+            return np.nan, close
+        return np.nan, np.nan
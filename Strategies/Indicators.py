@@ -0,0 +1,133 @@
+import math
+import typing
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from Utility.Utility import rolling_max, rolling_min
+
+# Online versions of the indicators the strategies compute over whole frames. Every update is O(1) and gives
+# the same value as the pandas / numpy batch version at that bar. warm_up seeds the state from history
+# (e.g. Database.get_data) with the batch version and returns the batch values.
+
+class EMA:
+    # pd.Series.ewm(span=span, adjust=False).mean(), including how pandas carries the mean over NaNs
+    def __init__(self, span:int):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.value = math.nan
+        self._old_weight = 1.0
+
+    def update(self, value:float) -> float:
+        if self.value == self.value:
+            self._old_weight *= 1 - self.alpha
+            if value == value:
+                if self.value != value:
+                    self.value = (self._old_weight * self.value + self.alpha * value) / (self._old_weight + self.alpha)
+                self._old_weight = 1.0
+        elif value == value:
+            self.value = value
+
+        return self.value
+
+    def warm_up(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        result = pd.Series(values).ewm(span=self.span, adjust=False).mean().to_numpy()
+        observed = np.flatnonzero(~np.isnan(values))
+
+        if observed.shape[0] > 0:
+            self.value = float(result[-1])
+            # The weight of the mean decays for every NaN after the last observation
+            self._old_weight = (1 - self.alpha) ** (values.shape[0] - 1 - observed[-1])
+
+        return result
+
+class MACD:
+    def __init__(self, fast_span=12, slow_span=26, signal_span=9):
+        self.fast_ema = EMA(fast_span)
+        self.slow_ema = EMA(slow_span)
+        self.signal_ema = EMA(signal_span)
+        self.macd = math.nan
+        self.signal_line = math.nan
+
+    def update(self, value:float) -> typing.Tuple[float, float]:
+        self.macd = self.fast_ema.update(value) - self.slow_ema.update(value)
+        self.signal_line = self.signal_ema.update(self.macd)
+        return self.macd, self.signal_line
+
+    def warm_up(self, values) -> typing.Tuple[np.ndarray, np.ndarray]:
+        macd = self.fast_ema.warm_up(values) - self.slow_ema.warm_up(values)
+        signal_line = self.signal_ema.warm_up(macd)
+
+        if macd.shape[0] > 0:
+            self.macd, self.signal_line = float(macd[-1]), float(signal_line[-1])
+        return macd, signal_line
+
+class RollingMax:
+    # Max of the last `window` values (all values so far when window is None) with a monotonic deque, NaNs are skipped.
+    # Same as Utility.rolling_max.
+    batch = staticmethod(rolling_max)
+
+    def __init__(self, window:typing.Union[int, None]):
+        self.window = window
+        self.value = math.nan
+        self._index = -1
+        self._deque = deque()
+
+    def _replaces(self, new:float, old:float) -> bool:
+        return new >= old
+
+    def update(self, value:float) -> float:
+        self._index += 1
+
+        if self.window is None:
+            if value == value and (self.value != self.value or self._replaces(value, self.value)):
+                self.value = value
+            return self.value
+
+        if value == value:
+            while len(self._deque) > 0 and self._replaces(value, self._deque[-1][1]):
+                self._deque.pop()
+            self._deque.append((self._index, value))
+
+        while len(self._deque) > 0 and self._deque[0][0] <= self._index - self.window:
+            self._deque.popleft()
+
+        self.value = self._deque[0][1] if len(self._deque) > 0 else math.nan
+        return self.value
+
+    def warm_up(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        result = self.batch(values, self.window if self.window is not None else max(1, values.shape[0]))
+
+        if self.window is None:
+            self._index = values.shape[0] - 1
+            self.value = float(result[-1]) if values.shape[0] > 0 else math.nan
+        else:
+            # Only the values still inside the window matter for the next updates
+            tail = values[-self.window:]
+            self._index = values.shape[0] - tail.shape[0] - 1
+            for value in tail.tolist():
+                self.update(value)
+
+        return result
+
+class RollingMin(RollingMax):
+    batch = staticmethod(rolling_min)
+
+    def _replaces(self, new:float, old:float) -> bool:
+        return new <= old
+
+class HeikinAshiCandle:
+    # HeikinAshi takes a candle's heikin open from the next candle, so every update completes the previous candle.
+    def __init__(self):
+        self.heikin_close = math.nan
+        self.previous_heikin_open = math.nan
+        self.previous_heikin_close = math.nan
+
+    def update(self, open:float, high:float, low:float, close:float) -> typing.Tuple[float, float]:
+        self.previous_heikin_open = (open + close) / 2
+        self.previous_heikin_close = self.heikin_close
+        self.heikin_close = (open + close + high + low) / 4
+        return self.previous_heikin_open, self.previous_heikin_close
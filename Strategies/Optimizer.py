@@ -0,0 +1,105 @@
+import functools
+import inspect
+import itertools
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from Database.Storage import COLUMNS
+from Strategies.Performance import Performance
+
+def total_return(strategy, **kwargs) -> float:
+    # Performance's total return of the strategy's signals after fees and slippage, kwargs go to Performance (maker, slippage, ...)
+    return Performance.from_strategy(strategy, **kwargs).metrics()["total_return"]
+
+# Candles of the sweep, attached once per worker process from shared memory
+_worker_state = dict()
+
+def _attach(shared_name:str, rows:int, strategy_class, score):
+    memory = shared_memory.SharedMemory(name=shared_name)
+    block = np.ndarray((rows, len(COLUMNS) + 1), dtype=np.float64, buffer=memory.buf)
+
+    _worker_state["memory"] = memory
+    _worker_state["block"] = block
+    _worker_state["strategy_class"] = strategy_class
+    _worker_state["score"] = score
+    # Strategies that take buffers reuse the arrays of the worker's previous run, the score is taken before the next one
+    _worker_state["buffers"] = dict() if "buffers" in inspect.signature(strategy_class).parameters else None
+
+def _run_batch(batch:typing.List[typing.Dict]):
+    block = _worker_state["block"]
+    index = pd.DatetimeIndex(block[:, 0].view(np.int64).view("datetime64[s]"), name="date")
+    results = []
+
+    for params in batch:
+        # A new frame over the shared columns for every run, strategies add their own columns to it
+        dataframe = pd.DataFrame({ column: block[:, i + 1] for i, column in enumerate(COLUMNS) }, index=index, copy=False)
+        buffers = dict(buffers=_worker_state["buffers"]) if _worker_state["buffers"] is not None else dict()
+        strategy = _worker_state["strategy_class"](dataframe, **params, **buffers)
+        strategy.backtest()
+        results.append(_worker_state["score"](strategy))
+
+    return results
+
+class Optimizer:
+    # Runs a strategy's backtest for many parameter sets on a process pool and ranks them by score.
+    # The candles are copied once into shared memory, workers read them from there instead of receiving a pickled frame.
+    # kwargs go to the score, for total_return the Performance options (maker, taker_fee, slippage, ...).
+    def __init__(self, strategy_class, dataframe:pd.DataFrame, score=total_return, workers:typing.Union[int, None]=None, batch_size=16, **kwargs):
+        self.strategy_class = strategy_class
+        self.dataframe = dataframe
+        self.score = functools.partial(score, **kwargs) if len(kwargs) > 0 else score
+        self.workers = workers
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_database(cls, strategy_class, database, client_name:str, symbol:str, time_frame:typing.Union[str, None]=None, **kwargs):
+        return cls(strategy_class, database.get_data(client_name=client_name, symbol=symbol, time_frame=time_frame), **kwargs)
+
+    def grid(self, param_grid:typing.Dict[str, typing.List]) -> pd.DataFrame:
+        names = list(param_grid)
+        return self.run([dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])])
+
+    def random(self, space:typing.Dict[str, typing.Union[typing.List, typing.Tuple]], iterations:int, seed=0) -> pd.DataFrame:
+        # A list is sampled from, an (low, high) tuple of ints or floats is drawn uniformly (ints inclusive)
+        generator = np.random.default_rng(seed)
+        params = []
+
+        for _ in range(iterations):
+            sample = dict()
+            for name, values in space.items():
+                if isinstance(values, tuple) and isinstance(values[0], int):
+                    sample[name] = int(generator.integers(values[0], values[1] + 1))
+                elif isinstance(values, tuple):
+                    sample[name] = float(generator.uniform(values[0], values[1]))
+                else:
+                    sample[name] = values[generator.integers(len(values))]
+            params.append(sample)
+
+        return self.run(params)
+
+    def run(self, params:typing.List[typing.Dict]) -> pd.DataFrame:
+        block = np.empty((self.dataframe.shape[0], len(COLUMNS) + 1), dtype=np.float64)
+        block[:, 0] = self.dataframe.index.to_numpy().astype("datetime64[s]").view(np.int64).view(np.float64)
+        for i, column in enumerate(COLUMNS):
+            block[:, i + 1] = self.dataframe[column].to_numpy(dtype=np.float64)
+
+        memory = shared_memory.SharedMemory(create=True, size=max(1, block.nbytes))
+        batches = [params[i:i + self.batch_size] for i in range(0, len(params), self.batch_size)]
+
+        try:
+            np.ndarray(block.shape, dtype=np.float64, buffer=memory.buf)[:] = block
+            del block
+
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_attach, initargs=(memory.name, self.dataframe.shape[0], self.strategy_class, self.score)) as executor:
+                scores = list(itertools.chain.from_iterable(executor.map(_run_batch, batches)))
+        finally:
+            memory.close()
+            memory.unlink()
+
+        results = pd.DataFrame(params)
+        results["score"] = scores
+        return results.sort_values("score", ascending=False, kind="stable").reset_index(drop=True)
@@ -0,0 +1,157 @@
+import math
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Utility import Timestamp
+from Utility.Utility import forward_fill
+
+# BitMEX perpetual swap fees, a negative fee is a rebate
+MAKER_FEE = -0.00025
+TAKER_FEE = 0.00075
+
+SECONDS_PER_YEAR = 365 * 86400
+
+def signal_positions(buys:np.ndarray, sells:np.ndarray) -> np.ndarray:
+    # 1 from a buy signal to the next sell signal, 0 otherwise, down every column of 2D (time, symbol) arrays
+    positions = np.where(buys, 1.0, np.where(sells, 0.0, np.nan))
+    return np.nan_to_num(forward_fill(positions), nan=0.0)
+
+class Performance:
+    # Turns buy / sell signals into positions, net returns, an equity curve, trades and metrics with array operations.
+    # Positions are opened and closed at the close of the signal's bar. Every fill pays the maker or taker fee,
+    # taker fills also lose `slippage` of the price. 2D (time, symbol) arrays are one column per symbol: every symbol
+    # gets a sleeve of `weights` of the capital (equal by default) that compounds on its own, the equity is the sum
+    # of the sleeves plus the unallocated cash. rebalance=True brings the sleeves back to their weights on every bar
+    # instead, the traded difference pays the fees and slippage too.
+    def __init__(self, close:np.ndarray, buys:np.ndarray, sells:np.ndarray, dates:typing.Union[np.ndarray, None]=None, capital=1.0,
+                 maker=False, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE, slippage=0.0005, weights:typing.Union[np.ndarray, None]=None,
+                 rebalance=False, periods_per_year:typing.Union[float, None]=None):
+        close = np.asarray(close, dtype=np.float64)
+        self.is_portfolio = close.ndim == 2
+        # One column per symbol, a single series is one column
+        self.close = close if self.is_portfolio else close.reshape(-1, 1)
+        self.dates = np.asarray(dates, dtype=np.int64) if dates is not None else None
+        self.capital = capital
+        self.fee = maker_fee if maker else taker_fee
+        self.slippage = 0.0 if maker else slippage
+        self.weights = np.asarray(weights, dtype=np.float64) if weights is not None else np.full(self.close.shape[1], 1 / max(1, self.close.shape[1]))
+        self.rebalance = rebalance
+        self.periods_per_year = periods_per_year if periods_per_year is not None else self._periods_per_year()
+
+        self.positions = signal_positions(np.asarray(buys).reshape(self.close.shape), np.asarray(sells).reshape(self.close.shape))
+        # Fraction of a column's value paid on every bar, fee and slippage on the traded part
+        changes = np.abs(np.diff(self.positions, axis=0, prepend=0.0))
+        self.costs = changes * (self.fee + self.slippage)
+
+        # Missing candles carry the last close, so a gap's move lands on the bar after it
+        if np.isnan(self.close).any():
+            close = forward_fill(self.close)
+        else:
+            close = self.close
+
+        # Price return of every column on every bar, then net of the costs paid on that bar
+        self.gross_returns = np.zeros(self.close.shape)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.gross_returns[1:] = np.nan_to_num(self.positions[:-1] * (close[1:] / close[:-1] - 1), nan=0.0)
+        self.returns = (1 + self.gross_returns) * (1 - self.costs) - 1
+
+        if self.rebalance:
+            # Growth of the whole portfolio on a bar, the unallocated cash stays flat
+            step = 1 + self.returns @ self.weights
+            # Fraction of the equity traded to bring the held sleeves back to their weights
+            turnover = (self.positions * np.abs(step[:, np.newaxis] - (1 + self.returns))) @ self.weights
+            self.rebalance_costs = turnover * (self.fee + self.slippage)
+            equity = self.capital * np.cumprod(step - self.rebalance_costs)
+            self.sleeves = None
+        else:
+            self.rebalance_costs = np.zeros(self.close.shape[0])
+            self.sleeves = self.capital * np.cumprod(1 + self.returns, axis=0) * self.weights
+            equity = self.sleeves.sum(axis=1) + self.capital * (1 - self.weights.sum())
+
+        self.portfolio_returns = equity / np.concatenate([[self.capital], equity[:-1]]) - 1
+        index = Timestamp.to_datetime_index(self.dates) if self.dates is not None else None
+        self.equity = pd.Series(equity, index=index, name="equity")
+
+    @classmethod
+    def from_strategy(cls, strategy, **kwargs):
+        # Any strategy whose backtest() filled the buy_signal_price / sell_signal_price columns
+        dataframe = strategy.dataframe
+        dates = Timestamp.to_epoch(dataframe.index) if dataframe.index.dtype.kind in "iuM" else None
+
+        return cls(dataframe["close"].to_numpy(dtype=np.float64), ~np.isnan(dataframe["buy_signal_price"].to_numpy(dtype=np.float64)),
+                   ~np.isnan(dataframe["sell_signal_price"].to_numpy(dtype=np.float64)), dates=dates, **kwargs)
+
+    def _periods_per_year(self) -> float:
+        # From the median spacing of the bars, minute bars without dates
+        if self.dates is None or self.dates.shape[0] < 2:
+            return SECONDS_PER_YEAR / 60
+        spacing = float(np.median(np.diff(self.dates)))
+        return SECONDS_PER_YEAR / spacing if spacing > 0 else SECONDS_PER_YEAR / 60
+
+    def drawdown(self) -> pd.Series:
+        # Fraction below the running peak of the equity
+        equity = self.equity.to_numpy()
+        return pd.Series(equity / np.maximum.accumulate(equity) - 1, index=self.equity.index, name="drawdown")
+
+    def trades(self) -> pd.DataFrame:
+        # One row per round trip, a position still open at the last bar is closed there without paying the exit fee
+        bars = self.close.shape[0]
+        # Change of the position on every bar plus a close after the last bar
+        changes = np.diff(self.positions, axis=0, prepend=0.0, append=0.0)
+        entry_symbols, entries = np.nonzero(changes.T > 0)
+        exit_symbols, exits = np.nonzero(changes.T < 0)
+        # Entries and exits alternate in every column, so the n-th entry and exit of a column are one trade
+        is_open = exits == bars
+        exits = np.minimum(exits, bars - 1)
+
+        # Growth of every column, a trade's return is its growth from the bar before the entry to the exit
+        growth = np.vstack([np.ones((1, self.close.shape[1])), np.cumprod(1 + self.returns, axis=0)])
+        returns = growth[exits + 1, exit_symbols] / growth[entries, entry_symbols] - 1
+
+        trades = pd.DataFrame({
+            "entry": entries,
+            "exit": exits,
+            "entry_price": self.close[entries, entry_symbols],
+            "exit_price": self.close[exits, exit_symbols],
+            "bars": exits - entries,
+            "return": returns,
+            "open": is_open
+        })
+
+        if self.dates is not None:
+            trades.insert(0, "exit_date", Timestamp.to_datetime64(self.dates[exits]))
+            trades.insert(0, "entry_date", Timestamp.to_datetime64(self.dates[entries]))
+        if self.is_portfolio:
+            trades.insert(0, "symbol", entry_symbols)
+        return trades
+
+    def metrics(self) -> typing.Dict[str, float]:
+        returns = self.portfolio_returns
+        equity = self.equity.to_numpy()
+        trades = self.trades()
+        closed = trades[~trades["open"]]
+
+        deviation = returns.std() if returns.shape[0] > 1 else 0.0
+        previous_equity = np.concatenate([[self.capital], equity[:-1]])[:equity.shape[0]]
+
+        # Value of every sleeve before a bar, its costs are paid on that value after the bar's price move.
+        # Exposure is the held fraction of the equity
+        if self.rebalance:
+            previous_sleeves = previous_equity[:, np.newaxis] * self.weights
+            held = self.positions @ self.weights
+        else:
+            previous_sleeves = np.vstack([self.capital * self.weights, self.sleeves[:-1]])[:equity.shape[0]]
+            held = (self.positions * self.sleeves).sum(axis=1) / equity
+        fees = (previous_sleeves * (1 + self.gross_returns) * self.costs).sum() + previous_equity @ self.rebalance_costs
+
+        return {
+            "total_return": float(equity[-1] / self.capital - 1) if equity.shape[0] > 0 else 0.0,
+            "sharpe": float(returns.mean() / deviation * math.sqrt(self.periods_per_year)) if deviation > 0 else math.nan,
+            "max_drawdown": float(self.drawdown().min()) if equity.shape[0] > 0 else 0.0,
+            "win_rate": float((closed["return"] > 0).mean()) if closed.shape[0] > 0 else math.nan,
+            "exposure": float(held.mean()) if equity.shape[0] > 0 else 0.0,
+            "trades": int(trades.shape[0]),
+            "fees": float(fees)
+        }
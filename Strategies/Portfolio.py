@@ -0,0 +1,95 @@
+import typing
+
+import numpy as np
+import pandas as pd
+
+from Strategies.Performance import Performance
+from Utility import Timestamp
+
+def align_candles(candles:typing.Dict[str, pd.DataFrame], columns:typing.List[str]) -> typing.Tuple[np.ndarray, typing.Dict[str, np.ndarray]]:
+    # (int64 epoch dates, column -> (time, symbol) float64 array) on the union of the dates of every symbol.
+    # Bars a symbol has no candle for are NaN.
+    epochs = [Timestamp.to_epoch(dataframe.index) for dataframe in candles.values()]
+    dates = np.unique(np.concatenate(epochs)) if len(epochs) > 0 else np.empty(0, dtype=np.int64)
+    aligned = { column: np.full((dates.shape[0], len(epochs)), np.nan) for column in columns }
+
+    for i, (dataframe, symbol_dates) in enumerate(zip(candles.values(), epochs)):
+        rows = np.searchsorted(dates, symbol_dates)
+        for column in columns:
+            aligned[column][rows, i] = dataframe[column].to_numpy(dtype=np.float64)
+
+    return dates, aligned
+
+class Portfolio:
+    # Backtests one strategy on many symbols at once. The candles are aligned into (time, symbol) arrays and the
+    # strategy's portfolio_signals runs on every column in one vectorized pass instead of one backtest per symbol.
+    # Every symbol is long from a buy to the next sell with `weights` of the capital (equal by default, or
+    # "inverse_volatility"), the rest of the capital stays in cash. Fees, slippage and metrics come from Performance.
+    def __init__(self, strategy_class, candles:typing.Dict[str, pd.DataFrame], weights:typing.Union[typing.Dict[str, float], str, None]=None,
+                 capital=1.0, columns:typing.Union[typing.List[str], None]=None, **params):
+        self.strategy_class = strategy_class
+        self.symbols = list(candles)
+        self.capital = capital
+        self.params = params
+
+        columns = list(columns if columns is not None else strategy_class.columns)
+        if "close" not in columns:
+            columns.append("close")
+        self.dates, self.candles = align_candles(candles, columns)
+        self.weights = self._weights(weights)
+
+        self.buys, self.sells = None, None
+        self.performance = None
+
+    @classmethod
+    def from_database(cls, strategy_class, database, client_name:str, symbols:typing.List[str], time_frame:typing.Union[str, None]=None, **kwargs):
+        # Symbols without stored data are left out. Only the columns the strategy reads are loaded
+        columns = list(kwargs.get("columns") or strategy_class.columns)
+        columns += ["close"] if "close" not in columns else []
+        candles = dict()
+        for symbol in symbols:
+            dataframe = database.get_data(client_name=client_name, symbol=symbol, time_frame=time_frame, columns=columns)
+            if dataframe is not None:
+                candles[symbol] = dataframe
+        return cls(strategy_class, candles, **kwargs)
+
+    def _weights(self, weights:typing.Union[typing.Dict[str, float], str, None]) -> np.ndarray:
+        if weights is None:
+            return np.full(len(self.symbols), 1 / max(1, len(self.symbols)))
+
+        if weights == "inverse_volatility":
+            close = self.candles["close"]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                volatility = np.nanstd(close[1:] / close[:-1] - 1, axis=0) if close.shape[0] > 1 else np.full(close.shape[1], np.nan)
+            inverse = np.where(volatility > 0, 1 / volatility, 0.0)
+            return inverse / inverse.sum() if inverse.sum() > 0 else np.full(len(self.symbols), 1 / max(1, len(self.symbols)))
+
+        return np.array([weights.get(symbol, 0.0) for symbol in self.symbols], dtype=np.float64)
+
+    def backtest(self, **kwargs) -> pd.Series:
+        # kwargs go to Performance (fees, slippage, maker, rebalance, ...)
+        self.buys, self.sells = self.strategy_class.portfolio_signals(self.candles, **self.params)
+        self.performance = Performance(self.candles["close"], self.buys, self.sells, dates=self.dates, capital=self.capital, weights=self.weights, **kwargs)
+        return self.performance.equity
+
+    def metrics(self) -> typing.Dict[str, float]:
+        return self.performance.metrics()
+
+    def summary(self) -> pd.DataFrame:
+        # One row per symbol
+        performance = self.performance
+        trades = performance.trades()
+        closed = trades[~trades["open"]]
+        wins = np.bincount(closed["symbol"], weights=closed["return"] > 0, minlength=len(self.symbols))
+        closed_count = np.bincount(closed["symbol"], minlength=len(self.symbols))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            win_rate = wins / closed_count
+
+        return pd.DataFrame({
+            "weight": self.weights,
+            "trades": np.bincount(trades["symbol"], minlength=len(self.symbols)),
+            "total_return": np.prod(1 + performance.returns, axis=0) - 1,
+            "win_rate": win_rate,
+            "exposure": performance.positions.mean(axis=0) if performance.positions.shape[0] > 0 else np.zeros(len(self.symbols))
+        }, index=pd.Index(self.symbols, name="symbol"))
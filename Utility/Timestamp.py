@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# Canonical time representation shared by the connectors, Database and the strategies:
+# int64 seconds since the unix epoch, always UTC.
+EPOCH_UNIT = "s"
+
+# Format of the legacy csv files and of the dates given to Client.get_historical_data
+LEGACY_FORMAT = "%Y-%m-%dT%H:%M.%SZ"
+
+def now() -> int:
+    return int(time.time())
+
+def to_epoch(values) -> np.ndarray:
+    # Converts a whole array of epoch ints, datetime64s, datetimes or date strings (legacy or ISO) to int64 epoch seconds.
+    # Naive datetimes and strings without an offset are taken as UTC.
+    values = pd.Index(values)
+
+    if values.dtype.kind in "iuf":
+        return values.to_numpy(dtype=np.int64)
+
+    if values.dtype.kind != "M":
+        converted = pd.to_datetime(values, format=LEGACY_FORMAT, utc=True, errors="coerce")
+        if converted.isna().any():
+            converted = pd.to_datetime(values, utc=True, format="ISO8601")
+        values = converted
+
+    if values.tz is not None:
+        values = values.tz_convert("UTC").tz_localize(None)
+
+    return values.as_unit(EPOCH_UNIT).asi8
+
+def to_datetime64(epochs) -> np.ndarray:
+    # Zero-copy view of int64 epoch seconds as datetime64[s]
+    return np.asarray(epochs, dtype=np.int64).view("datetime64[" + EPOCH_UNIT + "]")
+
+def to_datetime_index(epochs, name="date") -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(to_datetime64(epochs), name=name)
+
+def to_str(epochs, format=LEGACY_FORMAT) -> np.ndarray:
+    return to_datetime_index(epochs).strftime(format).to_numpy()
+
+def ensure_datetime_index(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # Frames indexed by int64 epochs get a datetime index (a view, nothing is parsed) for resampling and plotting
+    if dataframe.index.dtype.kind in "iu":
+        dataframe = dataframe.set_axis(to_datetime_index(dataframe.index, name=dataframe.index.name), axis=0)
+    return dataframe
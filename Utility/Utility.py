@@ -1,33 +1,148 @@
+import typing
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
+
+from Utility import Timestamp
 
 time_frames = {
-    "1m" : "1T",
-    "3m" : "3T",
-    "5m" : "5T",
-    "10m" : "10T",
-    "15m" : "15T",
-    "30m" : "30T",
-    "45m" : "45T",
+    "1m" : "1min",
+    "3m" : "3min",
+    "5m" : "5min",
+    "10m" : "10min",
+    "15m" : "15min",
+    "30m" : "30min",
+    "45m" : "45min",
     "1h" : "60min",
     "2h" : "120min",
     "4h" : "240min",
     "1D" : "1D",
     "W"  : "W",
-    "M"  : "M",
-    "Q"  : "Q"
+    "M"  : "ME",
+    "Q"  : "QE"
 }
 
 def resample_dataframe(df: pd.DataFrame, time_frame:str):
+    df = Timestamp.ensure_datetime_index(df)
     return df.resample(time_frames[time_frame]).agg({'open':'first', 'high':'max', 'low':'min', 'close':'last', 'volume':'sum'})
 
+# Single value helpers, kept for existing callers. They are UTC based, see Utility.Timestamp for whole arrays.
 def str2int64time(date:str):
-    date_str = datetime.strptime(date, "%Y-%m-%dT%H:%M.%SZ")    
-    return int(datetime.timestamp(date_str))
+    return int(Timestamp.to_epoch([date])[0])
 
 def datetime2str(date:datetime):
-    return datetime.strftime(date, "%Y-%m-%dT%H:%M.%SZ")
+    return datetime.strftime(date, Timestamp.LEGACY_FORMAT)
 
 def int64time2str(date:int):
-    date_time = datetime.fromtimestamp(date)
-    return date_time.strftime("%Y-%m-%dT%H:%M.%SZ")
\ No newline at end of file
+    date_time = datetime.fromtimestamp(date, timezone.utc)
+    return date_time.strftime(Timestamp.LEGACY_FORMAT)
+
+# Length of the time frames whose buckets line up with the epoch (and with midnight, like resample_dataframe)
+time_frame_seconds = {
+    "1m" : 60,
+    "3m" : 180,
+    "5m" : 300,
+    "10m" : 600,
+    "15m" : 900,
+    "30m" : 1800,
+    "45m" : 2700,
+    "1h" : 3600,
+    "2h" : 7200,
+    "4h" : 14400,
+    "1D" : 86400
+}
+
+def resample_candles(df: pd.DataFrame, seconds:int) -> pd.DataFrame:
+    # Array version of resample_dataframe for frames with a sorted int64 epoch index.
+    # Only buckets with candles are returned, fill_candle_gaps adds the empty ones.
+    # The same aggregation works on already resampled candles, so coarse frames can be built from finer ones.
+    dates = df.index.to_numpy(dtype=np.int64)
+    
+    if dates.shape[0] == 0:
+        return df.iloc[:0][["open", "high", "low", "close", "volume"]]
+    
+    buckets = dates - dates % seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    positions = np.arange(dates.shape[0])
+    
+    def first_valid(values:np.ndarray, last=False) -> np.ndarray:
+        # first / last non NaN value of every bucket, like pandas' first and last
+        valid = ~np.isnan(values)
+        if last:
+            index = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+        else:
+            index = np.minimum.reduceat(np.where(valid, positions, dates.shape[0]), starts)
+        found = (index >= 0) & (index < dates.shape[0])
+        return np.where(found, values[np.clip(index, 0, dates.shape[0] - 1)], np.nan)
+    
+    high = df["high"].to_numpy(dtype=np.float64)
+    low = df["low"].to_numpy(dtype=np.float64)
+    
+    columns = {
+        "open": first_valid(df["open"].to_numpy(dtype=np.float64)),
+        "high": np.fmax.reduceat(high, starts),
+        "low": np.fmin.reduceat(low, starts),
+        "close": first_valid(df["close"].to_numpy(dtype=np.float64), last=True),
+        "volume": np.add.reduceat(np.nan_to_num(df["volume"].to_numpy(dtype=np.float64)), starts)
+    }
+    return pd.DataFrame(columns, index=pd.Index(buckets[starts], name=df.index.name), copy=False)
+
+def fill_candle_gaps(df: pd.DataFrame, seconds:int) -> pd.DataFrame:
+    # Adds the empty buckets between the first and last candle, NaN prices and 0 volume like resample_dataframe
+    dates = df.index.to_numpy(dtype=np.int64)
+    
+    if dates.shape[0] == 0:
+        return df
+    
+    full = np.arange(dates[0], dates[-1] + seconds, seconds, dtype=np.int64)
+    if full.shape[0] == dates.shape[0]:
+        return df
+    
+    df = df.reindex(pd.Index(full, name=df.index.name))
+    df["volume"] = df["volume"].fillna(0.0)
+    return df
+
+def reusable_array(buffers:typing.Union[typing.Dict[str, np.ndarray], None], name:str, shape:typing.Tuple, dtype=np.float64) -> np.ndarray:
+    # Uninitialized array, the one a previous run left in `buffers` under `name` when the shape and dtype match.
+    # Without buffers it's np.empty. The strategies' `buffers` argument is such a dict: give the same one to every
+    # run of a sweep (e.g. one per optimizer worker) and each run writes its arrays and signal columns into the
+    # previous run's, which are overwritten.
+    if buffers is None:
+        return np.empty(shape, dtype=dtype)
+    
+    array = buffers.get(name)
+    if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+        array = buffers[name] = np.empty(shape, dtype=dtype)
+    return array
+
+def rolling_max(values:np.ndarray, window:int, out:typing.Union[np.ndarray, None]=None) -> np.ndarray:
+    # Max of the last `window` values at every position in O(n) (van Herk / Gil-Werman), NaNs are skipped.
+    # Same as pd.Series(values).rolling(window, min_periods=1).max(), a 2D array is rolled down every column at once.
+    return _rolling_extreme(np.asarray(values, dtype=np.float64), window, np.fmax, out)
+
+def rolling_min(values:np.ndarray, window:int, out:typing.Union[np.ndarray, None]=None) -> np.ndarray:
+    return _rolling_extreme(np.asarray(values, dtype=np.float64), window, np.fmin, out)
+
+def _rolling_extreme(values:np.ndarray, window:int, function, out:typing.Union[np.ndarray, None]=None) -> np.ndarray:
+    count = values.shape[0]
+    result = out if out is not None else np.empty(values.shape)
+    
+    if count == 0:
+        return result
+    
+    # Running extreme from the start of every block of `window` values (prefix) and to its end (suffix),
+    # a window always covers the suffix of one block and the prefix of the next one.
+    blocks = np.concatenate([values, np.full((-count % window,) + values.shape[1:], np.nan)]).reshape((-1, window) + values.shape[1:])
+    prefix = function.accumulate(blocks, axis=1).reshape((-1,) + values.shape[1:])[:count]
+    suffix = function.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape((-1,) + values.shape[1:])[:count]
+    
+    result[:window - 1] = function.accumulate(values[:window - 1], axis=0)
+    ends = np.arange(window - 1, count)
+    result[window - 1:] = function(suffix[ends - window + 1], prefix[ends])
+    return result
+
+def forward_fill(values:np.ndarray) -> np.ndarray:
+    # Carries the last non NaN value down every column, like DataFrame.ffill
+    rows = np.where(np.isnan(values), 0, np.arange(values.shape[0]).reshape((-1,) + (1,) * (values.ndim - 1)))
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return np.take_along_axis(values, rows, axis=0)
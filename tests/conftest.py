@@ -0,0 +1,11 @@
+import numpy as np
+import pytest
+
+@pytest.fixture
+def memmap_of():
+    # The np.memmap an array is a view of, None when it was copied into memory
+    def memmap_of(array:np.ndarray):
+        while array is not None and not isinstance(array, np.memmap):
+            array = array.base
+        return array
+    return memmap_of
@@ -0,0 +1,83 @@
+import os.path
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Benchmark import Synthetic
+from Database.Database import Database, compact_dataframe, fix_legacy_kucoin_columns
+from Database.Storage import COLUMNS, NpyStorage
+from Utility.Utility import resample_candles, time_frames
+
+# Written by the old KuCoin parser
+LEGACY_KUCOIN_CSV = os.path.join(os.path.dirname(__file__), "..", "Data", "Kucoin_ETH-USDT.csv")
+
+def test_compact_dataframe_keeps_unconverted_columns_mapped(tmp_path, memmap_of):
+    storage = NpyStorage(str(tmp_path) + "/")
+    storage.write("Test_SYN", Synthetic.generate_candles(1000))
+
+    dataframe = compact_dataframe(storage.read("Test_SYN"), columns=["open", "close", "volume"], dtype=np.float32)
+    assert list(dataframe.columns) == ["open", "close", "volume"]
+    assert dataframe["close"].dtype == np.float32 and memmap_of(dataframe["close"].to_numpy()) is None
+    # The volume isn't converted without a volume_scale, so it stays a view of the stored file
+    memmap = memmap_of(dataframe["volume"].to_numpy())
+    assert memmap is not None and memmap.filename == storage._column_path("Test_SYN", "volume")
+
+def test_legacy_kucoin_csv_is_imported_with_real_columns(tmp_path):
+    database = Database(str(tmp_path) + "/")
+    shutil.copy(LEGACY_KUCOIN_CSV, str(tmp_path))
+    legacy = database.csv.read("Kucoin_ETH-USDT")
+
+    assert database.migrate_csv_files() == ["Kucoin_ETH-USDT"]
+    stored = database.get_data("Kucoin", "ETH-USDT", datetime_index=False)
+    assert (stored["low"] <= stored["high"]).all()
+    assert np.array_equal(stored["close"].to_numpy(), legacy["high"].to_numpy())
+    # Correctly mapped files, e.g. exported ones, are imported as they are
+    database.export_csv("Kucoin", "ETH-USDT")
+    assert database.csv.read("Kucoin_ETH-USDT").equals(fix_legacy_kucoin_columns(database.csv.read("Kucoin_ETH-USDT")))
+
+def test_legacy_kucoin_store_is_repaired(tmp_path):
+    database = Database(str(tmp_path) + "/")
+    shutil.copy(LEGACY_KUCOIN_CSV, str(tmp_path))
+    legacy = database.csv.read("Kucoin_ETH-USDT")
+    # Imported unchanged by an older version, then one newer candle downloaded
+    newer = pd.DataFrame({ column: [1.0] for column in COLUMNS }, index=pd.Index([int(legacy.index[-1]) + 60], name="date"))
+    database.storage.write("Kucoin_ETH-USDT", pd.concat([legacy, newer]))
+
+    assert database.migrate_csv_files() == []
+    stored = database.get_data("Kucoin", "ETH-USDT", datetime_index=False)
+    assert (stored["low"] <= stored["high"]).all()
+    assert np.array_equal(stored["close"].to_numpy()[:-1], legacy["high"].to_numpy())
+    assert stored.iloc[-1].tolist() == [1.0] * len(COLUMNS)
+
+@pytest.mark.parametrize("time_frame", list(time_frames))
+def test_get_data_every_time_frame(tmp_path, time_frame):
+    database = Database(str(tmp_path) + "/")
+    candles = Synthetic.generate_candles(200 * 1440, interval=60)
+    database.storage.write("Test_SYN", candles)
+
+    resampled = database.get_data("Test", "SYN", time_frame=time_frame)
+    assert resampled.shape[0] > 0
+    assert np.isclose(resampled["volume"].sum(), candles["volume"].sum())
+
+def test_cached_resample_reads_are_read_only(tmp_path):
+    database = Database(str(tmp_path) + "/")
+    candles = Synthetic.generate_candles(20 * 1440, interval=60)
+    database.storage.write("Test_SYN", candles.iloc[:-30])
+
+    first = database.get_data("Test", "SYN", time_frame="1h", datetime_index=False)
+    cache_file = database.storage._column_path("Test_SYN.1h", "close")
+    modified = os.path.getmtime(cache_file)
+    assert database.get_data("Test", "SYN", time_frame="1h", datetime_index=False).equals(first)
+    assert os.path.getmtime(cache_file) == modified
+
+    # New raw candles are still picked up
+    database.storage.write("Test_SYN", candles)
+    updated = database.get_data("Test", "SYN", time_frame="1h", datetime_index=False)
+    assert np.array_equal(updated.to_numpy(), resample_candles(candles, 3600).to_numpy())
+
+def test_empty_store_with_time_frame(tmp_path):
+    database = Database(str(tmp_path) + "/")
+    database.storage.write("Test_SYN", Synthetic.generate_candles(10).iloc[:0])
+    assert database.get_data("Test", "SYN", time_frame="1h").shape[0] == 0
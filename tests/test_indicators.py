@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Strategies.Indicators import EMA, MACD, RollingMax, RollingMin
+from Utility.Utility import rolling_max, rolling_min
+
+def _values(seed:int, rows=2000) -> np.ndarray:
+    # A random walk with NaN gaps, including a run of NaNs at the start
+    generator = np.random.default_rng(seed)
+    values = 100 + np.cumsum(generator.normal(size=rows))
+    values[generator.random(rows) < 0.05] = np.nan
+    values[:3] = np.nan
+    return values
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [1, 2, 7, 100, 5000])
+def test_rolling_extremes_match_pandas(seed, window):
+    values = _values(seed)
+    rolling = pd.Series(values).rolling(window, min_periods=1)
+    np.testing.assert_array_equal(rolling_max(values, window), rolling.max().to_numpy())
+    np.testing.assert_array_equal(rolling_min(values, window), rolling.min().to_numpy())
+
+    # Every column of a 2D array is rolled on its own
+    columns = np.column_stack([values, _values(seed + 100)])
+    expected = pd.DataFrame(columns).rolling(window, min_periods=1).max().to_numpy()
+    np.testing.assert_array_equal(rolling_max(columns, window), expected)
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("warm_up_rows", [0, 1, 500])
+def test_ema_and_macd_match_pandas(seed, warm_up_rows):
+    values = _values(seed)
+    fast = pd.Series(values).ewm(span=12, adjust=False).mean()
+    slow = pd.Series(values).ewm(span=26, adjust=False).mean()
+    signal_line = (fast - slow).ewm(span=9, adjust=False).mean()
+
+    ema, macd = EMA(12), MACD()
+    np.testing.assert_allclose(ema.warm_up(values[:warm_up_rows]), fast.to_numpy()[:warm_up_rows], rtol=1e-12)
+    macd.warm_up(values[:warm_up_rows])
+    updates = np.array([macd.update(value) for value in values[warm_up_rows:].tolist()]).reshape(-1, 2)
+
+    np.testing.assert_allclose([ema.update(value) for value in values[warm_up_rows:].tolist()], fast.to_numpy()[warm_up_rows:], rtol=1e-12)
+    np.testing.assert_allclose(updates[:, 0], (fast - slow).to_numpy()[warm_up_rows:], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(updates[:, 1], signal_line.to_numpy()[warm_up_rows:], rtol=1e-9, atol=1e-12)
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("window", [None, 1, 7, 100])
+@pytest.mark.parametrize("warm_up_rows", [0, 1, 500])
+def test_online_rolling_extremes_match_batch(seed, window, warm_up_rows):
+    values = _values(seed)
+    batch_window = window if window is not None else values.shape[0]
+
+    for indicator, batch in ((RollingMax(window), rolling_max), (RollingMin(window), rolling_min)):
+        expected = batch(values, batch_window)
+        # Without a window the warm up rolls over all the history it's given
+        warm_up_window = window if window is not None else max(1, warm_up_rows)
+        np.testing.assert_array_equal(indicator.warm_up(values[:warm_up_rows]), batch(values[:warm_up_rows], warm_up_window))
+        np.testing.assert_array_equal([indicator.update(value) for value in values[warm_up_rows:].tolist()], expected[warm_up_rows:])
@@ -0,0 +1,37 @@
+import numpy as np
+
+from Benchmark import Synthetic
+from Database.Storage import COLUMNS, NpyStorage
+
+def test_npy_read_is_zero_copy(tmp_path, memmap_of):
+    storage = NpyStorage(str(tmp_path) + "/")
+    storage.write("Test_SYN", Synthetic.generate_candles(1000))
+
+    dataframe = storage.read("Test_SYN")
+    for column in COLUMNS:
+        values = dataframe[column].to_numpy()
+        memmap = memmap_of(values)
+        assert memmap is not None and memmap.filename == storage._column_path("Test_SYN", column)
+        assert np.shares_memory(values, memmap)
+
+def test_npy_read_is_copy_on_write(tmp_path):
+    storage = NpyStorage(str(tmp_path) + "/")
+    candles = Synthetic.generate_candles(10)
+    storage.write("Test_SYN", candles)
+
+    dataframe = storage.read("Test_SYN")
+    dataframe.loc[dataframe.index[0], "close"] = -1.0
+    assert storage.read("Test_SYN")["close"].iloc[0] == candles["close"].iloc[0]
+
+def test_npy_append_streams_chunks(tmp_path):
+    storage = NpyStorage(str(tmp_path) + "/")
+    candles = Synthetic.generate_candles(5000)
+
+    for start in range(0, 5000, 1000):
+        storage.append("Test_SYN", candles.iloc[start:start + 1000])
+    # A repeated last candle replaces the stored one
+    storage.append("Test_SYN", candles.iloc[-1:])
+
+    stored = storage.read("Test_SYN")
+    assert np.array_equal(stored.index.to_numpy(), candles.index.to_numpy())
+    assert np.array_equal(stored[COLUMNS].to_numpy(), candles[COLUMNS].to_numpy())
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Benchmark import Synthetic
+from Strategies.FibonacciRetracement import FibonacciRetracement, FibonacciRetracementRunner
+from Strategies.HeikinAshi import HeikinAshi, HeikinAshiRunner
+
+def _candles(seed:int, rows=3000, dtype=np.float64) -> pd.DataFrame:
+    # Random candles with NaN prices in a few percent of the bars
+    candles = Synthetic.generate_candles(rows, seed=seed, volatility=0.003)
+    generator = np.random.default_rng(seed)
+    for column in ["open", "high", "low", "close"]:
+        candles.loc[candles.index[generator.random(rows) < 0.02], column] = np.nan
+    return candles.astype(dtype)
+
+def _fibonacci_loop(dataframe:pd.DataFrame):
+    # The row by row FibonacciRetracement.backtest this replaced, with the per bar lookups on arrays
+    prices = dataframe["close"].to_numpy()
+    fast_ema = dataframe["close"].ewm(span=12, adjust=False).mean()
+    slow_ema = dataframe["close"].ewm(span=26, adjust=False).mean()
+    macd = (fast_ema - slow_ema).to_numpy()
+    signal_line = (fast_ema - slow_ema).ewm(span=9, adjust=False).mean().to_numpy()
+
+    max_price = dataframe["close"].max()
+    min_price = dataframe["close"].min()
+    min_max_diff = max_price - min_price
+    first_level  = max_price - min_max_diff * 0.236
+    second_level = max_price - min_max_diff * 0.382
+    third_level  = max_price - min_max_diff * 0.5
+    fourth_level = max_price - min_max_diff * 0.618
+
+    def get_fib_lvls_for_price(price):
+        if price >= first_level:
+            return (max_price, first_level)
+        elif price >= second_level:
+            return (first_level, second_level)
+        elif price >= third_level:
+            return (second_level, third_level)
+        elif price >= fourth_level:
+            return (third_level, fourth_level)
+        else:
+            return (fourth_level, min_price)
+
+    buy_list, sell_list = [], []
+    flag, last_buy_price = 0, 0
+    upper_level, lower_level = None, None
+
+    for index in range(0, prices.shape[0]):
+        price = prices[index]
+        if index == 0:
+            upper_level, lower_level = get_fib_lvls_for_price(price)
+            buy_list.append(np.nan)
+            sell_list.append(np.nan)
+        elif price >= upper_level or price <= lower_level:
+            if signal_line[index] > macd[index] and flag == 0:
+                last_buy_price = price
+                buy_list.append(price)
+                sell_list.append(np.nan)
+                flag = 1
+            elif signal_line[index] < macd[index] and flag == 1 and price >= last_buy_price:
+                buy_list.append(np.nan)
+                sell_list.append(price)
+                flag = 0
+            else:
+                buy_list.append(np.nan)
+                sell_list.append(np.nan)
+        else:
+            buy_list.append(np.nan)
+            sell_list.append(np.nan)
+
+        upper_level, lower_level = get_fib_lvls_for_price(price)
+
+    return np.array(buy_list, dtype=np.float64), np.array(sell_list, dtype=np.float64)
+
+def _heikin_ashi_loop(dataframe:pd.DataFrame):
+    # The row by row HeikinAshi.backtest this replaced
+    prices = dataframe["close"].to_numpy()
+    heikin_open = ((dataframe["open"].shift(-1) + dataframe["close"].shift(-1)) / 2).to_numpy()
+    heikin_close = ((dataframe["open"] + dataframe["close"] + dataframe["high"] + dataframe["low"]) / 4).to_numpy()
+    signals = pd.Series(np.where(heikin_close < heikin_open, 1, -1)).shift(1).to_numpy()
+
+    buy_prices, sell_prices = [], []
+    for index in range(0, prices.shape[0]):
+        price = prices[index]
+        if index != 0 and signals[index - 1] != signals[index]:
+            buy_prices.append(price if signals[index] == 1 else np.nan)
+            sell_prices.append(price if signals[index] == -1 else np.nan)
+        else:
+            buy_prices.append(np.nan)
+            sell_prices.append(np.nan)
+
+    return np.array(buy_prices, dtype=np.float64), np.array(sell_prices, dtype=np.float64)
+
+def _signal_prices(strategy):
+    return tuple(strategy.dataframe[column].to_numpy(dtype=np.float64) for column in ("buy_signal_price", "sell_signal_price"))
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("seed", range(10))
+def test_fibonacci_backtest_matches_loop(seed, dtype):
+    candles = _candles(seed, dtype=dtype)
+    strategy = FibonacciRetracement(candles.copy())
+    strategy.backtest()
+
+    for result, expected in zip(_signal_prices(strategy), _fibonacci_loop(candles)):
+        np.testing.assert_array_equal(result, expected)
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("seed", range(10))
+def test_heikin_ashi_backtest_matches_loop(seed, dtype):
+    candles = _candles(seed, dtype=dtype)
+    strategy = HeikinAshi(candles.copy())
+    strategy.backtest()
+
+    for result, expected in zip(_signal_prices(strategy), _heikin_ashi_loop(candles)):
+        np.testing.assert_array_equal(result, expected)
+
+@pytest.mark.parametrize("warm_up_rows", [0, 1, 2, 700])
+def test_fibonacci_runner_matches_backtest(warm_up_rows):
+    candles = _candles(1, rows=2000)
+    strategy = FibonacciRetracement(candles.copy(), lookback=300)
+    strategy.backtest()
+    buys, sells = _signal_prices(strategy)
+
+    runner = FibonacciRetracementRunner(lookback=300)
+    runner.warm_up(candles.iloc[:warm_up_rows])
+    updates = np.array([runner.update(price) for price in candles["close"].to_numpy()[warm_up_rows:].tolist()]).reshape(-1, 2)
+
+    np.testing.assert_array_equal(updates[:, 0], buys[warm_up_rows:])
+    np.testing.assert_array_equal(updates[:, 1], sells[warm_up_rows:])
+
+@pytest.mark.parametrize("warm_up_rows", [0, 1, 2, 3, 700])
+def test_heikin_ashi_runner_matches_backtest(warm_up_rows):
+    candles = _candles(2, rows=2000)
+    strategy = HeikinAshi(candles.copy())
+    strategy.backtest()
+    buys, sells = _signal_prices(strategy)
+
+    runner = HeikinAshiRunner()
+    runner.warm_up(candles.iloc[:warm_up_rows])
+    rows = candles[["open", "high", "low", "close"]].to_numpy()[warm_up_rows:].tolist()
+    updates = np.array([runner.update(*row) for row in rows]).reshape(-1, 2)
+
+    np.testing.assert_array_equal(updates[:, 0], buys[warm_up_rows:])
+    np.testing.assert_array_equal(updates[:, 1], sells[warm_up_rows:])
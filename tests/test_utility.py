@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from Benchmark import Synthetic
+from Utility.Utility import resample_dataframe, time_frames
+
+@pytest.mark.parametrize("time_frame", list(time_frames))
+def test_resample_dataframe_every_time_frame(time_frame):
+    # Two hundred days of minute candles cover a few quarters
+    candles = Synthetic.generate_candles(200 * 1440, interval=60)
+    resampled = resample_dataframe(candles, time_frame)
+
+    assert resampled.shape[0] > 0
+    assert np.isclose(resampled["volume"].sum(), candles["volume"].sum())
+    assert resampled["high"].max() == candles["high"].max() and resampled["low"].min() == candles["low"].min()